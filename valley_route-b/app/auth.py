@@ -16,14 +16,15 @@ from typing import Annotated
 # Third-party imports
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from starlette import status
 
 # Local imports (project-specific)
-from app.database import SessionLocal
+from app.database import AsyncSessionLocal
 from app.models import User
 from app.schemas import UserReset
 
@@ -72,25 +73,22 @@ class Token(BaseModel):
     token_type: str
 
 
-def get_db():
+async def get_db():
     """
-    Dependency function to get a database session.
+    Dependency function to get an asynchronous database session.
 
     Args:
     - None
 
     Returns:
-    - db (Session): The database session.
+    - db (AsyncSession): The database session.
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 # Define a dependency to get the database session
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
@@ -104,7 +102,7 @@ async def create_user(user: CreateUserRequest, db: db_dependency):
         user: (CreateUserRequest): The request body containing the user data,
         first name, last name, email, and password.
 
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
 
     Returns:
         None
@@ -114,7 +112,8 @@ async def create_user(user: CreateUserRequest, db: db_dependency):
     """
 
     # Check if the email is already registered
-    db_user = db.query(User).filter(User.email == user.email).first()
+    result = await db.execute(select(User).where(User.email == user.email))
+    db_user = result.scalars().first()
     if db_user:
         # Return an error if the email is already registered
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
@@ -126,8 +125,8 @@ async def create_user(user: CreateUserRequest, db: db_dependency):
 
     # Add the user to the database
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
 
 
 @router.post("/token", response_model=Token)
@@ -136,7 +135,7 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
     Authenticate a user and generate an access token. This endpoint authenticates a user
     Args:
         form_data: (OAuth2PasswordRequestForm): The form data containing the username and password.
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
 
     Returns:
         (Token): The access token and token type.
@@ -146,7 +145,7 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
     """
 
     # Authenticate the user
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         # Return an error if the email or password is incorrect
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
@@ -170,7 +169,7 @@ async def reset_password(body: UserReset, db: db_dependency):
     by providing their email address and a new password.
     Args:
         body: (UserReset): The request body containing the user's email and new password.
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
 
     Returns:
         (dict): A message indicating that the password was reset successfully.
@@ -180,7 +179,8 @@ async def reset_password(body: UserReset, db: db_dependency):
     """
 
     # Check if the user exists
-    user = db.query(User).filter(User.email == body.email).first()
+    result = await db.execute(select(User).where(User.email == body.email))
+    user = result.scalars().first()
     if not user:
         # Return an error if the user is not found
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -188,17 +188,17 @@ async def reset_password(body: UserReset, db: db_dependency):
     # Hash the new password
     hashed_password = bcrypt_context.hash(body.new_password)
     user.hashed_password = hashed_password
-    db.commit()
+    await db.commit()
     return {"message": "Password reset successfully"}
 
 
-def authenticate_user(db: Session, email: str, password: str):
+async def authenticate_user(db: AsyncSession, email: str, password: str):
     """
     Authenticate a user. This function authenticates a user by email and password.
     If the user is found and the password is correct, the user object is returned;
     otherwise, False is returned.
     Args:
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
         email: (str): The email address of the user.
         password: (str): The password of the user.
 
@@ -207,7 +207,8 @@ def authenticate_user(db: Session, email: str, password: str):
         the password is correct; otherwise, False.
 
     """
-    user = db.query(User).filter(User.email == email).first()
+    result = await db.execute(select(User).where(User.email == email))
+    user = result.scalars().first()
 
     # Check if the user exists and the password is correct
     if not user:
@@ -235,14 +236,14 @@ def create_access_token(data: dict, expires_delta: timedelta):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_current_user(token: Annotated[str, Depends(oauth2_bearer)], db: db_dependency):
+async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)], db: db_dependency):
     """
     Get the current user from the access token. This function decodes the access token
     and retrieves the user object from the database based on the email address in the token.
 
     Args:
         token: (str): The access token.
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
 
     Returns:
         (User): The user object if the token is valid and the user is found;
@@ -269,7 +270,8 @@ def get_current_user(token: Annotated[str, Depends(oauth2_bearer)], db: db_depen
         # Raise an exception if the token is invalid
         raise credentials_exception
     # Get the user from the database based on the email address
-    user = db.query(User).filter(User.email == email).first()
+    result = await db.execute(select(User).where(User.email == email))
+    user = result.scalars().first()
     if user is None:
         # Raise an exception if the user is not found
         raise credentials_exception
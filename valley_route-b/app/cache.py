@@ -0,0 +1,134 @@
+"""
+This module contains the cache of computed routes.
+It includes the following:
+- The RouteCache class, a bounded LRU cache of routes keyed by start node, end node and graph version
+- The process-level route_cache instance used by the route engine
+"""
+
+# Standard library imports
+import os
+import threading
+from collections import OrderedDict
+
+# Maximum number of routes kept in the cache
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "10000"))
+
+
+class RouteCache:
+    """
+    RouteCache keeps the most recently used routes. The graph is undirected, so a route and its reverse
+    share the same entry. Entries of older graph versions can never be hit again, so they are dropped
+    as soon as a newer version is seen.
+
+    Attributes:
+    - maxsize (int): The maximum number of routes kept.
+    - hits (int): The number of lookups answered from the cache.
+    - misses (int): The number of lookups not found in the cache.
+    - evictions (int): The number of routes dropped to make room for new ones.
+    - invalidations (int): The number of routes dropped because the graph changed.
+    """
+
+    def __init__(self, maxsize: int = ROUTE_CACHE_SIZE):
+        """
+        Initialize an empty RouteCache.
+        Args:
+            maxsize: (int): The maximum number of routes kept.
+
+        Returns: None
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, start_node_id: int, end_node_id: int, version: int):
+        """
+        Gets a route from the cache.
+
+        Args:
+            start_node_id: (int): The id of the start node.
+            end_node_id: (int): The id of the end node.
+            version: (int): The version of the graph.
+
+        Returns:
+            tuple[list[int], float] | None: The node ids of the path and its distance, or None if the
+            route is not in the cache.
+        """
+        key = (min(start_node_id, end_node_id), max(start_node_id, end_node_id))
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key) if version == self._version else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        # The entry is stored from the lowest node id, so it is reversed for the other direction
+        path, distance = entry
+        if start_node_id > end_node_id:
+            path = path[::-1]
+        return list(path), distance
+
+    def put(self, start_node_id: int, end_node_id: int, version: int, path: list[int], distance: float):
+        """
+        Adds a route to the cache, dropping the least recently used route if the cache is full.
+
+        Args:
+            start_node_id: (int): The id of the start node.
+            end_node_id: (int): The id of the end node.
+            version: (int): The version of the graph the route was computed with.
+            path: (list[int]): The node ids of the path.
+            distance: (float): The distance of the path.
+
+        Returns: None
+        """
+        if self.maxsize <= 0:
+            return
+
+        key = (min(start_node_id, end_node_id), max(start_node_id, end_node_id))
+        path = tuple(path) if start_node_id <= end_node_id else tuple(reversed(path))
+        with self._lock:
+            self._check_version(version)
+            if version != self._version:
+                return
+            self._entries[key] = (path, distance)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Gets the counters of the cache.
+
+        Returns:
+            dict: The size, capacity, hits, misses, evictions and invalidations of the cache.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _check_version(self, version):
+        """
+        Drops all the entries when a newer graph version is seen.
+        """
+        if self._version is None or version > self._version:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._version = version
+
+
+# The route cache of the process
+route_cache = RouteCache()
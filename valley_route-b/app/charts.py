@@ -0,0 +1,134 @@
+"""
+This module contains the rendering and caching of the statistics charts.
+It includes the following:
+- The render_bar_chart function, which draws the number of packages per node as a PNG or SVG image
+- The RenderedChart class, an image with its media type and ETag
+- The ChartCache class, which keeps the rendered charts with the version of the package counts they show
+- The process-level chart_cache instance used by the statistics endpoints
+
+The charts are drawn with the object-oriented Figure API, so no pyplot global state is shared between
+requests, and each figure is released as soon as it is saved.
+"""
+
+# Standard library imports
+import hashlib
+import threading
+from io import BytesIO
+
+# Third-party imports
+from matplotlib.figure import Figure
+
+# Media type of each image format
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def render_bar_chart(labels: list[str], counts: list[int], title: str, image_format: str = "png"):
+    """
+    Create a bar chart with the number of packages of each node. It runs in the workers of the executor.
+
+    Args:
+        labels: (list[str]): The name of the nodes of each bar.
+        counts: (list[int]): The number of packages of each bar.
+        title: (str): The title of the chart.
+        image_format: (str): "png" or "svg".
+
+    Returns:
+        bytes: The image of the bar chart.
+    """
+    figure = Figure(figsize=(15, 6))
+    axes = figure.subplots()
+    axes.bar(labels, counts, width=0.5, color='blue')
+    axes.set_xlabel('Nodos')
+    axes.set_ylabel('Número de Paquetes')
+    axes.set_title(title)
+    axes.grid(True)
+    figure.tight_layout()
+
+    # Save the plot to a buffer, without the date, so the same data always gives the same image
+    buffer = BytesIO()
+    figure.savefig(buffer, format=image_format, metadata={"Date": None} if image_format == "svg" else None)
+    return buffer.getvalue()
+
+
+class RenderedChart:
+    """
+    RenderedChart is a chart image ready to be sent.
+
+    Attributes:
+    - content (bytes): The image.
+    - media_type (str): The media type of the image.
+    - etag (str): The entity tag of the image, computed from its content.
+    """
+
+    def __init__(self, content: bytes, image_format: str):
+        """
+        Initialize the RenderedChart object.
+        Args:
+            content: (bytes): The image.
+            image_format: (str): "png" or "svg".
+
+        Returns: None
+        """
+        self.content = content
+        self.media_type = MEDIA_TYPES[image_format]
+        self.etag = f'"{hashlib.sha1(content).hexdigest()}"'
+
+
+class ChartCache:
+    """
+    ChartCache keeps the rendered charts with the version of the package counts they were rendered from.
+    The version is read from the database by the caller, so a chart is rendered again once packages are
+    created by any process, and charts rendered with another version are never returned.
+
+    Attributes:
+    - hits (int): The number of charts answered from the cache.
+    - misses (int): The number of charts that had to be rendered.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty ChartCache.
+
+        Returns: None
+        """
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, version: tuple):
+        """
+        Gets a chart from the cache.
+
+        Args:
+            key: (tuple): The chart and image format.
+            version: (tuple): The version of the package counts the chart must have been rendered with.
+
+        Returns:
+            RenderedChart | None: The chart, or None if it is not in the cache.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, version: tuple, chart: RenderedChart):
+        """
+        Adds a chart to the cache, replacing the chart of another version.
+
+        Args:
+            key: (tuple): The chart and image format.
+            version: (tuple): The version of the package counts the chart was rendered with.
+            chart: (RenderedChart): The chart.
+
+        Returns: None
+        """
+        with self._lock:
+            self._entries[key] = (version, chart)
+
+
+# The chart cache of the process
+chart_cache = ChartCache()
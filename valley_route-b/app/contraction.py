@@ -0,0 +1,459 @@
+"""
+This module contains the optional contraction hierarchies (CH) index of the route engine.
+It includes the following:
+- The build_hierarchy function, which contracts the nodes of a graph snapshot
+- The ContractionHierarchy class, which answers route queries with a bidirectional search
+- The ContractionIndex class, which stores the hierarchy on disk and rebuilds it in a separate process
+- The process-level contraction_index instance used by the route engine
+"""
+
+# Standard library imports
+import hashlib
+import heapq
+import logging
+import math
+import multiprocessing
+import os
+import threading
+
+# Third-party imports
+import numpy as np
+
+# Local imports (project-specific)
+from app.graph import GraphSnapshot
+
+# File where the hierarchy is stored between restarts
+CH_INDEX_PATH = os.getenv("CH_INDEX_PATH", "ch_index.npz")
+
+# Maximum number of nodes settled by each witness search while contracting
+CH_WITNESS_LIMIT = int(os.getenv("CH_WITNESS_LIMIT", "500"))
+
+logger = logging.getLogger(__name__)
+
+
+def graph_signature(graph: GraphSnapshot):
+    """
+    Calculates a fingerprint of the nodes and edges of a graph snapshot, used to know if a stored
+    hierarchy was built from the same graph.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+
+    Returns:
+        str: The hexadecimal fingerprint of the graph.
+    """
+    digest = hashlib.sha1()
+    for array in (graph.node_ids, graph.matrix.indptr, graph.matrix.indices, graph.matrix.data):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def _witness_search(adjacency, source, skipped, limit, settle_limit):
+    """
+    Runs a Dijkstra search from a node that avoids the node being contracted. The search stops at the
+    distance limit or after settling settle_limit nodes, so the distances found are upper bounds.
+    """
+    distance = {source: 0.0}
+    queue = [(0.0, source)]
+    settled = 0
+    while queue and settled < settle_limit:
+        node_distance, node = heapq.heappop(queue)
+        if node_distance > limit:
+            break
+        if node_distance > distance[node]:
+            continue
+        settled += 1
+        for neighbor, weight in adjacency[node].items():
+            new_distance = node_distance + weight
+            if neighbor != skipped and new_distance < distance.get(neighbor, math.inf):
+                distance[neighbor] = new_distance
+                heapq.heappush(queue, (new_distance, neighbor))
+    return distance
+
+
+def _shortcuts(adjacency, node, settle_limit):
+    """
+    Gets the shortcuts needed to contract a node, as (start, end, distance) tuples.
+    """
+    neighbors = list(adjacency[node].items())
+    shortcuts = []
+    for position, (start, start_weight) in enumerate(neighbors):
+        # The graph is undirected, so each pair of neighbors is checked once
+        targets = {end: start_weight + end_weight for end, end_weight in neighbors[position + 1:]}
+        if not targets:
+            continue
+
+        # A shortcut is only needed if no path avoiding the node is as short as the one through it
+        witness = _witness_search(adjacency, start, node, max(targets.values()), settle_limit)
+        for end, via in targets.items():
+            if witness.get(end, math.inf) > via:
+                shortcuts.append((start, end, via))
+    return shortcuts
+
+
+def build_hierarchy(graph: GraphSnapshot, settle_limit: int = CH_WITNESS_LIMIT):
+    """
+    Builds the contraction hierarchy of a graph snapshot. Nodes are contracted in order of edge difference,
+    and every edge is kept in the upward graph of its lower ranked node.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+        settle_limit: (int): The maximum number of nodes settled by each witness search.
+
+    Returns:
+        ContractionHierarchy: The hierarchy of the graph.
+    """
+    size = graph.size
+    indptr, indices, data = graph.matrix.indptr, graph.matrix.indices, graph.matrix.data
+
+    # Remaining graph, and the middle node of the edges that are shortcuts
+    adjacency = [dict(zip(indices[indptr[node]:indptr[node + 1]].tolist(),
+                          data[indptr[node]:indptr[node + 1]].tolist())) for node in range(size)]
+    middle = [{} for _ in range(size)]
+    contracted_neighbors = [0] * size
+
+    def priority(node):
+        shortcuts = _shortcuts(adjacency, node, settle_limit)
+        return len(shortcuts) - len(adjacency[node]) + contracted_neighbors[node], shortcuts
+
+    rank = np.full(size, -1, dtype=np.int64)
+    upward = [None] * size
+    queue = [(priority(node)[0], node) for node in range(size)]
+    heapq.heapify(queue)
+
+    order = 0
+    while queue:
+        _, node = heapq.heappop(queue)
+        if rank[node] >= 0:
+            continue
+
+        # The priority may have changed since it was queued, so it is updated lazily
+        node_priority, shortcuts = priority(node)
+        if queue and node_priority > queue[0][0]:
+            heapq.heappush(queue, (node_priority, node))
+            continue
+
+        rank[node] = order
+        order += 1
+
+        # The remaining neighbors are contracted later, so they are above the node
+        upward[node] = [(neighbor, weight, middle[node].get(neighbor, -1))
+                        for neighbor, weight in adjacency[node].items()]
+        for neighbor in adjacency[node]:
+            del adjacency[neighbor][node]
+            contracted_neighbors[neighbor] += 1
+        adjacency[node] = {}
+
+        for start, end, via in shortcuts:
+            if via < adjacency[start].get(end, math.inf):
+                adjacency[start][end] = adjacency[end][start] = via
+                middle[start][end] = middle[end][start] = node
+
+    # Store the upward graph in CSR arrays
+    up_indptr = np.zeros(size + 1, dtype=np.int64)
+    up_indptr[1:] = np.cumsum([len(edges) for edges in upward])
+    edges = [edge for node_edges in upward for edge in node_edges]
+    up_targets = np.array([edge[0] for edge in edges], dtype=np.int64)
+    up_weights = np.array([edge[1] for edge in edges], dtype=np.float64)
+    up_middles = np.array([edge[2] for edge in edges], dtype=np.int64)
+
+    return ContractionHierarchy(graph_signature(graph), rank, up_indptr, up_targets, up_weights, up_middles)
+
+
+class ContractionHierarchy:
+    """
+    ContractionHierarchy answers shortest route queries with a bidirectional search over the upward graph,
+    and unpacks the shortcuts of the result into the original nodes.
+
+    Attributes:
+    - signature (str): The fingerprint of the graph the hierarchy was built from.
+    - rank (np.ndarray): The contraction order of each node.
+    - up_indptr, up_targets, up_weights, up_middles (np.ndarray): The upward graph in CSR arrays,
+      with the middle node of each shortcut, or -1 for the original edges.
+    """
+
+    def __init__(self, signature: str, rank: np.ndarray, up_indptr: np.ndarray, up_targets: np.ndarray,
+                 up_weights: np.ndarray, up_middles: np.ndarray):
+        """
+        Initialize the ContractionHierarchy object.
+        Args:
+            signature: (str): The fingerprint of the graph.
+            rank: (np.ndarray): The contraction order of each node.
+            up_indptr: (np.ndarray): The offsets of the upward edges of each node.
+            up_targets: (np.ndarray): The target of each upward edge.
+            up_weights: (np.ndarray): The distance of each upward edge.
+            up_middles: (np.ndarray): The middle node of each upward edge, or -1.
+
+        Returns: None
+        """
+        self.signature = signature
+        self.rank = rank
+        self.up_indptr = up_indptr
+        self.up_targets = up_targets
+        self.up_weights = up_weights
+        self.up_middles = up_middles
+
+    def save(self, path: str):
+        """
+        Saves the hierarchy to a file. The file is replaced atomically, so readers never see a partial file.
+
+        Args:
+            path: (str): The path of the file.
+
+        Returns: None
+        """
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, signature=np.array(self.signature), rank=self.rank, up_indptr=self.up_indptr,
+                     up_targets=self.up_targets, up_weights=self.up_weights, up_middles=self.up_middles)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads a hierarchy from a file.
+
+        Args:
+            path: (str): The path of the file.
+
+        Returns:
+            ContractionHierarchy: The loaded hierarchy.
+        """
+        with np.load(path) as arrays:
+            return cls(str(arrays["signature"]), arrays["rank"], arrays["up_indptr"], arrays["up_targets"],
+                       arrays["up_weights"], arrays["up_middles"])
+
+    def query(self, source: int, target: int):
+        """
+        Finds the shortest path between two nodes.
+
+        Args:
+            source: (int): The matrix index of the start node.
+            target: (int): The matrix index of the end node.
+
+        Returns:
+            tuple[list[int], float]: The matrix indexes of the path and its distance, or an empty path and
+            infinity if the target can not be reached.
+        """
+        if source == target:
+            return [source], 0.0
+
+        # Forward search from the source and backward search from the target, both going up the hierarchy
+        distances = ({source: 0.0}, {target: 0.0})
+        previous = ({source: -1}, {target: -1})
+        queues = ([(0.0, source)], [(0.0, target)])
+        best, meeting = math.inf, -1
+
+        while queues[0] or queues[1]:
+            # Advance the direction with the closest node, until no direction can improve the best route
+            side = 0 if not queues[1] or (queues[0] and queues[0][0][0] <= queues[1][0][0]) else 1
+            if queues[side][0][0] >= best:
+                break
+            node_distance, node = heapq.heappop(queues[side])
+            if node_distance > distances[side][node]:
+                continue
+
+            other_distance = distances[1 - side].get(node)
+            if other_distance is not None and node_distance + other_distance < best:
+                best, meeting = node_distance + other_distance, node
+
+            start, end = self.up_indptr[node], self.up_indptr[node + 1]
+            for neighbor, weight in zip(self.up_targets[start:end].tolist(), self.up_weights[start:end].tolist()):
+                new_distance = node_distance + weight
+                if new_distance < distances[side].get(neighbor, math.inf):
+                    distances[side][neighbor] = new_distance
+                    previous[side][neighbor] = node
+                    heapq.heappush(queues[side], (new_distance, neighbor))
+
+        if meeting < 0:
+            return [], math.inf
+
+        # Join the two halves of the route at the meeting node
+        forward = [meeting]
+        while previous[0][forward[-1]] != -1:
+            forward.append(previous[0][forward[-1]])
+        forward.reverse()
+        backward = [meeting]
+        while previous[1][backward[-1]] != -1:
+            backward.append(previous[1][backward[-1]])
+        route = forward + backward[1:]
+
+        # Replace the shortcuts with the nodes they skip
+        path = [route[0]]
+        for start, end in zip(route, route[1:]):
+            self._unpack(start, end, path)
+        return path, best
+
+    def _unpack(self, start, end, path):
+        """
+        Appends the original nodes of the edge between start and end, without start, to the path.
+        """
+        stack = [(start, end)]
+        while stack:
+            first, second = stack.pop()
+            middle = self._middle(first, second)
+            if middle < 0:
+                path.append(second)
+            else:
+                stack.append((middle, second))
+                stack.append((first, middle))
+
+    def _middle(self, first, second):
+        """
+        Gets the middle node of the edge between two nodes, or -1 if it is an original edge.
+        """
+        # The edge is stored in the upward graph of the lower ranked node
+        lower, upper = (first, second) if self.rank[first] < self.rank[second] else (second, first)
+        start, end = self.up_indptr[lower], self.up_indptr[lower + 1]
+        position = start + int(np.flatnonzero(self.up_targets[start:end] == upper)[0])
+        return int(self.up_middles[position])
+
+
+def build_hierarchy_file(node_ids: np.ndarray, matrix, path: str, settle_limit: int = CH_WITNESS_LIMIT):
+    """
+    Builds the contraction hierarchy of a graph and writes it to a file. It runs in a separate process, so the
+    pure Python contraction does not hold the GIL of the API process.
+
+    Args:
+        node_ids: (np.ndarray): The id of the node stored at each matrix index.
+        matrix: (csr_matrix): The adjacency matrix of the graph.
+        path: (str): The path of the file.
+        settle_limit: (int): The maximum number of nodes settled by each witness search.
+
+    Returns: None
+    """
+    graph = GraphSnapshot(node_ids, np.empty(0), np.empty(0), matrix, {}, 0)
+    build_hierarchy(graph, settle_limit).save(path)
+
+
+class ContractionIndex:
+    """
+    ContractionIndex keeps the hierarchy of the current graph. The hierarchy is read from disk on first use.
+    When the graph changes, a background thread starts a separate process that builds the hierarchy and
+    writes it to the file, and reads it back once the process ends. While it is rebuilt, get returns None
+    so the route engine can fall back to the A* search.
+
+    Attributes:
+    - path (str): The file where the hierarchy is stored.
+    - build (bool): Whether the hierarchy is rebuilt by this process. When False, a stale hierarchy is read
+      again from the file when another process writes it.
+    """
+
+    def __init__(self, path: str = CH_INDEX_PATH):
+        """
+        Initialize the ContractionIndex object.
+        Args:
+            path: (str): The file where the hierarchy is stored.
+
+        Returns: None
+        """
+        self.path = path
+        self.build = True
+        self._hierarchy = None
+        self._disk_checked = False
+        self._disk_mtime = None
+        self._pending = None
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def get(self, graph: GraphSnapshot):
+        """
+        Gets the hierarchy of a graph snapshot. If the current hierarchy was built from another graph,
+        a rebuild is started and None is returned.
+
+        Args:
+            graph: (GraphSnapshot): The graph snapshot.
+
+        Returns:
+            ContractionHierarchy | None: The hierarchy of the graph, or None if it is not available yet.
+        """
+        signature = graph.derived("signature", graph_signature)
+
+        with self._lock:
+            stale = self._hierarchy is None or self._hierarchy.signature != signature
+            if stale and (not self._disk_checked or not self.build):
+                self._disk_checked = True
+                self._read_disk()
+            hierarchy = self._hierarchy
+
+        if hierarchy is not None and hierarchy.signature == signature:
+            return hierarchy
+
+        self.rebuild(graph)
+        return None
+
+    def _read_disk(self):
+        """
+        Reads the hierarchy from its file, if the file changed since it was last read.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._disk_mtime:
+            return
+
+        self._disk_mtime = mtime
+        try:
+            self._hierarchy = ContractionHierarchy.load(self.path)
+        except (OSError, ValueError, KeyError):
+            logger.exception("Could not read the contraction hierarchy from %s", self.path)
+
+    def rebuild(self, graph: GraphSnapshot):
+        """
+        Starts the background rebuild of the hierarchy. If a rebuild is already running, the graph is queued
+        and only the latest queued graph is built next. It does nothing if this process does not build the
+        hierarchy.
+
+        Args:
+            graph: (GraphSnapshot): The graph snapshot to build the hierarchy from.
+
+        Returns: None
+        """
+        if not self.build:
+            return
+
+        with self._lock:
+            self._pending = graph
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="contraction-index", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        """
+        Builds the queued graphs until there is none left.
+        """
+        while True:
+            with self._lock:
+                graph, self._pending = self._pending, None
+                if graph is None:
+                    self._worker = None
+                    return
+                current = self._hierarchy
+
+            if current is not None and current.signature == graph.derived("signature", graph_signature):
+                continue
+
+            # The process is spawned, because forking a process with running threads is not safe
+            process = multiprocessing.get_context("spawn").Process(
+                target=build_hierarchy_file, args=(graph.node_ids, graph.matrix, self.path, CH_WITNESS_LIMIT),
+                name="contraction-build", daemon=True)
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                logger.error("The contraction hierarchy build ended with exit code %s", process.exitcode)
+                continue
+
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                hierarchy = ContractionHierarchy.load(self.path)
+            except (OSError, ValueError, KeyError):
+                logger.exception("Could not read the contraction hierarchy from %s", self.path)
+                continue
+
+            with self._lock:
+                self._hierarchy, self._disk_mtime = hierarchy, mtime
+
+
+# The hierarchy of the process, used when the route engine is "ch"
+contraction_index = ContractionIndex()
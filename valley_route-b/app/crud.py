@@ -8,73 +8,106 @@ It includes the following:
 """
 
 # Standard library imports
+import asyncio
 import base64
-from io import BytesIO
+import os
+from datetime import datetime
+from typing import Optional
 
 # Third-party imports
-import geopandas as gpd
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-from scipy.sparse.csgraph import shortest_path
-from shapely.geometry import Point
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, joinedload
 
 # Local imports (project-specific)
 from app import models, schemas
+from app.charts import RenderedChart, chart_cache, render_bar_chart
+from app.distance import edge_distances
+from app.executor import executor
+from app.graph import graph_store
+from app.graph_export import build_graph_export
+from app.package_routes import current_route, discard_outdated_routes, route_maintenance, save_route
+from app.pagination import encode_cursor
 from app.models import Node
+from app.rollups import count_package, get_package_time_series
+from app.route_jobs import route_jobs
+from app.routing import distance_matrix, find_route, find_routes, graph_changed, reachable_nodes
 from app.schemas import EdgeGet, PackageGet, PackageGetAll
+from app.spatial import NODE_BBOX_MAX_NODES, NODE_CLUSTER_MAX_ZOOM, node_grid, node_index
 
+# Number of packages per page of GET /packages, and the largest page size a client can request
+PACKAGES_PAGE_SIZE = int(os.getenv("PACKAGES_PAGE_SIZE", "8"))
+PACKAGES_MAX_PAGE_SIZE = int(os.getenv("PACKAGES_MAX_PAGE_SIZE", "100"))
 
-def get_user_by_email(db: Session, email: str):
+# Largest number of packages of a request of POST /packages/routes
+PACKAGE_ROUTES_MAX_IDS = int(os.getenv("PACKAGE_ROUTES_MAX_IDS", "1000"))
+
+# Largest number of cells (origins times destinations) of a distance matrix
+DISTANCE_MATRIX_MAX_CELLS = int(os.getenv("DISTANCE_MATRIX_MAX_CELLS", "1000000"))
+
+
+async def get_user_by_email(db: AsyncSession, email: str):
     """
     Retrieves a user from the database by email.
 
     Args:
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
         email: (str): The email address of the user.
 
     Returns:
         models.User: The user object corresponding to the provided email address.
     """
-    return db.query(models.User).filter(models.User.email == email).first()
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
 
 
-def new_node(db: Session, node: schemas.NodeCreate):
+async def new_node(db: AsyncSession, node: schemas.NodeCreate):
     """
     Creates a new node in the database.
 
     Args:
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
         node: (schemas.NodeCreate): The node data to create.
 
     Returns:
         models.Node: The created node object.
     """
 
+    # Load the routing graph first, so the version before the node is known
+    await graph_store.load(db)
+
     db_node = models.Node(name=node.name, lat=node.lat, lng=node.lng)
-    db.add(db_node)
-    db.commit()
-    db.refresh(db_node)
+
+    # Add the node to the database and to the routing graph of the process, and log the edit
+    with graph_store.editing():
+        db.add(db_node)
+        await db.commit()
+        await db.refresh(db_node)
+        old_version = graph_store.version
+        graph_store.add_node(db_node)
+    route_maintenance.graph_edited(old_version, graph_store.version)
     return db_node
 
 
-def new_edge(db: Session, edge: schemas.EdgeCreate):
+async def new_edge(db: AsyncSession, edge: schemas.EdgeCreate):
     """
     Creates a new edge in the database.
 
     Args:
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
         edge: (schemas.EdgeCreate): The edge data to create.
 
     Returns:
         models.Edge: The created edge object.
     """
+    # Load the routing graph first, so the version before the edge is known
+    await graph_store.load(db)
+
     # Get the start and end nodes
-    node_start = db.query(models.Node).filter(models.Node.id == edge.start_node_id).first()
+    node_start = await db.get(models.Node, edge.start_node_id)
 
     # Get the start and end nodes
-    node_end = db.query(models.Node).filter(models.Node.id == edge.end_node_id).first()
+    node_end = await db.get(models.Node, edge.end_node_id)
 
     # Calculate the distance between the start and end nodes
     distance = calculate_distance(node_start, node_end)
@@ -82,63 +115,103 @@ def new_edge(db: Session, edge: schemas.EdgeCreate):
     # Create the edge object
     db_edge = models.Edge(start_node_id=edge.start_node_id, end_node_id=edge.end_node_id, distance=distance)
 
-    # Add the edge to the database
-    db.add(db_edge)
-    db.commit()
-    db.refresh(db_edge)
+    # Add the edge to the database and to the routing graph of the process
+    with graph_store.editing():
+        db.add(db_edge)
+        await db.commit()
+        await db.refresh(db_edge)
+        old_version = graph_store.version
+        graph_store.add_edge(db_edge)
+
+    # Update the stored routes the edge can shorten
+    route_maintenance.graph_edited(old_version, graph_store.version,
+                                   [(db_edge.start_node_id, db_edge.end_node_id, db_edge.distance)])
+    await graph_changed(db)
     return db_edge
 
 
-def get_edge_all(db: Session):
+def _edges_with_nodes():
+    """
+    Builds the query of the edges with the columns of their start and end nodes, joined in the same query.
     """
-    Retrieves all edges from the database.
+    start_node = aliased(models.Node)
+    end_node = aliased(models.Node)
+    return (select(models.Edge.id, models.Edge.distance, start_node.id, start_node.name, start_node.lat,
+                   start_node.lng, end_node.id, end_node.name, end_node.lat, end_node.lng)
+            .join(start_node, models.Edge.start_node_id == start_node.id)
+            .join(end_node, models.Edge.end_node_id == end_node.id)
+            .order_by(models.Edge.id))
+
+
+def _edge_get(row):
+    """
+    Creates the response object of an edge from a row of the edges with nodes query.
+    """
+    _, distance, start_id, start_name, start_lat, start_lng, end_id, end_name, end_lat, end_lng = row
+    return EdgeGet(start_node=schemas.Node(id=start_id, name=start_name, lat=start_lat, lng=start_lng),
+                   end_node=schemas.Node(id=end_id, name=end_name, lat=end_lat, lng=end_lng),
+                   distance=distance)
+
+
+async def get_edge_all(db: AsyncSession):
+    """
+    Retrieves all edges from the database, with their start and end nodes, with one query.
 
     Args:
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
 
     Returns:
-        list[models.Edge]: A list of all edge objects in the database.
+        list[schemas.EdgeGet]: A list of all edges in the database.
     """
 
-    # Get all edges from the database
-    all_edges = db.query(models.Edge).all()
+    # Get all edges from the database, with their nodes joined in the same query
+    result = await db.execute(_edges_with_nodes())
 
     # Create a list of edge objects
-    list_edges = [EdgeGet(edge) for edge in all_edges]
+    list_edges = [_edge_get(row) for row in result.all()]
     return list_edges
 
 
-def calculate_distance(node_start: Node, node_end: Node):
+async def get_edge_page(db: AsyncSession, after_id: int, limit: int):
     """
-    Calculates the distance between two nodes using geopandas.
+    Retrieves a page of edges ordered by id, starting after the given id, with one query.
+
     Args:
-        node_start: (Node): The start node.
-        node_end: (Node): The end node.
+        db: (AsyncSession): The database session.
+        after_id: (int): The id after which the page starts.
+        limit: (int): The maximum number of edges of the page.
 
     Returns:
-        float: The distance between the two nodes.
+        schemas.EdgePage: The edges of the page, and the cursor of the next page, or None if it is the last page.
     """
 
-    # Create two points from the node coordinates
-    point1 = Point(node_start.lat, node_start.lng)
-    point2 = Point(node_end.lat, node_end.lng)
+    # Read one more edge than requested to know if there is a next page
+    result = await db.execute(_edges_with_nodes().where(models.Edge.id > after_id).limit(limit + 1))
+    rows = result.all()
 
-    # Create a GeoDataFrame with the two points
-    points_df = gpd.GeoDataFrame({'geometry': [point1, point2]}, crs='EPSG:4686')
+    return schemas.EdgePage(data=[_edge_get(row) for row in rows[:limit]],
+                            next_cursor=encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None)
 
-    # Convert the GeoDataFrame to EPSG:32633
-    points_df = points_df.to_crs('EPSG:32633')
 
-    # Calculate the distance between the two points
-    return points_df.distance(points_df.shift())[1]
+def calculate_distance(node_start: Node, node_end: Node):
+    """
+    Calculates the distance between two nodes, projecting them with the shared transformer.
+    Args:
+        node_start: (Node): The start node.
+        node_end: (Node): The end node.
+
+    Returns:
+        float: The distance between the two nodes.
+    """
+    return float(edge_distances(node_start.lat, node_start.lng, node_end.lat, node_end.lng))
 
 
-def create_user_package(db: Session, user_id: int, package: schemas.PackageCreate):
+async def create_user_package(db: AsyncSession, user_id: int, package: schemas.PackageCreate):
     """
-    Creates a new package in the database.
+    Creates a new package in the database, and queues the computation of its route.
 
     Args:
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
         user_id: (int): The ID of the user who owns the package.
         package: (schemas.PackageCreate): The package data to create.
 
@@ -147,216 +220,529 @@ def create_user_package(db: Session, user_id: int, package: schemas.PackageCreat
     """
     db_package = models.Package(**package.dict(), user_id=user_id)
     db.add(db_package)
-    db.commit()
-    db.refresh(db_package)
+
+    # Queue the route and count the package in the statistics rollups, in the same transaction,
+    # once its id and creation date are set
+    await db.flush()
+    db.add(models.RouteJob(package_id=db_package.id))
+    await count_package(db, db_package.start_node_id, db_package.end_node_id, db_package.created_at)
+    await db.commit()
+    await db.refresh(db_package)
+
+    # The route worker is woken up
+    route_jobs.notify()
     return db_package
 
 
-def get_package(db: Session, package_id: int):
+async def get_route_job(db: AsyncSession, package_id: int):
     """
-    Retrieves a package from the database by ID.
+    Retrieves the status of the computation of the route of a package.
 
     Args:
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
+        package_id: (int): The ID of the package.
+
+    Returns:
+        schemas.RouteJobStatus: The status of the route, or None if the package does not exist.
+    """
+    result = await db.execute(select(models.Package.id, models.RouteJob.status, models.RouteJob.attempts,
+                                     models.RouteJob.error, models.PackageRoute.package_id)
+                              .outerjoin(models.RouteJob, models.RouteJob.package_id == models.Package.id)
+                              .outerjoin(models.PackageRoute, models.PackageRoute.package_id == models.Package.id)
+                              .where(models.Package.id == package_id))
+    row = result.first()
+
+    # If the package is not found, return None
+    if row is None:
+        return None
+
+    # The packages created before the queue have no job, their route is computed on read
+    package_id, job_status, attempts, error, stored = row
+    if job_status is None:
+        job_status = "done" if stored is not None else "pending"
+    return schemas.RouteJobStatus(package_id=package_id, status=job_status, attempts=attempts or 0, error=error,
+                                  route_url=f"/package/{package_id}")
+
+
+async def get_package(db: AsyncSession, package_id: int):
+    """
+    Retrieves a package from the database by ID, with its stored route. The route is only computed again if
+    the graph changed since it was stored.
+
+    Args:
+        db: (AsyncSession): The database session.
         package_id: (int): The ID of the package.
 
     Returns:
         models.Package: The package object corresponding to the provided ID.
     """
 
-    # Get the package from the database
-    package = db.query(models.Package).filter(models.Package.id == package_id).first()
+    # Get the package from the database, with the relationships returned in the response and the stored route
+    result = await db.execute(select(models.Package)
+                              .options(joinedload(models.Package.start_node), joinedload(models.Package.end_node),
+                                       joinedload(models.Package.owner), joinedload(models.Package.route))
+                              .where(models.Package.id == package_id))
+    package = result.scalars().first()
 
     # If the package is not found, return None
     if package is None:
         return None
 
-    # Get the size of the nodes
-    size_nodes = db.query(models.Node).count()
+    # Get the routing graph, it is only read from the database the first time
+    graph = await graph_store.snapshot(db)
 
-    # Create a matrix of zeros with the size of the nodes
-    M = np.zeros((size_nodes, size_nodes))
+    # Use the stored route while the graph does not change, and store the route computed otherwise
+    route = current_route(package.route, graph)
+    if route is None:
+        route = await find_route(graph, package.start_node_id, package.end_node_id)
+        await save_route(db, package.id, graph.version, *route)
+        await db.commit()
+        await discard_outdated_routes(db, graph.version, [package.id])
+    path, distance = route
 
-    # Get all edges from the database
-    all_edges = db.query(models.Edge).all()
+    # Get the nodes of the path with one query
+    result = await db.execute(select(models.Node).where(models.Node.id.in_(path)))
+    nodes = {node.id: node for node in result.scalars().all()}
+    path_nodes = [nodes[node_id] for node_id in path]
 
-    # Fill the matrix with the distances between the nodes
-    for edge in all_edges:
-        M[edge.start_node_id][edge.end_node_id] = edge.distance
-        M[edge.end_node_id][edge.start_node_id] = edge.distance
+    # Create the package return object
+    package_return = PackageGet(package, path_nodes, distance if path else None)
 
-    # Get the shortest path between the start and end nodes
-    D, Pr = shortest_path(M, directed=False, method='D', return_predecessors=True)
+    return package_return
 
-    # Get the path nodes
-    path = get_path(Pr, package.start_node_id, package.end_node_id)
-    path_nodes = [db.query(models.Node).filter(models.Node.id == int(node_id)).first() for node_id in path]
 
-    # Create the package return object
-    package_return = PackageGet(package, path_nodes, D[package.start_node_id, package.end_node_id])
+async def get_package_routes(db: AsyncSession, package_ids: list[int]):
+    """
+    Retrieves the routes of many packages. The stored routes are used while the graph does not change,
+    and the others are solved together and stored.
 
-    return package_return
+    Args:
+        db: (AsyncSession): The database session.
+        package_ids: (list[int]): The IDs of the packages.
 
+    Returns:
+        list[schemas.PackageRoute]: The route of each package found, in the order of the IDs.
+    """
 
-def get_all_packages(db: Session, owner_id: int, page: int):
+    # Get the start and end nodes and the stored route of all the packages with one query
+    result = await db.execute(select(models.Package.id, models.Package.start_node_id, models.Package.end_node_id,
+                                     models.PackageRoute)
+                              .outerjoin(models.PackageRoute)
+                              .where(models.Package.id.in_(package_ids)))
+    packages = result.all()
+    packages_by_id = {package.id: package for package in packages}
+    packages = [packages_by_id[package_id] for package_id in dict.fromkeys(package_ids)
+                if package_id in packages_by_id]
+
+    # Get the routing graph, and solve the routes that are not stored, one search per distinct start node
+    graph = await graph_store.snapshot(db)
+    routes = [current_route(package.PackageRoute, graph) for package in packages]
+    missing = [position for position, route in enumerate(routes) if route is None]
+    if missing:
+        found = await find_routes(graph, [(packages[position].start_node_id, packages[position].end_node_id)
+                                          for position in missing])
+        for position, route in zip(missing, found):
+            await save_route(db, packages[position].id, graph.version, *route)
+            routes[position] = route
+        await db.commit()
+        await discard_outdated_routes(db, graph.version, [packages[position].id for position in missing])
+
+    # Create the list of routes
+    return [schemas.PackageRoute(package_id=package.id, start_node_id=package.start_node_id,
+                                 end_node_id=package.end_node_id, path=path, distance=distance if path else None)
+            for package, (path, distance) in zip(packages, routes)]
+
+
+async def get_distance_matrix(db: AsyncSession, origins: list[int], destinations: list[int]):
     """
-    Retrieves all packages from the database for a given user.
+    Computes the matrix of shortest distances between two lists of nodes.
 
     Args:
-        db: (Session): The database session.
-        owner_id: (int): The ID of the user who owns the packages.
-        page: (int): The page number to retrieve.
+        db: (AsyncSession): The database session.
+        origins: (list[int]): The IDs of the origin nodes.
+        destinations: (list[int]): The IDs of the destination nodes.
 
     Returns:
-        dict: A dictionary containing the list of packages and the total number of pages.
+        np.ndarray: The float32 matrix of distances, with infinity for the pairs without a route,
+        or None if any of the nodes does not exist.
+    """
+
+    # Get the routing graph and the matrix index of every node
+    graph = await graph_store.snapshot(db)
+    origin_indexes = [graph.index_of(node_id) for node_id in origins]
+    destination_indexes = [graph.index_of(node_id) for node_id in destinations]
 
+    # If any node is not found, return None
+    if None in origin_indexes or None in destination_indexes:
+        return None
+
+    # Compute the matrix in the executor, so the event loop is not blocked
+    return await executor.run_graph(distance_matrix, graph, origin_indexes, destination_indexes)
+
+
+async def get_reachable_nodes(db: AsyncSession, node_id: int, max_distance: float):
     """
-    # Set the number of packages per page
-    size_page = 8
+    Finds the nodes that can be reached from a node within a distance, with a bounded search of the
+    routing graph.
 
-    # Get all packages from the database for the given user
-    all_packages = db.query(models.Package).filter(models.Package.user_id == owner_id).all()
+    Args:
+        db: (AsyncSession): The database session.
+        node_id: (int): The ID of the node.
+        max_distance: (float): The largest distance of the route to a node.
 
-    # Calculate the total number of pages
-    total_pages = len(all_packages) // size_page + 1
+    Returns:
+        schemas.ReachableNodes: The nodes reached and their distances, sorted by distance,
+        or None if the node does not exist.
+    """
+    graph = await graph_store.snapshot(db)
+    source = graph.index_of(node_id)
+
+    # If the node is not found, return None
+    if source is None:
+        return None
+
+    # Run the search in the executor, so the event loop is not blocked
+    node_ids, distances = await executor.run_graph(reachable_nodes, graph, source, max_distance)
+    nodes = [schemas.ReachableNode(id=reached_id, distance=distance)
+             for reached_id, distance in zip(node_ids.tolist(), distances.tolist())]
+    return schemas.ReachableNodes(node_id=node_id, max_distance=max_distance, nodes=nodes)
+
+
+async def get_graph_export(db: AsyncSession, encoding: str):
+    """
+    Gets the binary export of the routing graph. The export is built from the in-memory graph, in the
+    executor, and kept until the graph changes.
 
-    # Create a list of package objects
-    list_packages = []
+    Args:
+        db: (AsyncSession): The database session.
+        encoding: (str): "br", "gzip" or "identity".
+
+    Returns:
+        tuple[GraphSnapshot, bytes, str]: The graph snapshot, the export and its ETag.
+    """
+    graph = await graph_store.snapshot(db)
 
-    # Create a package object for each package and add it to the list
-    for package in all_packages:
-        package_id = package.id
-        description = package.description
-        created_at = package.created_at
-        start_node_name = db.query(models.Node).filter(models.Node.id == package.start_node_id).first().name
-        end_node_name = db.query(models.Node).filter(models.Node.id == package.end_node_id).first().name
-        package_str = PackageGetAll(package_id, description, created_at, start_node_name, end_node_name)
-        list_packages.append(package_str)
+    # The exports of each encoding are stored with the snapshot, so they are dropped when the graph changes
+    exports = graph.derived("binary_exports", lambda snapshot: {})
+    if encoding not in exports:
+        exports[encoding] = await executor.run_graph(build_graph_export, graph, encoding)
+    payload, etag = exports[encoding]
+    return graph, payload, etag
+
+
+async def get_all_packages(db: AsyncSession, owner_id: int, page: int, size_page: int = PACKAGES_PAGE_SIZE):
+    """
+    Retrieves a page of the packages of a given user, with the names of their start and end nodes.
+    The page is read with LIMIT and OFFSET, and the total with a single COUNT.
+
+    Args:
+        db: (AsyncSession): The database session.
+        owner_id: (int): The ID of the user who owns the packages.
+        page: (int): The page number to retrieve, starting at 1.
+        size_page: (int): The number of packages per page.
+
+    Returns:
+        dict: A dictionary containing the list of packages and the total number of pages.
+
+    """
+    # Count the packages of the user
+    total = (await db.execute(select(func.count()).select_from(models.Package)
+                              .where(models.Package.user_id == owner_id))).scalar()
+
+    # Calculate the total number of pages
+    total_pages = total // size_page + 1
+
+    # Get the packages of the page, with the names of the start and end nodes joined in the same query
+    start_node = aliased(models.Node)
+    end_node = aliased(models.Node)
+    result = await db.execute(select(models.Package.id, models.Package.description, models.Package.created_at,
+                                     start_node.name, end_node.name)
+                              .outerjoin(start_node, models.Package.start_node_id == start_node.id)
+                              .outerjoin(end_node, models.Package.end_node_id == end_node.id)
+                              .where(models.Package.user_id == owner_id)
+                              .order_by(models.Package.id)
+                              .limit(size_page)
+                              .offset((page - 1) * size_page))
 
     # Create a response object with the list of packages and the total number of pages
     response = {
-        "data": list_packages[page * size_page - size_page: page * size_page],
+        "data": [PackageGetAll(*row) for row in result.all()],
         "total_pages": total_pages
     }
 
     return response
 
 
-def get_node_all(db: Session):
+async def get_node_all(db: AsyncSession):
     """
     Retrieves all nodes from the database.
 
     Args:
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
 
     Returns:
         list[models.Node]: A list of all node objects in the database.
     """
-    return db.query(models.Node).all()
+    result = await db.execute(select(models.Node))
+    return result.scalars().all()
 
 
-def get_path(Pr, i, j):
+async def get_node_page(db: AsyncSession, after_id: int, limit: int):
     """
-    Gets the path between two nodes using the predecessor matrix.
+    Retrieves a page of nodes ordered by id, starting after the given id.
 
     Args:
-        Pr: (np.array): The predecessor matrix.
-        i: (int): The start node.
-        j: (int): The end node.
+        db: (AsyncSession): The database session.
+        after_id: (int): The id after which the page starts.
+        limit: (int): The maximum number of nodes of the page.
 
     Returns:
-        list[int]: A list of node IDs representing the path between the two nodes.
+        schemas.NodePage: The nodes of the page, and the cursor of the next page, or None if it is the last page.
     """
 
-    # Create a list to store the path
-    path = [j]
+    # Read one more node than requested to know if there is a next page
+    result = await db.execute(select(models.Node).where(models.Node.id > after_id)
+                              .order_by(models.Node.id).limit(limit + 1))
+    nodes = result.scalars().all()
 
-    # Get the path nodes, starting from the end node
-    while Pr[i, j] != -9999:
-        path.append(Pr[i, j])
-        j = Pr[i, j]
+    return schemas.NodePage(data=[schemas.Node.model_validate(node) for node in nodes[:limit]],
+                            next_cursor=encode_cursor(nodes[limit - 1].id) if len(nodes) > limit else None)
 
-    # Reverse the path to get the correct order
-    path.reverse()
-    return path
 
+async def get_nearest_nodes(db: AsyncSession, points: list[tuple[float, float]], k: int):
+    """
+    Finds the nodes nearest to many coordinates, with the spatial index of the routing graph.
 
-def get_package_by_start_node(db: Session):
+    Args:
+        db: (AsyncSession): The database session.
+        points: (list[tuple[float, float]]): The latitude and longitude of each coordinate.
+        k: (int): The number of nodes to find for each coordinate.
+
+    Returns:
+        list[list[schemas.NearestNode]]: The nearest nodes of each coordinate, sorted by distance. There are
+        fewer than k nodes when the graph is smaller than k.
     """
-    Create a bar chart with the number of packages that start at each node.
+    graph = await graph_store.snapshot(db)
+
+    # Rebuild the tree in a thread when too many nodes were added since it was built
+    if node_index.stale(graph):
+        await asyncio.to_thread(node_index.rebuild, graph)
+
+    lat, lng = zip(*points) if points else ((), ())
+    distances, indexes = node_index.query(graph, lat, lng, k)
+
+    # Read the names of all the nodes found with a single query
+    node_ids = {int(graph.node_ids[index]) for index in indexes[indexes >= 0]}
+    result = await db.execute(select(models.Node).where(models.Node.id.in_(node_ids)))
+    nodes = {node.id: node for node in result.scalars().all()}
+
+    # Create the list of nearest nodes of each coordinate, skipping the padding of small graphs
+    nearest = []
+    for row_distances, row_indexes in zip(distances, indexes):
+        row = []
+        for distance, index in zip(row_distances, row_indexes):
+            if index >= 0:
+                node = nodes[int(graph.node_ids[index])]
+                row.append(schemas.NearestNode(id=node.id, name=node.name, lat=node.lat, lng=node.lng,
+                                               distance=float(distance)))
+        nearest.append(row)
+    return nearest
+
+
+async def get_nodes_in_viewport(db: AsyncSession, min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                                zoom: int):
+    """
+    Gets the content of a map viewport from the grid of the routing graph. From NODE_CLUSTER_MAX_ZOOM the
+    nodes are listed, unless there are more than NODE_BBOX_MAX_NODES. Otherwise, the nodes are grouped into
+    the clusters of the grid cells of the zoom level.
 
     Args:
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
+        min_lat: (float): The southern edge of the viewport.
+        min_lng: (float): The western edge of the viewport.
+        max_lat: (float): The northern edge of the viewport.
+        max_lng: (float): The eastern edge of the viewport, smaller than min_lng across the antimeridian.
+        zoom: (int): The zoom level.
 
     Returns:
-        str: A base64 encoded image of the bar chart.
+        schemas.NodeViewport: The nodes or the clusters inside the viewport.
 
+    Raises:
+        ViewportTooLargeError: If the viewport covers too many grid cells of its zoom level.
+    """
+    node_grid.check_viewport(min_lat, min_lng, max_lat, max_lng, zoom)
+    graph = await graph_store.snapshot(db)
+    bbox = (min_lat, min_lng, max_lat, max_lng)
+
+    # The grids are built in a thread the first time a zoom level is requested
+    if zoom >= NODE_CLUSTER_MAX_ZOOM:
+        indexes = await asyncio.to_thread(node_grid.nodes, graph, *bbox)
+        if len(indexes) <= NODE_BBOX_MAX_NODES:
+            node_ids = [int(node_id) for node_id in graph.node_ids[indexes]]
+            result = await db.execute(select(models.Node).where(models.Node.id.in_(node_ids))
+                                      .order_by(models.Node.id))
+            nodes = [schemas.Node.model_validate(node) for node in result.scalars().all()]
+            return schemas.NodeViewport(zoom=zoom, kind="nodes", nodes=nodes, clusters=[])
+
+    lat, lng, counts = await asyncio.to_thread(node_grid.clusters, graph, *bbox, zoom)
+    clusters = [schemas.NodeCluster(lat=cluster_lat, lng=cluster_lng, count=count)
+                for cluster_lat, cluster_lng, count in zip(lat.tolist(), lng.tolist(), counts.tolist())]
+    return schemas.NodeViewport(zoom=zoom, kind="clusters", nodes=[], clusters=clusters)
+
+
+async def get_node_package_counts(db: AsyncSession, side: str):
     """
+    Gets the number of packages that start or end at each node from the rollup table, so only one row per
+    node is read, whatever the number of packages.
 
-    # Get all packages from the database
-    all_packages_query = (db.query(models.Package, models.Node.name).
-                          join(models.Node, models.Package.start_node_id == models.Node.id).all())
+    Args:
+        db: (AsyncSession): The database session.
+        side: (str): "start" to count by start node, or "end" to count by end node.
 
-    # Create a DataFrame with the packages and the start nodes
-    group_start = pd.DataFrame(all_packages_query, columns=['Package', 'Start Node'])
+    Returns:
+        list[schemas.NodePackageCount]: The number of packages of each node with packages, ordered by name.
+    """
+    rollup = models.NodePackageRollup
+    count_column = rollup.start_packages if side == "start" else rollup.end_packages
 
-    # Group the packages by the start node
-    group_start = group_start.groupby('Start Node').count()
+    # Read the counts of the nodes with packages
+    result = await db.execute(select(models.Node.id, models.Node.name, count_column)
+                              .join(rollup, rollup.node_id == models.Node.id)
+                              .where(count_column > 0)
+                              .order_by(models.Node.name, models.Node.id))
 
-    # Create a bar chart with the number of packages that start at each node
-    plt.figure(figsize=(15, 6))
-    plt.bar(group_start.index, group_start['Package'], width=0.5, color='blue')
-    plt.xlabel('Nodos')
-    plt.ylabel('Número de Paquetes')
-    plt.title('Número de Paquetes por Nodo Inicial')
-    plt.grid(True)
-    plt.tight_layout()
+    return [schemas.NodePackageCount(node_id=node_id, name=name, packages=packages)
+            for node_id, name, packages in result.all()]
 
-    # Save the plot to a buffer
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
 
-    # Convert the bytes object to a base64 string
-    image_base64 = base64.b64encode(buffer.read()).decode()
+async def get_node_package_statistics(db: AsyncSession):
+    """
+    Gets the number of packages that start and end at each node from the rollup table, with one query.
+
+    Args:
+        db: (AsyncSession): The database session.
 
-    return image_base64
+    Returns:
+        list[schemas.NodePackageStatistics]: The number of packages that start and end at each node with
+        packages, ordered by name.
+    """
+    rollup = models.NodePackageRollup
+    result = await db.execute(select(models.Node.id, models.Node.name, rollup.start_packages, rollup.end_packages)
+                              .join(rollup, rollup.node_id == models.Node.id)
+                              .where((rollup.start_packages > 0) | (rollup.end_packages > 0))
+                              .order_by(models.Node.name, models.Node.id))
 
+    return [schemas.NodePackageStatistics(node_id=node_id, name=name, start_packages=start_packages,
+                                          end_packages=end_packages)
+            for node_id, name, start_packages, end_packages in result.all()]
 
-def get_package_by_end_node(db: Session):
+
+async def get_package_time_series_statistics(db: AsyncSession, bucket: str, start: Optional[datetime] = None,
+                                             end: Optional[datetime] = None, node_id: Optional[int] = None):
     """
-    Create a bar chart with the number of packages that end at each node.
+    Gets the number of packages that start and end at each node by hour, day or week, from the hourly rollup.
 
     Args:
-        db: (Session): The database session.
+        db: (AsyncSession): The database session.
+        bucket: (str): "hour", "day" or "week".
+        start: (Optional[datetime]): The first hour of the range, included.
+        end: (Optional[datetime]): The end of the range, excluded.
+        node_id: (Optional[int]): The id of the node, or None for all the nodes.
 
     Returns:
-        str: A base64 encoded image of the bar chart.
+        list[schemas.PackageTimeBucket]: The counts of each node in each bucket with packages.
+    """
+    points = await get_package_time_series(db, bucket, start, end, node_id)
+    return [schemas.PackageTimeBucket(bucket=bucket_start, node_id=point_node_id, name=name,
+                                      start_packages=start_packages, end_packages=end_packages)
+            for bucket_start, point_node_id, name, start_packages, end_packages in points]
+
+
+async def get_package_count_version(db: AsyncSession):
     """
+    Gets the version of the package counts from the database, so every process sees the packages created by
+    the others. The last package id changes when packages are created, and the total of the rollup when they
+    are deleted or the rollup is rebuilt. Both are read without scanning the packages.
+
+    Args:
+        db: (AsyncSession): The database session.
+
+    Returns:
+        tuple[int, int]: The id of the last package and the number of packages counted in the rollup.
+    """
+    rollup = models.NodePackageRollup
+    result = await db.execute(select(select(func.max(models.Package.id)).scalar_subquery(),
+                                     select(func.sum(rollup.start_packages)).scalar_subquery()))
+    last_id, total = result.one()
+    return last_id or 0, total or 0
+
+
+# Title of the chart of each side of the packages
+CHART_TITLES = {"start": 'Número de Paquetes por Nodo Inicial', "end": 'Número de Paquetes por Nodo Final'}
+
+
+async def get_node_chart(db: AsyncSession, side: str, image_format: str = "png"):
+    """
+    Gets the bar chart with the number of packages that start or end at the nodes of each name. The chart is
+    rendered in the executor, and kept in the chart cache while the package counts do not change.
+
+    Args:
+        db: (AsyncSession): The database session.
+        side: (str): "start" to count by start node, or "end" to count by end node.
+        image_format: (str): "png" or "svg".
+
+    Returns:
+        RenderedChart: The image of the bar chart.
+    """
+    key = (side, image_format)
+
+    # The version is read first, so a chart of data that changed while it was rendered is not returned for
+    # the new data
+    version = await get_package_count_version(db)
+    chart = chart_cache.get(key, version)
+    if chart is None:
+        counts = await get_node_package_counts(db, side)
+
+        # The chart has one bar per node name, as bars of nodes with the same name would be drawn on top
+        totals = {}
+        for count in counts:
+            totals[count.name] = totals.get(count.name, 0) + count.packages
+
+        content = await executor.run(render_bar_chart, list(totals), list(totals.values()), CHART_TITLES[side],
+                                     image_format)
+        chart = RenderedChart(content, image_format)
+        chart_cache.put(key, version, chart)
+    return chart
 
-    # Get all packages from the database
-    all_packages_query = db.query(models.Package, models.Node.name).join(models.Node,
-                                                                         models.Package.end_node_id == models.Node.id).all()
 
-    # Create a DataFrame with the packages and the end nodes
-    group_end = pd.DataFrame(all_packages_query, columns=['Package', 'End Node'])
-    group_end = group_end.groupby('End Node').count()
+async def get_package_by_start_node(db: AsyncSession):
+    """
+    Create a bar chart with the number of packages that start at each node.
 
-    # Create a bar chart with the number of packages that end at each node
-    plt.figure(figsize=(15, 6))
-    plt.bar(group_end.index, group_end['Package'], width=0.5, color='blue')
-    plt.xlabel('Nodos')
-    plt.ylabel('Número de Paquetes')
-    plt.title('Número de Paquetes por Nodo Final')
-    plt.grid(True)
-    plt.tight_layout()
+    Args:
+        db: (AsyncSession): The database session.
 
-    # Save the plot to a buffer
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
+    Returns:
+        str: A base64 encoded image of the bar chart.
+
+    """
+    chart = await get_node_chart(db, "start")
 
     # Convert the bytes object to a base64 string
-    image_base64 = base64.b64encode(buffer.read()).decode()
+    return base64.b64encode(chart.content).decode()
+
+
+async def get_package_by_end_node(db: AsyncSession):
+    """
+    Create a bar chart with the number of packages that end at each node.
 
-    return image_base64
+    Args:
+        db: (AsyncSession): The database session.
+
+    Returns:
+        str: A base64 encoded image of the bar chart.
+    """
+    chart = await get_node_chart(db, "end")
+
+    # Convert the bytes object to a base64 string
+    return base64.b64encode(chart.content).decode()
@@ -0,0 +1,76 @@
+"""
+This module contains the distance calculations between coordinates.
+It includes the following:
+- The edge_distances function, which measures edges in batches with a reusable projection transformer
+- The haversine function, a vectorized great-circle distance
+"""
+
+# Standard library imports
+import threading
+
+# Third-party imports
+import numpy as np
+from pyproj import Transformer
+
+# Mean radius of the earth, in meters
+EARTH_RADIUS = 6371008.8
+
+# Coordinate system of the node coordinates, and projected coordinate system where edges are measured
+SOURCE_CRS = "EPSG:4686"
+PROJECTED_CRS = "EPSG:32633"
+
+# Each thread keeps its own transformer, because creating one is the slow part of a projection
+_local = threading.local()
+
+
+def _transformer():
+    """
+    Gets the projection transformer of the current thread, creating it on first use.
+    """
+    if not hasattr(_local, "transformer"):
+        _local.transformer = Transformer.from_crs(SOURCE_CRS, PROJECTED_CRS, always_xy=True)
+    return _local.transformer
+
+
+def edge_distances(start_lat, start_lng, end_lat, end_lng):
+    """
+    Calculates the distance of edges, projecting both ends and measuring the straight line between them.
+    The points are built as (lat, lng), the same way the distances of the existing edges were measured,
+    so the new distances can be compared with them. The arguments can be floats or NumPy arrays.
+
+    Args:
+        start_lat: (float | np.ndarray): The latitude of the start nodes.
+        start_lng: (float | np.ndarray): The longitude of the start nodes.
+        end_lat: (float | np.ndarray): The latitude of the end nodes.
+        end_lng: (float | np.ndarray): The longitude of the end nodes.
+
+    Returns:
+        np.ndarray: The distance of each edge.
+    """
+    transformer = _transformer()
+
+    # Project the start and end points of all the edges with one call each
+    start_x, start_y = transformer.transform(np.asarray(start_lat, dtype=np.float64),
+                                             np.asarray(start_lng, dtype=np.float64))
+    end_x, end_y = transformer.transform(np.asarray(end_lat, dtype=np.float64),
+                                         np.asarray(end_lng, dtype=np.float64))
+
+    return np.hypot(np.asarray(end_x) - start_x, np.asarray(end_y) - start_y)
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Calculates the great-circle distance between coordinates. The arguments can be floats or NumPy arrays.
+
+    Args:
+        lat1: (float | np.ndarray): The latitude of the first points.
+        lng1: (float | np.ndarray): The longitude of the first points.
+        lat2: (float | np.ndarray): The latitude of the second points.
+        lng2: (float | np.ndarray): The longitude of the second points.
+
+    Returns:
+        float | np.ndarray: The distance between the points, in meters.
+    """
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
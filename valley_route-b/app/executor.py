@@ -0,0 +1,424 @@
+"""
+This module contains the executor layer where the CPU-bound work of the API runs, away from the event loop.
+It includes the following:
+- The SharedGraph class, which publishes the arrays of a graph snapshot in shared memory for worker processes
+- The TaskExecutor class, a process or thread pool with a bounded number of pending tasks and per-task timeouts
+- The process-level executor instance used by the route engine and the statistics charts
+
+With the process pool, each worker keeps its own copy of the values derived from the snapshot, such as the
+A* heuristic, and reads the contraction hierarchy from the file written by the API process.
+"""
+
+# Standard library imports
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Optional
+
+# Third-party imports
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Local imports (project-specific)
+from app.graph import GraphSnapshot
+
+# Pool where the tasks run: "process", or "thread" to run them in threads of the API process
+EXECUTOR_MODE = os.getenv("EXECUTOR_MODE", "process")
+
+# Number of workers of the pool
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+
+# Number of tasks that can wait for a free worker, more tasks are rejected
+EXECUTOR_QUEUE_SIZE = int(os.getenv("EXECUTOR_QUEUE_SIZE", "64"))
+
+# Maximum number of seconds a request waits for its task
+EXECUTOR_TIMEOUT = float(os.getenv("EXECUTOR_TIMEOUT", "30"))
+
+# Number of published snapshots kept in shared memory after their last task finished, so the next tasks of
+# a recent snapshot do not copy it again. Older snapshots are freed once no queued or running task uses them
+SHARED_GRAPH_GENERATIONS = 2
+
+
+class ExecutorBusyError(RuntimeError):
+    """
+    ExecutorBusyError is raised when a task is submitted while the queue of the executor is full.
+    """
+    pass
+
+
+class TaskTimeoutError(TimeoutError):
+    """
+    TaskTimeoutError is raised when a task does not finish within its timeout.
+    """
+    pass
+
+
+class SharedGraph:
+    """
+    SharedGraph is a small, picklable reference to the arrays of a graph snapshot stored in shared memory.
+    Worker processes attach to the blocks instead of receiving a copy of the graph with every task.
+
+    Attributes:
+    - version (int): The version of the snapshot.
+    - arrays (dict[str, tuple[str, str, int]]): The shared memory block, dtype and length of each array.
+    """
+
+    # The arrays needed to rebuild a snapshot
+    FIELDS = ("node_ids", "lat", "lng", "indptr", "indices", "data")
+
+    # Snapshots attached by the current worker process, by version
+    _attached = {}
+
+    def __init__(self, version: int, arrays: dict[str, tuple[str, str, int]]):
+        """
+        Initialize the SharedGraph object.
+        Args:
+            version: (int): The version of the snapshot.
+            arrays: (dict[str, tuple[str, str, int]]): The block name, dtype and length of each array.
+
+        Returns: None
+        """
+        self.version = version
+        self.arrays = arrays
+
+    @classmethod
+    def publish(cls, graph: GraphSnapshot):
+        """
+        Copies the arrays of a snapshot to new shared memory blocks.
+
+        Args:
+            graph: (GraphSnapshot): The graph snapshot.
+
+        Returns:
+            tuple[SharedGraph, list[SharedMemory]]: The reference to the snapshot and the blocks, which are
+            owned by the caller.
+        """
+        values = {"node_ids": graph.node_ids, "lat": graph.lat, "lng": graph.lng, "indptr": graph.matrix.indptr,
+                  "indices": graph.matrix.indices, "data": graph.matrix.data}
+        arrays = {}
+        blocks = []
+        for field in cls.FIELDS:
+            value = np.ascontiguousarray(values[field])
+
+            # Empty arrays still need a block of one byte
+            block = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+            np.ndarray(value.shape, dtype=value.dtype, buffer=block.buf)[:] = value
+            arrays[field] = (block.name, value.dtype.str, len(value))
+            blocks.append(block)
+        return cls(graph.version, arrays), blocks
+
+    def attach(self):
+        """
+        Gets the snapshot in the current worker process, attaching to the shared memory the first time.
+        Only the latest version is kept, so the derived values of older snapshots are released.
+
+        Returns:
+            GraphSnapshot: The graph snapshot, backed by the shared memory blocks.
+        """
+        attached = self._attached.get(self.version)
+        if attached is not None:
+            return attached[0]
+
+        blocks = {field: shared_memory.SharedMemory(name=name) for field, (name, _, _) in self.arrays.items()}
+        values = {field: np.ndarray((length,), dtype=np.dtype(dtype), buffer=blocks[field].buf)
+                  for field, (_, dtype, length) in self.arrays.items()}
+
+        size = len(values["node_ids"])
+        matrix = csr_matrix((values["data"], values["indices"], values["indptr"]), shape=(size, size), copy=False)
+        index = {int(node_id): position for position, node_id in enumerate(values["node_ids"].tolist())}
+        graph = GraphSnapshot(values["node_ids"], values["lat"], values["lng"], matrix, index, self.version)
+
+        if self.version > max(self._attached, default=-1):
+            self._release()
+        self._attached[self.version] = (graph, blocks)
+        return graph
+
+    @classmethod
+    def _release(cls):
+        """
+        Drops the snapshots attached by the current worker process and closes their blocks.
+        """
+        for version in list(cls._attached):
+            graph, blocks = cls._attached.pop(version)
+            del graph
+            for block in blocks.values():
+                try:
+                    block.close()
+                except BufferError:
+                    # The arrays are still referenced, the block is closed when they are collected
+                    pass
+
+
+class _Publication:
+    """
+    The shared memory copy of a graph snapshot, with the number of queued and running tasks that use it.
+    """
+
+    def __init__(self):
+        self.shared = None
+        self.blocks = []
+        self.tasks = 0
+
+
+def _init_worker():
+    """
+    Prepares a worker process of the pool.
+    """
+    # The API process rebuilds the contraction hierarchy, the workers read it from its file
+    from app.contraction import contraction_index
+    contraction_index.build = False
+
+
+def _run_with_graph(function, graph, *args):
+    """
+    Runs a task that takes a graph snapshot, attaching to the shared snapshot in worker processes.
+    """
+    if isinstance(graph, SharedGraph):
+        graph = graph.attach()
+    return function(graph, *args)
+
+
+class TaskExecutor:
+    """
+    TaskExecutor runs the CPU-bound tasks of the API in a pool of workers, so the event loop keeps serving
+    the light endpoints while routes are computed and charts are rendered.
+
+    The number of tasks waiting or running is bounded, and tasks submitted while the executor is full are
+    rejected at once. A request stops waiting for its task after the timeout, and the task is cancelled if it
+    has not started yet.
+
+    Attributes:
+    - mode (str): "process" or "thread".
+    - workers (int): The number of workers of the pool.
+    - queue_size (int): The number of tasks that can wait for a free worker.
+    - timeout (float): The default number of seconds a request waits for its task.
+    """
+
+    def __init__(self, mode: str = EXECUTOR_MODE, workers: int = EXECUTOR_WORKERS,
+                 queue_size: int = EXECUTOR_QUEUE_SIZE, timeout: float = EXECUTOR_TIMEOUT):
+        """
+        Initialize the TaskExecutor object. The pool is created when the first task is submitted.
+        Args:
+            mode: (str): "process" or "thread".
+            workers: (int): The number of workers of the pool.
+            queue_size: (int): The number of tasks that can wait for a free worker.
+            timeout: (float): The default number of seconds a request waits for its task.
+
+        Returns: None
+        """
+        if mode not in ("process", "thread"):
+            raise ValueError(f"Unknown executor mode '{mode}'")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._pending = 0
+        self._pool = None
+        self._published = []
+        self._lock = threading.Lock()
+
+    async def run(self, function, *args, timeout: Optional[float] = None):
+        """
+        Runs a function in the pool and waits for its result.
+
+        Args:
+            function: (Callable): The function, a module-level function when the pool uses processes.
+            *args: The arguments of the function.
+            timeout: (Optional[float]): The number of seconds to wait, the default timeout if None.
+
+        Returns:
+            Any: The result of the function.
+
+        Raises:
+            ExecutorBusyError: If the queue of the executor is full.
+            TaskTimeoutError: If the task does not finish within the timeout.
+        """
+        return await self._wait(self._start(function, *args), timeout)
+
+    async def run_graph(self, function, graph: GraphSnapshot, *args, timeout: Optional[float] = None):
+        """
+        Runs a function that takes a graph snapshot as its first argument. Worker processes receive a
+        reference to the snapshot in shared memory instead of a copy.
+
+        Args:
+            function: (Callable): The function, called as function(graph, *args).
+            graph: (GraphSnapshot): The graph snapshot.
+            *args: The other arguments of the function.
+            timeout: (Optional[float]): The number of seconds to wait, the default timeout if None.
+
+        Returns:
+            Any: The result of the function.
+        """
+        if self.mode != "process":
+            return await self.run(_run_with_graph, function, graph, *args, timeout=timeout)
+
+        # The shared memory of the snapshot is kept until the task finishes, even if the request stopped waiting
+        publication = self._acquire(graph)
+        try:
+            future = self._start(_run_with_graph, function, publication.shared, *args)
+        except Exception:
+            self._release(publication)
+            raise
+        future.add_done_callback(lambda _: self._release(publication))
+        return await self._wait(future, timeout)
+
+    def stats(self):
+        """
+        Gets the configuration and counters of the executor.
+
+        Returns:
+            dict: The mode, size, pending tasks, and completed, rejected and timed out tasks of the executor.
+        """
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "timeout": self.timeout,
+                "pending": self._pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+    def shutdown(self):
+        """
+        Stops the pool and frees the shared memory of the published snapshots.
+
+        Returns: None
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            published, self._published = self._published, []
+            expired = [publication.blocks for publication in published]
+            for publication in published:
+                publication.shared, publication.blocks = None, []
+        for blocks in expired:
+            self._unlink(blocks)
+
+    def _start(self, function, *args):
+        """
+        Takes a place in the queue and submits a task, or rejects it if the queue is full.
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise ExecutorBusyError("The server is busy, try again later")
+            self._pending += 1
+
+        try:
+            future = self._submit(function, *args)
+        except Exception:
+            self._task_done(None)
+            raise
+
+        # The task keeps its place until it finishes, even if the request stopped waiting for it
+        future.add_done_callback(self._task_done)
+        return future
+
+    async def _wait(self, future, timeout: Optional[float]):
+        """
+        Waits for the result of a submitted task.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise TaskTimeoutError("The task did not finish in time")
+
+    def _submit(self, function, *args):
+        """
+        Submits a task to the pool, creating the pool again if a worker process died.
+        """
+        try:
+            return self._get_pool().submit(function, *args)
+        except BrokenProcessPool:
+            with self._lock:
+                self._pool = None
+            return self._get_pool().submit(function, *args)
+
+    def _get_pool(self):
+        """
+        Gets the pool, creating it on first use.
+        """
+        with self._lock:
+            if self._pool is None:
+                if self.mode == "process":
+                    # Workers are spawned, because forking a process with running threads is not safe
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="executor")
+            return self._pool
+
+    def _task_done(self, future):
+        """
+        Frees the place of a finished task.
+        """
+        with self._lock:
+            self._pending -= 1
+            if future is not None and not future.cancelled():
+                self.completed += 1
+
+    def _acquire(self, graph: GraphSnapshot):
+        """
+        Counts a new task of a snapshot, publishing the snapshot in shared memory if it is not there, as the
+        first time or after its blocks were freed.
+        """
+        publication = graph.derived("shared_memory", lambda _: _Publication())
+        with self._lock:
+            if publication.shared is None:
+                publication.shared, publication.blocks = SharedGraph.publish(graph)
+                self._published.append(publication)
+            publication.tasks += 1
+            expired = self._expire()
+        for blocks in expired:
+            self._unlink(blocks)
+        return publication
+
+    def _release(self, publication: _Publication):
+        """
+        Counts a finished task of a snapshot, and frees the snapshots that are no longer needed.
+        """
+        with self._lock:
+            publication.tasks -= 1
+            expired = self._expire()
+        for blocks in expired:
+            self._unlink(blocks)
+
+    def _expire(self):
+        """
+        Removes the published snapshots older than the last SHARED_GRAPH_GENERATIONS that no task uses, and
+        returns their blocks. It is called with the lock held.
+        """
+        expired = []
+        for publication in self._published[:-SHARED_GRAPH_GENERATIONS]:
+            if publication.tasks == 0:
+                self._published.remove(publication)
+                expired.append(publication.blocks)
+                publication.shared, publication.blocks = None, []
+        return expired
+
+    @staticmethod
+    def _unlink(blocks):
+        """
+        Closes and removes shared memory blocks.
+        """
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+# The executor of the process
+executor = TaskExecutor()
@@ -0,0 +1,106 @@
+"""
+This module contains the streaming exports of nodes, edges and packages.
+It includes the following:
+- The export_nodes, export_edges and export_packages functions, which stream a table as NDJSON or as a JSON array
+- The media type of each export format
+
+The rows are read with a server-side cursor, in partitions of EXPORT_CHUNK_SIZE rows, and each partition is
+encoded and sent before the next one is read, so the memory used does not depend on the size of the table.
+Each export opens its own database session, because the session of the request is closed before a
+streaming response starts sending its body.
+"""
+
+# Standard library imports
+import json
+import os
+
+# Third-party imports
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+# Local imports (project-specific)
+from app import models
+from app.database import AsyncSessionLocal
+
+# Number of rows read from the cursor and encoded at a time
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+
+# Media type of each export format
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+
+async def _stream(statement, fields: tuple[str, ...], file_format: str):
+    """
+    Streams the rows of a query as NDJSON lines or as the items of a JSON array.
+    """
+    encoder = json.JSONEncoder(default=lambda value: value.isoformat(), ensure_ascii=False)
+    separator = "\n" if file_format == "ndjson" else ","
+    first = True
+
+    if file_format == "json":
+        yield "["
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(statement.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        async for rows in result.partitions():
+            chunk = separator.join(encoder.encode(dict(zip(fields, row))) for row in rows)
+            if file_format == "ndjson":
+                yield chunk + "\n"
+            else:
+                yield chunk if first else "," + chunk
+            first = False
+
+    if file_format == "json":
+        yield "]"
+
+
+def export_nodes(file_format: str = "ndjson"):
+    """
+    Streams all the nodes, ordered by id.
+
+    Args:
+        file_format: (str): "ndjson" or "json".
+
+    Returns:
+        AsyncIterator[str]: The chunks of the export.
+    """
+    statement = select(models.Node.id, models.Node.name, models.Node.lat, models.Node.lng).order_by(models.Node.id)
+    return _stream(statement, ("id", "name", "lat", "lng"), file_format)
+
+
+def export_edges(file_format: str = "ndjson"):
+    """
+    Streams all the edges, ordered by id. The nodes are referenced by id, to be joined with the node export.
+
+    Args:
+        file_format: (str): "ndjson" or "json".
+
+    Returns:
+        AsyncIterator[str]: The chunks of the export.
+    """
+    statement = (select(models.Edge.id, models.Edge.start_node_id, models.Edge.end_node_id, models.Edge.distance)
+                 .order_by(models.Edge.id))
+    return _stream(statement, ("id", "start_node_id", "end_node_id", "distance"), file_format)
+
+
+def export_packages(owner_id: int, file_format: str = "ndjson"):
+    """
+    Streams all the packages of a user, ordered by id, with the names of their start and end nodes.
+
+    Args:
+        owner_id: (int): The ID of the user who owns the packages.
+        file_format: (str): "ndjson" or "json".
+
+    Returns:
+        AsyncIterator[str]: The chunks of the export.
+    """
+    start_node = aliased(models.Node)
+    end_node = aliased(models.Node)
+    statement = (select(models.Package.id, models.Package.description, models.Package.created_at,
+                        models.Package.start_node_id, start_node.name, models.Package.end_node_id, end_node.name)
+                 .outerjoin(start_node, models.Package.start_node_id == start_node.id)
+                 .outerjoin(end_node, models.Package.end_node_id == end_node.id)
+                 .where(models.Package.user_id == owner_id)
+                 .order_by(models.Package.id))
+    fields = ("id", "description", "created_at", "start_node_id", "start_node", "end_node_id", "end_node")
+    return _stream(statement, fields, file_format)
@@ -0,0 +1,469 @@
+"""
+This module contains the in-memory routing graph shared by all the requests of the process.
+It includes the following:
+- The GraphSnapshot class, an immutable CSR view of the checkpoint graph
+- The GraphStore class, which loads the graph once, keeps it updated in place, and reloads it when the tables
+  were changed by another process
+- The process-level graph_store instance used by the CRUD functions
+"""
+
+# Standard library imports
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Third-party imports
+import numpy as np
+from scipy.sparse import csr_matrix
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local imports (project-specific)
+from app import models
+
+# Seconds between two checks of the row counts of the node and edge tables, to reload the graph when another
+# process, such as the command line import, added rows
+GRAPH_CHECK_INTERVAL = float(os.getenv("GRAPH_CHECK_INTERVAL", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class GraphSnapshot:
+    """
+    GraphSnapshot is an immutable view of the checkpoint graph at a given moment. The graph is stored as a
+    symmetric scipy.sparse CSR adjacency matrix, where the row and column indexes are positions in node_ids.
+
+    Attributes:
+    - node_ids (np.ndarray): The id of the node stored at each matrix index.
+    - lat (np.ndarray): The latitude of each node, by matrix index.
+    - lng (np.ndarray): The longitude of each node, by matrix index.
+    - matrix (csr_matrix): The adjacency matrix, with the edge distances as values.
+    - version (int): The version of the graph the snapshot was taken from.
+    """
+
+    def __init__(self, node_ids: np.ndarray, lat: np.ndarray, lng: np.ndarray, matrix: csr_matrix,
+                 index: dict[int, int], version: int):
+        """
+        Initialize the GraphSnapshot object.
+        Args:
+            node_ids: (np.ndarray): The id of the node stored at each matrix index.
+            lat: (np.ndarray): The latitude of each node.
+            lng: (np.ndarray): The longitude of each node.
+            matrix: (csr_matrix): The adjacency matrix of the graph.
+            index: (dict[int, int]): The matrix index of each node id, shared with the store.
+            version: (int): The version of the graph.
+
+        Returns: None
+        """
+        self.node_ids = node_ids
+        self.lat = lat
+        self.lng = lng
+        self.matrix = matrix
+        self.version = version
+        self._index = index
+
+        # Values derived from the snapshot, such as routing indexes, computed on first use
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    @property
+    def size(self):
+        """
+        Number of nodes in the snapshot.
+
+        Returns:
+            int: The number of nodes.
+        """
+        return len(self.node_ids)
+
+    def index_of(self, node_id: int):
+        """
+        Gets the matrix index of a node.
+
+        Args:
+            node_id: (int): The id of the node.
+
+        Returns:
+            int | None: The matrix index of the node, or None if the node is not part of this snapshot.
+        """
+        # The index is shared with the store, so nodes added after the snapshot are filtered out
+        index = self._index.get(int(node_id))
+        if index is None or index >= self.size:
+            return None
+        return index
+
+    def derived(self, key: str, factory):
+        """
+        Gets a value derived from the snapshot, computing it the first time it is requested. The value lives
+        as long as the snapshot, so it is discarded as soon as the graph changes.
+
+        Args:
+            key: (str): The name of the derived value.
+            factory: (Callable[[GraphSnapshot], Any]): The function that computes the value from the snapshot.
+
+        Returns:
+            Any: The derived value.
+        """
+        with self._derived_lock:
+            if key not in self._derived:
+                self._derived[key] = factory(self)
+            return self._derived[key]
+
+
+class _ArrayBuffer:
+    """
+    A numpy array that doubles its capacity when it is full, so values are appended in amortized
+    constant time and the filled part is copied with a single memory copy.
+    """
+
+    def __init__(self, dtype):
+        """
+        Initialize an empty buffer.
+        """
+        self._array = np.empty(1024, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value):
+        """
+        Appends a value, growing the array if it is full.
+        """
+        if self._size == len(self._array):
+            self._array = np.concatenate((self._array, np.empty(len(self._array), dtype=self._array.dtype)))
+        self._array[self._size] = value
+        self._size += 1
+
+    def clear(self):
+        """
+        Removes all the values, keeping the capacity.
+        """
+        self._size = 0
+
+    def values(self):
+        """
+        Copies the filled part of the array.
+        """
+        return self._array[:self._size].copy()
+
+
+class GraphStore:
+    """
+    GraphStore keeps the routing graph of the process in memory. The graph is read from the node and edge
+    tables the first time it is needed, and after that it is updated in place by new_node and new_edge,
+    so route queries never scan the tables or allocate a dense matrix.
+
+    The version of the graph is the number of node and edge rows it contains. Nodes and edges are never
+    updated or deleted, so the version increases with every commit of new_node or new_edge, and a process
+    that reads the same tables gets the same version.
+
+    Rows added by another process are not seen by new_node and new_edge, so the row counts of the tables are
+    compared with the store every GRAPH_CHECK_INTERVAL seconds, and the graph is reloaded when they differ or
+    when an edge references a node the store does not have. The nodes keep their matrix index when the graph
+    is reloaded, so the indexes built from older snapshots stay valid.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty, not yet loaded, GraphStore.
+
+        Returns: None
+        """
+        self._lock = threading.Lock()
+        self._load_lock = asyncio.Lock()
+        self._build_lock = asyncio.Lock()
+        self._loaded = False
+        self._snapshot = None
+
+        # Reload state: the graph must be reloaded, time of the next check of the tables, edits of this process
+        # between their commit and their addition to the store, and number of edits started
+        self._stale = False
+        self._next_check = 0.0
+        self._editing = 0
+        self._edits = 0
+        self._lost_nodes = 0
+
+        # Node data, by matrix index
+        self._index = {}
+        self._node_ids = _ArrayBuffer(np.int64)
+        self._lat = _ArrayBuffer(np.float64)
+        self._lng = _ArrayBuffer(np.float64)
+
+        # Edge data, one entry per edge row
+        self._starts = _ArrayBuffer(np.int32)
+        self._ends = _ArrayBuffer(np.int32)
+        self._distances = _ArrayBuffer(np.float64)
+        self._edge_rows = 0
+
+    @property
+    def version(self):
+        """
+        Version of the graph, it increases every time a node or an edge is added.
+
+        Returns:
+            int: The version of the graph.
+        """
+        return len(self._node_ids) + self._edge_rows
+
+    async def load(self, db: AsyncSession):
+        """
+        Loads the whole graph from the database, if it has not been loaded yet. Once loaded, the row counts
+        of the tables are checked every GRAPH_CHECK_INTERVAL seconds, and the graph is reloaded if they changed.
+
+        Args:
+            db: (AsyncSession): The database session.
+
+        Returns: None
+        """
+        if self._loaded and not self._stale and time.monotonic() < self._next_check:
+            return
+
+        # Concurrent requests wait for the first load instead of reading the tables again
+        async with self._load_lock:
+            if not self._loaded:
+                nodes, edges = await self._read_tables(db)
+                with self._lock:
+                    for node_id, lat, lng in nodes:
+                        self._append_node(node_id, lat, lng)
+                    for start_node_id, end_node_id, distance in edges:
+                        self._append_edge(start_node_id, end_node_id, distance)
+                    self._loaded = True
+                self._next_check = time.monotonic() + GRAPH_CHECK_INTERVAL
+            elif self._stale or time.monotonic() >= self._next_check:
+                await self._reload(db)
+
+    @contextmanager
+    def editing(self):
+        """
+        Marks an edit of this process, from the commit of its rows to their addition to the store. The graph
+        is not reloaded while an edit is running, because the reload could read its rows before the edit adds
+        them again.
+
+        Returns:
+            ContextManager[None]: The context of the edit.
+        """
+        with self._lock:
+            self._editing += 1
+            self._edits += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._editing -= 1
+
+    def add_node(self, node: models.Node):
+        """
+        Adds a committed node to the graph. Nothing is done if the graph has not been loaded yet,
+        because the node will be read with the rest of the table.
+
+        Args:
+            node: (models.Node): The node to add.
+
+        Returns: None
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            self._append_node(node.id, node.lat, node.lng)
+            self._snapshot = None
+
+    def add_edge(self, edge: models.Edge):
+        """
+        Adds a committed edge to the graph. Nothing is done if the graph has not been loaded yet,
+        because the edge will be read with the rest of the table.
+
+        Args:
+            edge: (models.Edge): The edge to add.
+
+        Returns: None
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            self._append_edge(edge.start_node_id, edge.end_node_id, edge.distance)
+            self._snapshot = None
+
+    def add_nodes(self, nodes):
+        """
+        Adds many committed nodes to the graph, as done by the bulk import.
+
+        Args:
+            nodes: (Iterable[tuple[int, float, float]]): The id, latitude and longitude of each node.
+
+        Returns: None
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            for node_id, lat, lng in nodes:
+                self._append_node(node_id, lat, lng)
+            self._snapshot = None
+
+    def add_edges(self, edges):
+        """
+        Adds many committed edges to the graph, as done by the bulk import.
+
+        Args:
+            edges: (Iterable[tuple[int, int, float]]): The start node id, end node id and distance of each edge.
+
+        Returns: None
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            for start_node_id, end_node_id, distance in edges:
+                self._append_edge(start_node_id, end_node_id, distance)
+            self._snapshot = None
+
+    async def snapshot(self, db: AsyncSession):
+        """
+        Gets the current snapshot of the graph, loading the graph first if needed. The CSR matrix is only
+        rebuilt when a node or edge was added since the previous call, in a thread so the event loop keeps
+        serving requests, and concurrent calls wait for the same rebuild.
+
+        Args:
+            db: (AsyncSession): The database session.
+
+        Returns:
+            GraphSnapshot: The current snapshot of the graph.
+        """
+        await self.load(db)
+        if self._snapshot is not None:
+            return self._snapshot
+
+        async with self._build_lock:
+            # Copy the filled part of the buffers, the matrix is built from the copies outside the lock
+            with self._lock:
+                if self._snapshot is not None:
+                    return self._snapshot
+                arrays = (self._node_ids.values(), self._lat.values(), self._lng.values(), self._starts.values(),
+                          self._ends.values(), self._distances.values())
+                version = self.version
+
+            snapshot = await asyncio.to_thread(self._build_snapshot, *arrays, self._index, version)
+
+            # A snapshot of a graph that changed while it was built is returned, but not kept
+            with self._lock:
+                if self.version == version:
+                    self._snapshot = snapshot
+            return snapshot
+
+    def _append_node(self, node_id, lat, lng):
+        """
+        Appends a node to the node arrays, ignoring nodes that are already present.
+        """
+        if node_id in self._index:
+            return
+        self._index[node_id] = len(self._node_ids)
+        self._node_ids.append(node_id)
+        self._lat.append(lat)
+        self._lng.append(lng)
+
+    def _append_edge(self, start_node_id, end_node_id, distance):
+        """
+        Appends an edge to the edge arrays, ignoring edges without a distance. An edge with a node that is not
+        in the store was added by another process, so it is not counted and the graph is marked to be reloaded.
+        """
+        start, end = self._index.get(start_node_id), self._index.get(end_node_id)
+        if start is None or end is None:
+            self._stale = True
+            return
+        self._edge_rows += 1
+        if distance is None:
+            return
+        self._starts.append(start)
+        self._ends.append(end)
+        self._distances.append(distance)
+
+    @staticmethod
+    async def _read_tables(db: AsyncSession):
+        """
+        Reads the columns of the node and edge tables needed for routing.
+        """
+        nodes = (await db.execute(select(models.Node.id, models.Node.lat, models.Node.lng)
+                                  .order_by(models.Node.id))).all()
+        edges = (await db.execute(select(models.Edge.start_node_id, models.Edge.end_node_id,
+                                         models.Edge.distance))).all()
+        return nodes, edges
+
+    async def _reload(self, db: AsyncSession):
+        """
+        Reloads the graph if the row counts of the tables differ from the store, or if it was marked to be
+        reloaded. The new nodes are appended, and the edges are read again.
+        """
+        self._next_check = time.monotonic() + GRAPH_CHECK_INTERVAL
+        with self._lock:
+            if self._editing:
+                return
+            edits = self._edits
+            counts = (len(self._node_ids) - self._lost_nodes, self._edge_rows)
+
+        if not self._stale:
+            result = await db.execute(select(select(func.count(models.Node.id)).scalar_subquery(),
+                                             select(func.count(models.Edge.id)).scalar_subquery()))
+            if tuple(result.one()) == counts:
+                return
+
+        nodes, edges = await self._read_tables(db)
+        with self._lock:
+            # An edit of this process started while the tables were read, so they are checked again
+            if self._editing or self._edits != edits:
+                self._next_check = 0.0
+                return
+
+            old_version = self.version
+            node_ids = {node_id for node_id, _, _ in nodes}
+            for node_id, lat, lng in nodes:
+                self._append_node(node_id, lat, lng)
+
+            # Nodes are never deleted by the API, a node missing from the table stays in the graph without edges
+            self._lost_nodes = int(np.count_nonzero(~np.isin(self._node_ids.values(),
+                                                             np.fromiter(node_ids, dtype=np.int64))))
+            if self._lost_nodes:
+                logger.warning("%s nodes of the routing graph are no longer in the node table", self._lost_nodes)
+
+            for buffer in (self._starts, self._ends, self._distances):
+                buffer.clear()
+            self._edge_rows = 0
+            self._stale = False
+            for start_node_id, end_node_id, distance in edges:
+                self._append_edge(start_node_id, end_node_id, distance)
+            self._snapshot = None
+
+        logger.info("Reloaded the routing graph from version %s to %s", old_version, self.version)
+
+    @staticmethod
+    def _build_snapshot(node_ids: np.ndarray, lat: np.ndarray, lng: np.ndarray, starts: np.ndarray,
+                        ends: np.ndarray, distances: np.ndarray, index: dict[int, int], version: int):
+        """
+        Builds the CSR matrix of a copy of the node and edge arrays.
+        """
+        size = len(node_ids)
+
+        # The graph is undirected, so every pair is stored as (low, high) and self loops are dropped
+        low = np.minimum(starts, ends)
+        high = np.maximum(starts, ends)
+        keep = low != high
+        low, high, distances = low[keep], high[keep], distances[keep]
+
+        # Keep only the shortest edge between each pair of nodes
+        order = np.lexsort((distances, high, low))
+        low, high, distances = low[order], high[order], distances[order]
+        first = np.ones(len(low), dtype=bool)
+        first[1:] = (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+        low, high, distances = low[first], high[first], distances[first]
+
+        # Store both directions so the matrix is symmetric
+        rows = np.concatenate((low, high))
+        cols = np.concatenate((high, low))
+        matrix = csr_matrix((np.concatenate((distances, distances)), (rows, cols)), shape=(size, size))
+
+        return GraphSnapshot(node_ids, lat, lng, matrix, index, version)
+
+
+# The graph of the process, shared by all the requests
+graph_store = GraphStore()
@@ -0,0 +1,102 @@
+"""
+This module contains the compact binary export of the routing graph, for the map clients.
+It includes the following:
+- The encode_graph function, which packs a graph snapshot into typed arrays
+- The build_graph_export function, which encodes and compresses the export in the workers of the executor
+- The content encodings supported by the export, with brotli only when its package is installed
+
+Format (little-endian):
+    header      magic "VRG1", then uint32 version, node count (N) and adjacency count (M)
+    node_ids    int32[N]    the id of the node at each position
+    lat         float32[N]  the latitude of each node
+    lng         float32[N]  the longitude of each node
+    offsets     int32[N+1]  the adjacency of node i is targets[offsets[i]:offsets[i+1]]
+    targets     int32[M]    the position of each neighbor
+    distances   float32[M]  the distance of each adjacency
+
+The arrays are the CSR adjacency used by the route engine. The graph is undirected, so every edge appears
+in the adjacency of both of its nodes, and only the shortest edge between two nodes is kept.
+"""
+
+# Standard library imports
+import gzip
+import hashlib
+from typing import Optional
+
+# Third-party imports
+import numpy as np
+
+# Local imports (project-specific)
+from app.graph import GraphSnapshot
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# First bytes of every export
+GRAPH_EXPORT_MAGIC = b"VRG1"
+
+# Content encodings of the export, in order of preference
+GRAPH_EXPORT_ENCODINGS = ("br", "gzip", "identity") if brotli is not None else ("gzip", "identity")
+
+
+def encode_graph(graph: GraphSnapshot):
+    """
+    Packs a graph snapshot into the binary export format.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+
+    Returns:
+        bytes: The uncompressed export.
+    """
+    matrix = graph.matrix.sorted_indices()
+    header = np.array([graph.version, graph.size, matrix.nnz], dtype="<u4")
+    arrays = (graph.node_ids.astype("<i4"), graph.lat.astype("<f4"), graph.lng.astype("<f4"),
+              matrix.indptr.astype("<i4"), matrix.indices.astype("<i4"), matrix.data.astype("<f4"))
+    return GRAPH_EXPORT_MAGIC + header.tobytes() + b"".join(array.tobytes() for array in arrays)
+
+
+def build_graph_export(graph: GraphSnapshot, encoding: str):
+    """
+    Encodes and compresses a graph snapshot. It runs in the workers of the executor.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+        encoding: (str): "br", "gzip" or "identity".
+
+    Returns:
+        tuple[bytes, str]: The export, and its ETag, computed from the uncompressed export and suffixed with
+        the encoding, so each representation has its own strong ETag.
+    """
+    payload = encode_graph(graph)
+    digest = hashlib.sha1(payload).hexdigest()
+    etag = f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+    if encoding == "br":
+        payload = brotli.compress(payload, quality=5)
+    elif encoding == "gzip":
+        payload = gzip.compress(payload, compresslevel=6)
+    return payload, etag
+
+
+def choose_encoding(accept_encoding: Optional[str]):
+    """
+    Chooses the content encoding of the export from the Accept-Encoding header of the request.
+
+    Args:
+        accept_encoding: (Optional[str]): The Accept-Encoding header.
+
+    Returns:
+        str: The preferred encoding accepted by the client, "identity" if none is.
+    """
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        name, _, parameters = item.strip().partition(";")
+        if parameters.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(name.strip().lower())
+
+    for encoding in GRAPH_EXPORT_ENCODINGS:
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return "identity"
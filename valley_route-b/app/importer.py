@@ -0,0 +1,354 @@
+"""
+This module contains the bulk import of nodes and edges from CSV and GeoJSON files.
+It includes the following:
+- Readers that stream the records of CSV, GeoJSON and GeoJSON sequence files in chunks
+- The import_nodes and import_edges functions, which write each chunk with multi-row inserts
+- The command line entry point, to import files without going through the API. A running API sees the rows
+  within GRAPH_CHECK_INTERVAL seconds, when it compares the row counts of the tables with its graph
+
+Usage:
+    python -m app.importer nodes nodes.csv
+    python -m app.importer edges edges.geojson --chunk-size 10000
+"""
+
+# Standard library imports
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+from typing import TextIO
+
+# Third-party imports
+import numpy as np
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local imports (project-specific)
+from app import models
+from app.database import AsyncSessionLocal
+from app.distance import edge_distances
+from app.contraction import contraction_index
+from app.graph import GRAPH_CHECK_INTERVAL, GraphSnapshot, graph_store
+from app.package_routes import route_maintenance
+from app.routing import graph_changed
+
+# Number of records written with each multi-row insert
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+
+# Formats accepted by the import, by file extension
+FILE_FORMATS = {".csv": "csv", ".geojson": "geojson", ".json": "geojson", ".geojsonl": "geojsonseq",
+                ".geojsons": "geojsonseq", ".ndjson": "geojsonseq"}
+
+# Start of the features array of a GeoJSON FeatureCollection
+_FEATURES_START = re.compile(r'"features"\s*:\s*\[')
+
+
+class ImportFileError(ValueError):
+    """
+    ImportFileError is raised when a record of an import file is not valid. Nothing of the file is written.
+    """
+    pass
+
+
+def detect_format(filename: str):
+    """
+    Gets the format of an import file from its extension.
+
+    Args:
+        filename: (str): The name of the file.
+
+    Returns:
+        str: "csv", "geojson" or "geojsonseq".
+
+    Raises:
+        ImportFileError: If the extension is not supported.
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension not in FILE_FORMATS:
+        raise ImportFileError(f"Unsupported file extension '{extension}'")
+    return FILE_FORMATS[extension]
+
+
+def _iter_geojson_features(stream: TextIO, read_size: int = 65536):
+    """
+    Yields the features of a GeoJSON FeatureCollection one by one, reading the file in blocks so the whole
+    collection is never held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    finished = False
+
+    while not finished:
+        block = stream.read(read_size)
+        buffer += block
+
+        # Skip everything before the features array
+        if not started:
+            match = _FEATURES_START.search(buffer)
+            if match is None:
+                if not block:
+                    raise ImportFileError("The file is not a GeoJSON FeatureCollection")
+                continue
+            buffer = buffer[match.end():]
+            started = True
+
+        # Decode the complete features of the buffer, and keep the rest for the next block
+        while True:
+            buffer = buffer.lstrip(" \t\r\n,")
+            if buffer.startswith("]"):
+                finished = True
+                break
+            try:
+                feature, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if not block:
+                    raise ImportFileError("The GeoJSON file is truncated or not valid")
+                break
+            buffer = buffer[end:]
+            yield feature
+
+
+def _iter_geojson_sequence(stream: TextIO):
+    """
+    Yields the features of a GeoJSON sequence file, with one feature per line.
+    """
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip().lstrip("\x1e")
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            raise ImportFileError(f"Line {line_number} is not a valid GeoJSON feature")
+
+
+def _iter_records(stream: TextIO, file_format: str):
+    """
+    Yields the records of a file as dictionaries. The properties of GeoJSON features are merged with
+    their geometry, stored under the "coordinates" key.
+    """
+    if file_format == "csv":
+        yield from csv.DictReader(stream)
+        return
+
+    features = _iter_geojson_features(stream) if file_format == "geojson" else _iter_geojson_sequence(stream)
+    for feature in features:
+        record = dict(feature.get("properties") or {})
+        record["coordinates"] = (feature.get("geometry") or {}).get("coordinates")
+        yield record
+
+
+def _chunks(records, chunk_size):
+    """
+    Groups the records in lists of chunk_size records.
+    """
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _node_values(record: dict):
+    """
+    Gets the name, latitude and longitude of a node record. Like NodeCreate, a node needs a text name.
+    """
+    name = record.get("name")
+    if not isinstance(name, str) or not name:
+        raise ImportFileError(f"Node record {record} has no name")
+
+    try:
+        if record.get("coordinates") is not None:
+            # GeoJSON points are stored as (longitude, latitude)
+            lng, lat = record["coordinates"][:2]
+        else:
+            lat, lng = record["lat"], record["lng"]
+        return {"name": name, "lat": float(lat), "lng": float(lng)}
+    except (KeyError, TypeError, ValueError):
+        raise ImportFileError(f"Node record {record} has no valid coordinates")
+
+
+async def import_nodes(db: AsyncSession, stream: TextIO, file_format: str, chunk_size: int = IMPORT_CHUNK_SIZE):
+    """
+    Imports the nodes of a file in a single transaction. CSV files need the name, lat and lng columns,
+    and GeoJSON files need Point features with a name property.
+
+    Args:
+        db: (AsyncSession): The database session.
+        stream: (TextIO): The text stream of the file.
+        file_format: (str): "csv", "geojson" or "geojsonseq".
+        chunk_size: (int): The number of records written with each insert.
+
+    Returns:
+        int: The number of nodes imported.
+
+    Raises:
+        ImportFileError: If a record is not valid.
+    """
+    # Load the routing graph first, so the version before the import is known
+    await graph_store.load(db)
+
+    imported = []
+    with graph_store.editing():
+        try:
+            for chunk in _chunks(_iter_records(stream, file_format), chunk_size):
+                rows = [_node_values(record) for record in chunk]
+
+                # Insert the chunk with one multi-row statement, getting the ids in the order of the rows
+                statement = insert(models.Node).returning(models.Node.id, sort_by_parameter_order=True)
+                node_ids = (await db.execute(statement, rows)).scalars().all()
+                imported.extend((node_id, row["lat"], row["lng"]) for node_id, row in zip(node_ids, rows))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        # Add the nodes to the routing graph of the process
+        old_version = graph_store.version
+        graph_store.add_nodes(imported)
+
+    # Log the edit, a node can not change the stored routes
+    route_maintenance.graph_edited(old_version, graph_store.version)
+    return len(imported)
+
+
+class _NodeReferences:
+    """
+    Resolves the node references of edge records, by id or by name, from in-memory tables.
+    """
+
+    def __init__(self, db: AsyncSession, graph: GraphSnapshot):
+        self.db = db
+        self.graph = graph
+        self._names = None
+
+    async def resolve(self, record: dict, side: str):
+        """
+        Gets the matrix index and id of the start or end node of an edge record.
+        """
+        node_id = record.get(f"{side}_node_id")
+        if node_id not in (None, ""):
+            try:
+                node_id = int(node_id)
+            except (TypeError, ValueError):
+                raise ImportFileError(f"Edge record {record} has a {side} node id that is not a number")
+        else:
+            node_id = await self._by_name(record.get(f"{side}_node"), record)
+
+        index = self.graph.index_of(node_id)
+        if index is None:
+            raise ImportFileError(f"Edge record {record} references the node {node_id}, which does not exist")
+        return index, node_id
+
+    async def _by_name(self, name, record):
+        """
+        Gets the id of a node by its name, reading all the names with one query the first time.
+        """
+        if name in (None, ""):
+            raise ImportFileError(f"Edge record {record} has no {{start,end}}_node_id or {{start,end}}_node")
+
+        if self._names is None:
+            self._names = {}
+            for node_id, node_name in await self.db.execute(select(models.Node.id, models.Node.name)):
+                # Names used by more than one node can not be referenced
+                self._names[node_name] = None if node_name in self._names else node_id
+
+        node_id = self._names.get(name)
+        if node_id is None:
+            raise ImportFileError(f"Edge record {record} references the node '{name}', "
+                                  f"which does not exist or is not unique")
+        return node_id
+
+
+async def import_edges(db: AsyncSession, stream: TextIO, file_format: str, chunk_size: int = IMPORT_CHUNK_SIZE):
+    """
+    Imports the edges of a file in a single transaction. Each record references its nodes with the
+    start_node_id and end_node_id fields, or by name with the start_node and end_node fields. The distances
+    are calculated for each chunk with one vectorized call.
+
+    Args:
+        db: (AsyncSession): The database session.
+        stream: (TextIO): The text stream of the file.
+        file_format: (str): "csv", "geojson" or "geojsonseq".
+        chunk_size: (int): The number of records written with each insert.
+
+    Returns:
+        int: The number of edges imported.
+
+    Raises:
+        ImportFileError: If a record is not valid.
+    """
+    graph = await graph_store.snapshot(db)
+    references = _NodeReferences(db, graph)
+    imported = []
+    with graph_store.editing():
+        try:
+            for chunk in _chunks(_iter_records(stream, file_format), chunk_size):
+                # Resolve the node references in memory
+                ends = np.array([await references.resolve(record, "start") + await references.resolve(record, "end")
+                                 for record in chunk], dtype=np.int64)
+                start_indexes, start_ids, end_indexes, end_ids = ends.T
+
+                # Calculate the distances of the whole chunk at once
+                distances = edge_distances(graph.lat[start_indexes], graph.lng[start_indexes],
+                                           graph.lat[end_indexes], graph.lng[end_indexes])
+
+                rows = [{"start_node_id": int(start_id), "end_node_id": int(end_id), "distance": float(distance)}
+                        for start_id, end_id, distance in zip(start_ids, end_ids, distances)]
+                await db.execute(insert(models.Edge), rows)
+                imported.extend((row["start_node_id"], row["end_node_id"], row["distance"]) for row in rows)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        # Add the edges to the routing graph of the process
+        old_version = graph_store.version
+        graph_store.add_edges(imported)
+
+    # Update the stored routes the edges can shorten
+    route_maintenance.graph_edited(old_version, graph_store.version, imported)
+    await graph_changed(db)
+    return len(imported)
+
+
+def main():
+    """
+    Command line entry point of the bulk import.
+
+    Returns: None
+    """
+    parser = argparse.ArgumentParser(description="Import nodes or edges from a CSV or GeoJSON file.")
+    parser.add_argument("table", choices=["nodes", "edges"], help="The table to import into.")
+    parser.add_argument("path", help="The path of the file.")
+    parser.add_argument("--format", choices=sorted(set(FILE_FORMATS.values())),
+                        help="The format of the file, detected from the extension by default.")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE,
+                        help="The number of records written with each insert.")
+    args = parser.parse_args()
+
+    file_format = args.format or detect_format(args.path)
+    importer = import_nodes if args.table == "nodes" else import_edges
+
+    # The API rebuilds the contraction hierarchy once it reloads the graph
+    contraction_index.build = False
+
+    async def run():
+        with open(args.path, encoding="utf-8", newline="") as stream:
+            async with AsyncSessionLocal() as db:
+                return await importer(db, stream, file_format, args.chunk_size)
+
+    count = asyncio.run(run())
+    print(f"Imported {count} {args.table}")
+    print(f"A running API reloads its routing graph within {GRAPH_CHECK_INTERVAL:g} seconds, the stored routes "
+          f"are computed again on read")
+
+
+if __name__ == "__main__":
+    main()
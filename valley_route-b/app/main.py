@@ -4,19 +4,60 @@ This module defines the main FastAPI application and the endpoints for the API.
 """
 
 # Standard library imports
+import codecs
+from contextlib import asynccontextmanager
+from datetime import datetime
 
 # Third-party imports
-from fastapi import Depends, FastAPI, HTTPException, status
+import numpy as np
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import Annotated
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Literal, Optional, Union
 
 # Local imports (project-specific)
-from app import auth, crud, models, schemas
-from app.database import SessionLocal, engine
+from app import auth, crud, exports, importer, models, rollups, schemas
+from app.cache import route_cache
+from app.charts import RenderedChart
+from app.database import AsyncSessionLocal, engine
+from app.executor import ExecutorBusyError, TaskTimeoutError, executor
+from app.graph_export import choose_encoding
+from app.package_routes import route_maintenance
+from app.pagination import LISTING_MAX_PAGE_SIZE, LISTING_PAGE_SIZE, InvalidCursorError, decode_cursor
+from app.route_jobs import route_jobs
+from app.spatial import GRID_MAX_ZOOM, NEAREST_MAX_K, NEAREST_MAX_POINTS, ViewportTooLargeError
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Runs the startup and shutdown of the application.
+
+    Args:
+        app: (FastAPI) The application.
+
+    Yields: None
+    """
+    # Fill the statistics rollup of a database that has packages but no rollup yet, and read the log of the
+    # graph edits checked against the stored routes
+    async with AsyncSessionLocal() as db:
+        await rollups.ensure_node_package_rollups(db)
+        await route_maintenance.start(db)
+
+    # Start the worker that computes the routes of the new packages
+    route_jobs.start()
+
+    yield
+
+    # Stop the background jobs and the workers of the executor, and free the shared graph
+    await route_jobs.shutdown()
+    await route_maintenance.shutdown()
+    executor.shutdown()
+
 
 # Create the FastAPI application instance
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Include the routers for the authentication endpoints
 app.include_router(auth.router)
@@ -37,30 +78,58 @@ app.add_middleware(
 )
 
 
-def get_db():
+@app.exception_handler(ExecutorBusyError)
+async def executor_busy_handler(request: Request, error: ExecutorBusyError):
+    """
+    Answers the requests rejected because the executor is full.
+
+    Args:
+        request: (Request) The request.
+        error: (ExecutorBusyError) The error.
+
+    Returns:
+        JSONResponse: A 503 response, asking the client to retry.
+    """
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(error)},
+                        headers={"Retry-After": "1"})
+
+
+@app.exception_handler(TaskTimeoutError)
+async def task_timeout_handler(request: Request, error: TaskTimeoutError):
+    """
+    Answers the requests whose task did not finish in time.
+
+    Args:
+        request: (Request) The request.
+        error: (TaskTimeoutError) The error.
+
+    Returns:
+        JSONResponse: A 504 response.
+    """
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"detail": str(error)})
+
+
+async def get_db():
     """
-    Dependency to get a database session.
+    Dependency to get an asynchronous database session.
 
     Args:
     - None
 
     Returns:
-    - Session: A SQLAlchemy session to the database.
+    - AsyncSession: A SQLAlchemy asynchronous session to the database.
 
     Yields:
-    - Session: A SQLAlchemy session to the database.
+    - AsyncSession: A SQLAlchemy asynchronous session to the database.
     """
 
-    # Create a new session for each request
-    db = SessionLocal()
-    try:
+    # Create a new session for each request, it is closed when the request ends
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 # Define the dependencies for the database session and the current user
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
 # Define the dependency for the current user
 user_dependency = Annotated[schemas.User, Depends(auth.get_current_user)]
@@ -72,7 +141,7 @@ async def get_user(user: user_dependency, db: db_dependency):
     Get the current user.
     Args:
         user: (schemas.User) The current user.
-        db: (Session) The database session.
+        db: (AsyncSession) The database session.
 
     Returns:
         schemas.UserBase: The current user.
@@ -91,7 +160,7 @@ async def create_node(user: user_dependency, node: schemas.NodeCreate, db: db_de
     Args:
         user: (schemas.User) The current user.
         node: (schemas.NodeCreate) The data for the new node.
-        db: (Session) The database session.
+        db: (AsyncSession) The database session.
 
     Returns:
         schemas.Node: The new node.
@@ -99,24 +168,165 @@ async def create_node(user: user_dependency, node: schemas.NodeCreate, db: db_de
     if user is None:
         # If the user is not authenticated, return an HTTP 401 Unauthorized response
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
-    return crud.new_node(db, node)
+    return await crud.new_node(db, node)
+
+
+@app.get("/node/", tags=["Nodes"], status_code=status.HTTP_200_OK,
+         response_model=Union[list[schemas.Node], schemas.NodePage])
+async def get_node_all(user: user_dependency, db: db_dependency, cursor: Optional[str] = None,
+                       limit: Annotated[Optional[int], Query(ge=1, le=LISTING_MAX_PAGE_SIZE)] = None):
+    """
+    Get all nodes. Without cursor and limit, all the nodes are returned in one list. With any of them,
+    a page of nodes ordered by id is returned with the cursor of the next page.
+    Args:
+        user: (schemas.User) The current user.
+        db: (AsyncSession) The database session.
+        cursor: (Optional[str]) The next_cursor of the previous page, or None for the first page.
+        limit: (Optional[int]) The number of nodes per page.
+
+    Returns:
+        Union[List[schemas.Node], schemas.NodePage]: A list of all nodes, or a page of nodes and the cursor of the
+        next page.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+
+    # Keep the full list for the clients that do not page
+    if cursor is None and limit is None:
+        return await crud.get_node_all(db)
+
+    try:
+        after_id = decode_cursor(cursor)
+    except InvalidCursorError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    return await crud.get_node_page(db, after_id, limit or LISTING_PAGE_SIZE)
+
+
+@app.get("/node/export", tags=["Nodes"], status_code=status.HTTP_200_OK)
+async def export_nodes(user: user_dependency, format: Literal["ndjson", "json"] = "ndjson"):
+    """
+    Export all the nodes, streamed as they are read from the database.
+    Args:
+        user: (schemas.User) The current user.
+        format: (str) "ndjson" for one JSON object per line, or "json" for a JSON array.
+
+    Returns:
+        StreamingResponse: The export, sent in chunks.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+    return StreamingResponse(exports.export_nodes(format), media_type=exports.EXPORT_MEDIA_TYPES[format])
+
+
+@app.get("/node/nearest", tags=["Nodes"], status_code=status.HTTP_200_OK, response_model=list[schemas.NearestNode])
+async def get_nearest_nodes(user: user_dependency, db: db_dependency, lat: Annotated[float, Query(ge=-90, le=90)],
+                            lng: Annotated[float, Query(ge=-180, le=180)],
+                            k: Annotated[int, Query(ge=1, le=NEAREST_MAX_K)] = 1):
+    """
+    Get the k nodes nearest to a coordinate.
+    Args:
+        user: (schemas.User) The current user.
+        db: (AsyncSession) The database session.
+        lat: (float) The latitude of the coordinate.
+        lng: (float) The longitude of the coordinate.
+        k: (int) The number of nodes to find.
+
+    Returns:
+        List[schemas.NearestNode]: The nearest nodes, sorted by distance in meters.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+    return (await crud.get_nearest_nodes(db, [(lat, lng)], k))[0]
+
+
+@app.post("/node/nearest", tags=["Nodes"], status_code=status.HTTP_200_OK,
+          response_model=list[list[schemas.NearestNode]])
+async def get_nearest_nodes_batch(user: user_dependency, body: schemas.NearestNodesRequest, db: db_dependency):
+    """
+    Get the k nodes nearest to each coordinate of a list.
+    Args:
+        user: (schemas.User) The current user.
+        body: (schemas.NearestNodesRequest) The coordinates and the number of nodes to find for each one.
+        db: (AsyncSession) The database session.
+
+    Returns:
+        List[List[schemas.NearestNode]]: The nearest nodes of each coordinate, in the order of the request.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+
+    if body.k > NEAREST_MAX_K or len(body.points) > NEAREST_MAX_POINTS:
+        # If the batch is too large, return an HTTP 400 Bad Request response
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {NEAREST_MAX_POINTS} points and {NEAREST_MAX_K} nodes per point")
+    return await crud.get_nearest_nodes(db, [(point.lat, point.lng) for point in body.points], body.k)
+
+
+@app.get("/node/bbox", tags=["Nodes"], status_code=status.HTTP_200_OK, response_model=schemas.NodeViewport)
+async def get_nodes_in_viewport(user: user_dependency, db: db_dependency,
+                                min_lat: Annotated[float, Query(ge=-90, le=90)],
+                                min_lng: Annotated[float, Query(ge=-180, le=180)],
+                                max_lat: Annotated[float, Query(ge=-90, le=90)],
+                                max_lng: Annotated[float, Query(ge=-180, le=180)],
+                                zoom: Annotated[int, Query(ge=0, le=GRID_MAX_ZOOM)]):
+    """
+    Get the nodes inside a map viewport, or their clusters at the low zoom levels.
+    Args:
+        user: (schemas.User) The current user.
+        db: (AsyncSession) The database session.
+        min_lat: (float) The southern edge of the viewport.
+        min_lng: (float) The western edge of the viewport.
+        max_lat: (float) The northern edge of the viewport.
+        max_lng: (float) The eastern edge of the viewport, smaller than min_lng across the antimeridian.
+        zoom: (int) The zoom level of the map.
+
+    Returns:
+        schemas.NodeViewport: The nodes or the clusters inside the viewport.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+
+    if min_lat > max_lat:
+        # If the viewport is upside down, return an HTTP 400 Bad Request response
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="min_lat must not be greater than max_lat")
+
+    try:
+        return await crud.get_nodes_in_viewport(db, min_lat, min_lng, max_lat, max_lng, zoom)
+    except ViewportTooLargeError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
 
 
-@app.get("/node/", tags=["Nodes"], status_code=status.HTTP_200_OK)
-async def get_node_all(user: user_dependency, db: db_dependency):
+@app.get("/node/{node_id}/reachable", tags=["Nodes"], status_code=status.HTTP_200_OK,
+         response_model=schemas.ReachableNodes)
+async def get_reachable_nodes(user: user_dependency, node_id: int, db: db_dependency,
+                              max_distance: Annotated[float, Query(gt=0)]):
     """
-    Get all nodes.
+    Get the nodes that can be reached from a node within a distance.
     Args:
         user: (schemas.User) The current user.
-        db: (Session) The database session.
+        node_id: (int) The ID of the node where the routes start.
+        db: (AsyncSession) The database session.
+        max_distance: (float) The largest distance of the routes, in meters.
 
     Returns:
-        List[schemas.Node]: A list of all nodes.
+        schemas.ReachableNodes: The ids of the nodes reached and their distances, sorted by distance.
     """
     if user is None:
         # If the user is not authenticated, return an HTTP 401 Unauthorized response
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
-    return crud.get_node_all(db)
+
+    response = await crud.get_reachable_nodes(db, node_id, max_distance)
+
+    if response is None:
+        # If the node is not found, return an HTTP 404 Not Found response
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found")
+
+    return response
 
 
 @app.post("/edge/", tags=["Edges"], status_code=status.HTTP_201_CREATED, response_model=schemas.Edge)
@@ -126,7 +336,7 @@ async def create_edge(user: user_dependency, edge: schemas.EdgeCreate, db: db_de
     Args:
         user: (schemas.User) The current user.
         edge: (schemas.EdgeCreate) The data for the new edge.
-        db: (Session) The database session.
+        db: (AsyncSession) The database session.
 
     Returns:
         schemas.Edge: The new edge.
@@ -135,42 +345,215 @@ async def create_edge(user: user_dependency, edge: schemas.EdgeCreate, db: db_de
     if user is None:
         # If the user is not authenticated, return an HTTP 401 Unauthorized response
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
-    return crud.new_edge(db, edge)
+    return await crud.new_edge(db, edge)
 
 
-@app.get("/edge/", tags=["Edges"], status_code=status.HTTP_200_OK)
-async def get_edge_all(user: user_dependency, db: db_dependency):
+@app.get("/edge/", tags=["Edges"], status_code=status.HTTP_200_OK,
+         response_model=Union[list[schemas.EdgeGet], schemas.EdgePage])
+async def get_edge_all(user: user_dependency, db: db_dependency, cursor: Optional[str] = None,
+                       limit: Annotated[Optional[int], Query(ge=1, le=LISTING_MAX_PAGE_SIZE)] = None):
     """
-    Get all edges.
+    Get all edges. Without cursor and limit, all the edges are returned in one list. With any of them,
+    a page of edges ordered by id is returned with the cursor of the next page.
     Args:
         user: (schemas.User) The current user.
-        db: (Session) The database session.
+        db: (AsyncSession) The database session.
+        cursor: (Optional[str]) The next_cursor of the previous page, or None for the first page.
+        limit: (Optional[int]) The number of edges per page.
 
     Returns:
-        List[schemas.Edge]: A list of all edges.
+        Union[List[schemas.EdgeGet], schemas.EdgePage]: A list of all edges, or a page of edges and the cursor of
+        the next page.
     """
     if user is None:
         # If the user is not authenticated, return an HTTP 401 Unauthorized response
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
-    return crud.get_edge_all(db)
 
+    # Keep the full list for the clients that do not page
+    if cursor is None and limit is None:
+        return await crud.get_edge_all(db)
+
+    try:
+        after_id = decode_cursor(cursor)
+    except InvalidCursorError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    return await crud.get_edge_page(db, after_id, limit or LISTING_PAGE_SIZE)
 
-@app.post("/package/", tags=["Packages"], status_code=status.HTTP_201_CREATED, response_model=schemas.PackageCreate)
-async def create_package(user: user_dependency, package: schemas.PackageCreate, db: db_dependency):
+
+@app.get("/edge/export", tags=["Edges"], status_code=status.HTTP_200_OK)
+async def export_edges(user: user_dependency, format: Literal["ndjson", "json"] = "ndjson"):
     """
-    Create a new package.
+    Export all the edges, with their nodes referenced by id, streamed as they are read from the database.
+    Args:
+        user: (schemas.User) The current user.
+        format: (str) "ndjson" for one JSON object per line, or "json" for a JSON array.
+
+    Returns:
+        StreamingResponse: The export, sent in chunks.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+    return StreamingResponse(exports.export_edges(format), media_type=exports.EXPORT_MEDIA_TYPES[format])
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]):
+    """
+    Checks the If-None-Match header of a request against the ETag of a response. The header uses the weak
+    comparison, so a weak tag of the same representation also matches, and "*" matches any representation.
+
+    Args:
+        etag: (str) The ETag of the response.
+        if_none_match: (Optional[str]) The If-None-Match header of the request.
+
+    Returns:
+        bool: True if the client has the response already.
+    """
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+@app.get("/graph/binary", tags=["Routes"], status_code=status.HTTP_200_OK)
+async def get_graph_binary(user: user_dependency, db: db_dependency,
+                           accept_encoding: Annotated[Optional[str], Header()] = None,
+                           if_none_match: Annotated[Optional[str], Header()] = None):
+    """
+    Get the whole network as packed typed arrays: the node ids and coordinates, and the CSR adjacency with
+    its distances. The format is described in the graph_export module.
+    Args:
+        user: (schemas.User) The current user.
+        db: (AsyncSession) The database session.
+        accept_encoding: (Optional[str]) The Accept-Encoding header, to compress the export with brotli or gzip.
+        if_none_match: (Optional[str]) The ETag of the export the client has.
+
+    Returns:
+        Response: The binary export, or an empty 304 response if the client has it already.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+
+    encoding = choose_encoding(accept_encoding)
+    graph, payload, etag = await crud.get_graph_export(db, encoding)
+
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "X-Graph-Version": str(graph.version),
+               "X-Graph-Nodes": str(graph.size), "X-Graph-Adjacency": str(graph.matrix.nnz)}
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload, media_type="application/octet-stream", headers=headers)
+
+
+@app.post("/node/import", tags=["Nodes"], status_code=status.HTTP_201_CREATED)
+async def import_nodes(user: user_dependency, file: UploadFile, db: db_dependency, file_format: Optional[str] = None):
+    """
+    Import nodes from a CSV or GeoJSON file.
+    Args:
+        user: (schemas.User) The current user.
+        file: (UploadFile) The file with the nodes.
+        db: (AsyncSession) The database session.
+        file_format: (str) The format of the file, detected from the file name by default.
+
+    Returns:
+        dict: The number of nodes imported.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+    return await import_file(importer.import_nodes, file, db, file_format)
+
+
+@app.post("/edge/import", tags=["Edges"], status_code=status.HTTP_201_CREATED)
+async def import_edges(user: user_dependency, file: UploadFile, db: db_dependency, file_format: Optional[str] = None):
+    """
+    Import edges from a CSV or GeoJSON file.
+    Args:
+        user: (schemas.User) The current user.
+        file: (UploadFile) The file with the edges.
+        db: (AsyncSession) The database session.
+        file_format: (str) The format of the file, detected from the file name by default.
+
+    Returns:
+        dict: The number of edges imported.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+    return await import_file(importer.import_edges, file, db, file_format)
+
+
+async def import_file(import_function, file: UploadFile, db: AsyncSession, file_format: Optional[str]):
+    """
+    Run an import function over an uploaded file, streaming its content.
+    Args:
+        import_function: (Callable) importer.import_nodes or importer.import_edges.
+        file: (UploadFile) The uploaded file.
+        db: (AsyncSession) The database session.
+        file_format: (str) The format of the file, or None to detect it from the file name.
+
+    Returns:
+        dict: The number of records imported.
+    """
+    try:
+        file_format = file_format or importer.detect_format(file.filename)
+        # The upload is decoded as it is read. TextIOWrapper can not wrap the spooled file before Python 3.11
+        stream = codecs.getreader("utf-8")(file.file)
+        imported = await import_function(db, stream, file_format)
+    except (importer.ImportFileError, UnicodeDecodeError) as error:
+        # If the file is not valid, return an HTTP 400 Bad Request response
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    return {"imported": imported}
+
+
+@app.post("/package/", tags=["Packages"], status_code=status.HTTP_202_ACCEPTED,
+          response_model=schemas.PackageAccepted)
+async def create_package(user: user_dependency, package: schemas.PackageCreate, db: db_dependency,
+                         response: Response):
+    """
+    Create a new package. The package is stored right away, and its route is computed in the background.
     Args:
         user: (schemas.User) The current user.
         package: (schemas.PackageCreate) The data for the new package.
-        db: (Session) The database session.
+        db: (AsyncSession) The database session.
+        response: (Response) The response, to set the Location header.
 
     Returns:
-        schemas.PackageCreate: The new package.
+        schemas.PackageAccepted: The new package, and the URL of the status of its route.
     """
     if user is None:
         # If the user is not authenticated, return an HTTP 401 Unauthorized response
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
-    return crud.create_user_package(db, user.id, package)
+
+    db_package = await crud.create_user_package(db, user.id, package)
+    status_url = f"/package/{db_package.id}/status"
+    response.headers["Location"] = status_url
+    return schemas.PackageAccepted(id=db_package.id, description=db_package.description,
+                                   start_node_id=db_package.start_node_id, end_node_id=db_package.end_node_id,
+                                   status_url=status_url)
+
+
+@app.get("/package/{package_id}/status", tags=["Packages"], status_code=status.HTTP_200_OK,
+         response_model=schemas.RouteJobStatus)
+async def get_package_status(package_id: int, db: db_dependency):
+    """
+    Get the status of the computation of the route of a package.
+    Args:
+        package_id: (int) The ID of the package.
+        db: (AsyncSession) The database session.
+
+    Returns:
+        schemas.RouteJobStatus: The status of the route, and the URL of the package with its route.
+    """
+    response = await crud.get_route_job(db, package_id)
+
+    if response is None:
+        # If the package is not found, return an HTTP 404 Not Found response
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Package not found")
+
+    return response
 
 
 @app.get("/package/{package_id}", tags=["Packages"], status_code=status.HTTP_200_OK)
@@ -179,12 +562,12 @@ async def get_package(package_id: int, db: db_dependency):
     Get a package by ID.
     Args:
         package_id: (int) The ID of the package to retrieve.
-        db: (Session) The database session.
+        db: (AsyncSession) The database session.
 
     Returns:
         schemas.Package: The package with the specified ID.
     """
-    response = crud.get_package(db, package_id)
+    response = await crud.get_package(db, package_id)
 
     if response is None:
         # If the package is not found, return an HTTP 404 Not Found response
@@ -193,14 +576,75 @@ async def get_package(package_id: int, db: db_dependency):
     return response
 
 
+@app.post("/packages/routes", tags=["Packages"], status_code=status.HTTP_200_OK,
+          response_model=list[schemas.PackageRoute])
+async def get_package_routes(body: schemas.PackageRoutesRequest, db: db_dependency):
+    """
+    Get the routes of many packages at once.
+    Args:
+        body: (schemas.PackageRoutesRequest) The IDs of the packages.
+        db: (AsyncSession) The database session.
+
+    Returns:
+        List[schemas.PackageRoute]: The route of each package found.
+    """
+    if len(body.package_ids) > crud.PACKAGE_ROUTES_MAX_IDS:
+        # If the request has too many packages, return an HTTP 413 Request Entity Too Large response
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {crud.PACKAGE_ROUTES_MAX_IDS} packages per request")
+    return await crud.get_package_routes(db, body.package_ids)
+
+
+@app.post("/distance-matrix", tags=["Routes"], status_code=status.HTTP_200_OK)
+async def get_distance_matrix(user: user_dependency, body: schemas.DistanceMatrixRequest, db: db_dependency):
+    """
+    Get the shortest distances from a list of origin nodes to a list of destination nodes.
+    Args:
+        user: (schemas.User) The current user.
+        body: (schemas.DistanceMatrixRequest) The origin and destination nodes, and the output format.
+        db: (AsyncSession) The database session.
+
+    Returns:
+        dict | Response: The origins, destinations and distances as JSON, with null for the pairs without
+        a route, or the row-major float32 matrix as binary, with infinity for the pairs without a route.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+
+    if len(body.origins) * len(body.destinations) > crud.DISTANCE_MATRIX_MAX_CELLS:
+        # If the matrix is too large, return an HTTP 413 Request Entity Too Large response
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {crud.DISTANCE_MATRIX_MAX_CELLS} origin and destination pairs")
+
+    distances = await crud.get_distance_matrix(db, body.origins, body.destinations)
+
+    if distances is None:
+        # If any node is not found, return an HTTP 404 Not Found response
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found")
+
+    if body.format == "binary":
+        # Send the matrix as little-endian float32 values, with its shape in the headers
+        headers = {"X-Matrix-Rows": str(distances.shape[0]), "X-Matrix-Columns": str(distances.shape[1])}
+        return Response(content=distances.astype("<f4").tobytes(), media_type="application/octet-stream",
+                        headers=headers)
+
+    # JSON has no infinity, so the pairs without a route are sent as null
+    values = distances.astype(object)
+    values[~np.isfinite(distances)] = None
+    return {"origins": body.origins, "destinations": body.destinations, "distances": values.tolist()}
+
+
 @app.get("/packages", tags=["Packages"], status_code=status.HTTP_200_OK)
-async def get_all_package(user: user_dependency, db: db_dependency, page: int = 1):
+async def get_all_package(user: user_dependency, db: db_dependency, page: Annotated[int, Query(ge=1)] = 1,
+                          size: Annotated[int, Query(ge=1, le=crud.PACKAGES_MAX_PAGE_SIZE)] = crud.PACKAGES_PAGE_SIZE):
     """
     Get all packages for the current user.
     Args:
         user: (schemas.User) The current user.
-        db: (Session) The database session.
+        db: (AsyncSession) The database session.
         page: (int) The page number for the paginated results.
+        size: (int) The number of packages per page.
 
     Returns:
         List[schemas.Package]: A list of all packages for the current user.
@@ -208,32 +652,166 @@ async def get_all_package(user: user_dependency, db: db_dependency, page: int =
     if user is None:
         # If the user is not authenticated, return an HTTP 401 Unauthorized response
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
-    return crud.get_all_packages(db, user.id, page)
+    return await crud.get_all_packages(db, user.id, page, size)
+
+
+@app.get("/packages/export", tags=["Packages"], status_code=status.HTTP_200_OK)
+async def export_packages(user: user_dependency, format: Literal["ndjson", "json"] = "ndjson"):
+    """
+    Export all the packages of the current user, streamed as they are read from the database.
+    Args:
+        user: (schemas.User) The current user.
+        format: (str) "ndjson" for one JSON object per line, or "json" for a JSON array.
+
+    Returns:
+        StreamingResponse: The export, sent in chunks.
+    """
+    if user is None:
+        # If the user is not authenticated, return an HTTP 401 Unauthorized response
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed")
+    return StreamingResponse(exports.export_packages(user.id, format), media_type=exports.EXPORT_MEDIA_TYPES[format])
+
+
+def chart_response(chart: RenderedChart, if_none_match: Optional[str]):
+    """
+    Creates the response of a chart image, with its ETag, or a 304 response if the client has it already.
+
+    Args:
+        chart: (RenderedChart) The chart.
+        if_none_match: (Optional[str]) The If-None-Match header of the request.
+
+    Returns:
+        Response: The image, or an empty 304 response.
+    """
+    headers = {"ETag": chart.etag, "Cache-Control": "no-cache"}
+    if etag_matches(chart.etag, if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=chart.content, media_type=chart.media_type, headers=headers)
 
 
 @app.get("/statistics/nodestart", tags=["Statistics"], status_code=status.HTTP_200_OK)
-async def get_statistics_nodestart(db: db_dependency):
+async def get_statistics_nodestart(db: db_dependency, format: Literal["image", "json", "png", "svg"] = "image",
+                                   if_none_match: Annotated[Optional[str], Header()] = None):
     """
     Get statistics for the start nodes of packages.
     Args:
-        db: (Session) The database session.
+        db: (AsyncSession) The database session.
+        format: (str) "image" for a base64 encoded bar chart, "png" or "svg" for the image itself,
+            or "json" for the counts.
+        if_none_match: (Optional[str]) The ETag of the chart the client has, for the "png" and "svg" formats.
 
     Returns:
-        List[dict]: A list of dictionaries containing the start node statistics.
+        str | Response | list[schemas.NodePackageCount]: The bar chart, or the number of packages that start
+        at each node.
     """
+    if format == "json":
+        return await crud.get_node_package_counts(db, "start")
+    if format in ("png", "svg"):
+        return chart_response(await crud.get_node_chart(db, "start", format), if_none_match)
 
-    return crud.get_package_by_start_node(db)
+    return await crud.get_package_by_start_node(db)
 
 
 @app.get("/statistics/nodeend", tags=["Statistics"], status_code=status.HTTP_200_OK)
-async def get_statistics_nodeend(db: db_dependency):
+async def get_statistics_nodeend(db: db_dependency, format: Literal["image", "json", "png", "svg"] = "image",
+                                 if_none_match: Annotated[Optional[str], Header()] = None):
     """
     Get statistics for the end nodes of packages.
     Args:
-        db: (Session) The database session.
+        db: (AsyncSession) The database session.
+        format: (str) "image" for a base64 encoded bar chart, "png" or "svg" for the image itself,
+            or "json" for the counts.
+        if_none_match: (Optional[str]) The ETag of the chart the client has, for the "png" and "svg" formats.
+
+    Returns:
+        str | Response | list[schemas.NodePackageCount]: The bar chart, or the number of packages that end
+        at each node.
+    """
+    if format == "json":
+        return await crud.get_node_package_counts(db, "end")
+    if format in ("png", "svg"):
+        return chart_response(await crud.get_node_chart(db, "end", format), if_none_match)
+
+    return await crud.get_package_by_end_node(db)
+
+
+@app.get("/statistics/nodes", tags=["Statistics"], status_code=status.HTTP_200_OK,
+         response_model=list[schemas.NodePackageStatistics])
+async def get_statistics_nodes(db: db_dependency):
+    """
+    Get the number of packages that start and end at each node, counted with one query.
+    Args:
+        db: (AsyncSession) The database session.
 
     Returns:
-        List[dict]: A list of dictionaries containing the end node statistics.
+        list[schemas.NodePackageStatistics]: The start and end counts of each node with packages.
+    """
+    return await crud.get_node_package_statistics(db)
+
+
+@app.get("/statistics/timeseries", tags=["Statistics"], status_code=status.HTTP_200_OK,
+         response_model=list[schemas.PackageTimeBucket])
+async def get_statistics_timeseries(db: db_dependency, bucket: Literal["hour", "day", "week"] = "day",
+                                    start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                    node_id: Optional[int] = None):
+    """
+    Get the number of packages that start and end at each node by hour, day or week.
+    Args:
+        db: (AsyncSession) The database session.
+        bucket: (str) "hour", "day" or "week".
+        start: (Optional[datetime]) The first hour of the range, included.
+        end: (Optional[datetime]) The end of the range, excluded.
+        node_id: (Optional[int]) The id of the node, or None for all the nodes.
+
+    Returns:
+        list[schemas.PackageTimeBucket]: The counts of each node in each bucket with packages.
+    """
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The start must be before the end")
+
+    return await crud.get_package_time_series_statistics(db, bucket, start, end, node_id)
+
+
+@app.get("/statistics/route-cache", tags=["Statistics"], status_code=status.HTTP_200_OK)
+async def get_statistics_route_cache():
+    """
+    Get the counters of the route cache.
+
+    Returns:
+        dict: The size, capacity, hits, misses, evictions and invalidations of the route cache.
+    """
+    return route_cache.stats()
+
 
+@app.get("/statistics/executor", tags=["Statistics"], status_code=status.HTTP_200_OK)
+async def get_statistics_executor():
+    """
+    Get the configuration and counters of the executor.
+
+    Returns:
+        dict: The mode, size, pending tasks, and completed, rejected and timed out tasks of the executor.
+    """
+    return executor.stats()
+
+
+@app.get("/statistics/reroute", tags=["Statistics"], status_code=status.HTTP_200_OK)
+async def get_statistics_reroute():
+    """
+    Get the progress and counts of the re-routing of the stored package routes after graph edits.
+
+    Returns:
+        dict: The version of the graph and the oldest version of the current routes, the queued edits, the
+        running and last jobs, and the total counts of checked, re-routed, unchanged and failed routes.
+    """
+    return route_maintenance.stats()
+
+
+@app.get("/statistics/route-jobs", tags=["Statistics"], status_code=status.HTTP_200_OK)
+async def get_statistics_route_jobs():
+    """
+    Get the number of route jobs of each status, and the counters of the route worker.
+
+    Returns:
+        dict: The jobs by status, and the claimed, done, retried and failed jobs and the solved batches.
     """
-    return crud.get_package_by_end_node(db)
+    return await route_jobs.stats()
@@ -9,13 +9,18 @@ User: Represents a user entity in the database.
 Node: Represents a node entity in the database.
 Edge: Represents an edge entity in the database.
 Package: Represents a package entity in the database.
+NodePackageRollup: Represents the number of packages that start and end at a node.
+NodePackageHourlyRollup: Represents the number of packages that start and end at a node in an hour.
+PackageRoute: Represents the stored route of a package.
+RouteJob: Represents the computation of the route of a new package, queued for the background worker.
+GraphEdit: Represents a range of versions of the graph whose edits were checked against the stored routes.
 """
 
 # Standard library imports
 from datetime import datetime
 
 # Third-party imports
-from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, String
+from sqlalchemy import JSON, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 
 # Local imports (project-specific)
@@ -111,14 +116,148 @@ class Package(Base):
     # Define the table name for the Package model
     __tablename__ = "package"
 
+    # Index used to count and page the packages of a user
+    __table_args__ = (Index("ix_package_user_id_id", "user_id", "id"),)
+
     id = Column(Integer, primary_key=True)
     description = Column(String(100))
-    created_at = Column(DateTime, default=datetime.now())
+    created_at = Column(DateTime, default=datetime.now)
     user_id = Column(Integer, ForeignKey('user.id'))
     start_node_id = Column(Integer, ForeignKey('node.id'))
     end_node_id = Column(Integer, ForeignKey('node.id'))
 
-    # Define the relationship between the Package and User models, and the start and end nodes
+    # Define the relationship between the Package and User models, the start and end nodes, and the stored route
     owner = relationship("User", back_populates="packages")
     start_node = relationship("Node", foreign_keys=[start_node_id])
     end_node = relationship("Node", foreign_keys=[end_node_id])
+    route = relationship("PackageRoute", uselist=False, back_populates="package")
+
+
+class NodePackageRollup(Base):
+    """
+    Represents the number of packages that start and end at a node. The counts are updated in the same
+    transaction that creates or deletes a package, so the statistics read one row per node.
+
+    Attributes:
+    - node_id (int): The id of the node (primary key).
+    - start_packages (int): The number of packages that start at the node.
+    - end_packages (int): The number of packages that end at the node.
+
+    """
+
+    # Define the table name for the NodePackageRollup model
+    __tablename__ = "node_package_rollup"
+
+    node_id = Column(Integer, ForeignKey('node.id'), primary_key=True)
+    start_packages = Column(Integer, nullable=False, default=0)
+    end_packages = Column(Integer, nullable=False, default=0)
+
+    # Define the relationship between the NodePackageRollup and Node models
+    node = relationship("Node")
+
+
+class NodePackageHourlyRollup(Base):
+    """
+    Represents the number of packages that start and end at a node, created within an hour. The counts are
+    updated in the same transaction that creates or deletes a package, and merged into days and weeks when
+    they are read.
+
+    Attributes:
+    - node_id (int): The id of the node (primary key).
+    - hour (datetime): The start of the hour (primary key).
+    - start_packages (int): The number of packages created in the hour that start at the node.
+    - end_packages (int): The number of packages created in the hour that end at the node.
+
+    """
+
+    # Define the table name for the NodePackageHourlyRollup model
+    __tablename__ = "node_package_hourly_rollup"
+
+    node_id = Column(Integer, ForeignKey('node.id'), primary_key=True)
+    hour = Column(DateTime, primary_key=True, index=True)
+    start_packages = Column(Integer, nullable=False, default=0)
+    end_packages = Column(Integer, nullable=False, default=0)
+
+
+class PackageRoute(Base):
+    """
+    Represents the stored route of a package. The route is computed when the package is created, and it is
+    served while the edits of the graph made after its version are checked and can not shorten it.
+
+    Attributes:
+    - package_id (int): The id of the package (primary key).
+    - node_ids (list[int]): The ids of the nodes of the route, in order, empty if there is no route.
+    - distance (float): The distance of the route, None if there is no route.
+    - graph_version (int): The version of the graph the route was computed with, from which it is valid.
+
+    """
+
+    # Define the table name for the PackageRoute model
+    __tablename__ = "package_route"
+
+    package_id = Column(Integer, ForeignKey('package.id'), primary_key=True)
+    node_ids = Column(JSON, nullable=False)
+    distance = Column(Float(20))
+    graph_version = Column(Integer, nullable=False, index=True)
+
+    # Define the relationship between the PackageRoute and Package models
+    package = relationship("Package", back_populates="route")
+
+
+class RouteJob(Base):
+    """
+    Represents the computation of the route of a new package, queued for the background worker. The worker
+    claims the pending jobs, and the running jobs whose claim expired, so the queue survives a restart.
+
+    Attributes:
+    - id (int): The unique identifier for the job (primary key).
+    - package_id (int): The id of the package (unique).
+    - status (str): "pending", "running", "done" or "failed".
+    - attempts (int): The number of times the job was claimed.
+    - error (str): The error of the last attempt, None if it did not fail.
+    - created_at (datetime): The date and time when the job was queued.
+    - claimed_at (datetime): The date and time when the job was last claimed.
+
+    """
+
+    # Define the table name for the RouteJob model
+    __tablename__ = "route_job"
+
+    # Index used to claim the oldest jobs of a status
+    __table_args__ = (Index("ix_route_job_status_id", "status", "id"),)
+
+    id = Column(Integer, primary_key=True)
+    package_id = Column(Integer, ForeignKey('package.id'), unique=True, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String(200))
+    created_at = Column(DateTime, default=datetime.now)
+    claimed_at = Column(DateTime)
+
+    # Define the relationship between the RouteJob and Package models
+    package = relationship("Package")
+
+
+class GraphEdit(Base):
+    """
+    Represents a range of versions of the graph whose edits were checked against the stored routes. The
+    consecutive checked edits are merged into one row, and a stale edit, whose routes were not checked,
+    replaces the rows before it.
+
+    Attributes:
+    - id (int): The unique identifier for the edit (primary key).
+    - old_version (int): The version of the graph before the edits.
+    - new_version (int): The version of the graph after the edits.
+    - state (str): "checked" if the routes the edits can shorten were updated, or "stale" if they were not.
+    - edited_at (datetime): The date and time when the last edit of the row was checked.
+
+    """
+
+    # Define the table name for the GraphEdit model
+    __tablename__ = "graph_edit"
+
+    id = Column(Integer, primary_key=True)
+    old_version = Column(Integer, nullable=False)
+    new_version = Column(Integer, nullable=False)
+    state = Column(String(20), nullable=False)
+    edited_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
@@ -0,0 +1,540 @@
+"""
+This module contains the stored routes of the packages.
+It includes the following:
+- The save_route function, which stores the route of a package with the version of the graph it was computed with
+- The save_routes function, which stores the routes of many packages with one delete and one multi-row insert
+- The discard_outdated_routes function, which deletes the routes just stored that an edit may have missed
+- The current_route function, which gets a stored route if no edit since it was computed can have changed it
+- The affected_routes function, which finds the stored routes that new edges can shorten
+- The RouteMaintenance class, the background job that updates the stored routes after the graph changes
+- The process-level route_maintenance instance notified by the CRUD functions and the importer
+
+The route of a package only depends on its start and end nodes and on the graph, so it is computed when the
+package is created, and the reads of the package serve it until an edit of the graph can change it. A route
+that is missing or out of date is computed again on the next read, and stored again.
+
+A stored route keeps the version of the graph it was computed with, the version it is valid from. After a
+graph edit, the routes stored before the edit are checked in the background. Adding a node can not change a
+route, so no route is read. Adding edges can only shorten the routes that go through them, so only those
+routes are searched again and written, in batches run in parallel in the executor. The edit is then logged
+as checked in the graph_edit table, and the routes it did not change stay valid without being written.
+"""
+
+# Standard library imports
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+# Third-party imports
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local imports (project-specific)
+from app import models
+from app.database import AsyncSessionLocal
+from app.executor import ExecutorBusyError, TaskTimeoutError, executor
+from app.graph import GraphSnapshot, graph_store
+from app.routing import search_routes
+
+# Number of stored routes checked by each task of the re-routing job, and number of tasks run at a time
+REROUTE_BATCH_SIZE = int(os.getenv("REROUTE_BATCH_SIZE", "5000"))
+REROUTE_CONCURRENCY = int(os.getenv("REROUTE_CONCURRENCY", "4"))
+
+# Largest number of new edges checked by the re-routing job, the routes of larger edits are computed on read
+REROUTE_MAX_EDGES = int(os.getenv("REROUTE_MAX_EDGES", "16"))
+
+# Seconds to wait before a task is submitted again when the executor queue is full
+REROUTE_RETRY_DELAY = 0.5
+
+# Relative margin under which a route through a new edge is not considered shorter
+REROUTE_TOLERANCE = 1e-9
+
+logger = logging.getLogger(__name__)
+
+
+async def save_route(db: AsyncSession, package_id: int, graph_version: int, path: list[int], distance: float):
+    """
+    Stores the route of a package, replacing the stored one. It does not commit, and discard_outdated_routes
+    must be called once the route is committed.
+
+    Args:
+        db: (AsyncSession): The database session.
+        package_id: (int): The id of the package.
+        graph_version: (int): The version of the graph the route was computed with.
+        path: (list[int]): The ids of the nodes of the route, empty if there is no route.
+        distance: (float): The distance of the route.
+
+    Returns: None
+    """
+    values = {"node_ids": [int(node_id) for node_id in path], "distance": float(distance) if path else None,
+              "graph_version": graph_version}
+    statement = update(models.PackageRoute).where(models.PackageRoute.package_id == package_id).values(**values)
+    if (await db.execute(statement)).rowcount:
+        return
+
+    # The row is inserted in a savepoint, because another request can store the same route at the same time
+    try:
+        async with db.begin_nested():
+            await db.execute(insert(models.PackageRoute).values(package_id=package_id, **values))
+    except IntegrityError:
+        await db.execute(statement)
+
+
+async def save_routes(db: AsyncSession, graph_version: int, routes: list[tuple[int, list[int], float]]):
+    """
+    Stores the routes of many packages, replacing the stored ones, and commits. The routes are written with
+    one delete and one multi-row insert, or one by one if another request stores one of them at the same time.
+
+    Args:
+        db: (AsyncSession): The database session.
+        graph_version: (int): The version of the graph the routes were computed with.
+        routes: (list[tuple[int, list[int], float]]): The package id, the node ids of the path and the
+        distance of each route.
+
+    Returns: None
+    """
+    rows = [{"package_id": package_id, "node_ids": [int(node_id) for node_id in path],
+             "distance": float(distance) if path else None, "graph_version": graph_version}
+            for package_id, path, distance in routes]
+    package_ids = [row["package_id"] for row in rows]
+    try:
+        await db.execute(delete(models.PackageRoute).where(models.PackageRoute.package_id.in_(package_ids)))
+        await db.execute(insert(models.PackageRoute), rows)
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        for package_id, path, distance in routes:
+            await save_route(db, package_id, graph_version, path, distance)
+        await db.commit()
+    await discard_outdated_routes(db, graph_version, package_ids)
+
+
+async def discard_outdated_routes(db: AsyncSession, graph_version: int, package_ids: list[int]):
+    """
+    Deletes the routes just stored if edges were added to the graph after the version they were computed with.
+    The job of that edit may have read the routes before they were stored, so they were never checked. It is
+    called after the routes are committed.
+
+    Args:
+        db: (AsyncSession): The database session.
+        graph_version: (int): The version of the graph the routes were computed with.
+        package_ids: (list[int]): The ids of the packages of the routes.
+
+    Returns: None
+    """
+    if not route_maintenance.edited_since(graph_version):
+        return
+    await db.execute(delete(models.PackageRoute)
+                     .where(models.PackageRoute.package_id.in_(package_ids),
+                            models.PackageRoute.graph_version == graph_version))
+    await db.commit()
+
+
+def current_route(route: Optional[models.PackageRoute], graph: GraphSnapshot):
+    """
+    Gets a stored route, if it is valid at the version of the graph: it was computed with a version from
+    which every edit was checked by the re-routing job.
+
+    Args:
+        route: (Optional[models.PackageRoute]): The stored route of the package, or None if it has none.
+        graph: (GraphSnapshot): The graph snapshot.
+
+    Returns:
+        tuple[list[int], float | None] | None: The node ids of the path and its distance, or None if the
+        route must be computed again.
+    """
+    if route is None or not route_maintenance.valid_from(graph.version) <= route.graph_version <= graph.version:
+        return None
+    return route.node_ids, route.distance
+
+
+def affected_routes(graph: GraphSnapshot, edges: list[tuple[int, int, float]], start_node_ids: list[int],
+                    end_node_ids: list[int], distances: list[Optional[float]]):
+    """
+    Finds the stored routes that new edges can shorten. It runs in the workers of the executor.
+
+    A route from s to t of distance D is shortened by an edge (a, b) of length w only if the new shortest route
+    goes through the edge, that is, if d(s, a) + w + d(b, t) or d(s, b) + w + d(a, t) is shorter than D. The
+    distances from the ends of the edges are computed once per snapshot, and the test is vectorized.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot, with the new edges.
+        edges: (list[tuple[int, int, float]]): The start node id, end node id and distance of each new edge.
+        start_node_ids: (list[int]): The id of the start node of each route.
+        end_node_ids: (list[int]): The id of the end node of each route.
+        distances: (list[Optional[float]]): The stored distance of each route, None if there is no route.
+
+    Returns:
+        np.ndarray: True for the routes that must be searched again.
+    """
+    edges = [(graph.index_of(start), graph.index_of(end), distance) for start, end, distance in edges]
+    edges = [(start, end, distance) for start, end, distance in edges if start is not None and end is not None]
+    endpoints = sorted({index for start, end, _ in edges for index in (start, end)})
+
+    # The graph is undirected, so the distances from the ends of the edges are also the distances to them
+    def endpoint_distances(snapshot: GraphSnapshot):
+        rows = dijkstra(snapshot.matrix, directed=False, indices=endpoints) if endpoints else []
+        return dict(zip(endpoints, rows))
+    rows = graph.derived(f"reroute:{endpoints}", endpoint_distances)
+
+    starts = np.array([graph.index_of(node_id) for node_id in start_node_ids], dtype=float)
+    ends = np.array([graph.index_of(node_id) for node_id in end_node_ids], dtype=float)
+    limits = np.array(distances, dtype=float) * (1 - REROUTE_TOLERANCE)
+    limits[np.isnan(limits)] = np.inf
+
+    # The routes with a node that is not in the graph can not change
+    affected = np.zeros(len(limits), dtype=bool)
+    known = ~np.isnan(starts) & ~np.isnan(ends)
+    starts, ends, limits = starts[known].astype(np.int64), ends[known].astype(np.int64), limits[known]
+
+    through = np.zeros(len(limits), dtype=bool)
+    for start, end, distance in edges:
+        from_start, from_end = rows[start], rows[end]
+        through |= np.minimum(from_start[starts] + distance + from_end[ends],
+                              from_end[starts] + distance + from_start[ends]) < limits
+    affected[known] = through
+    return affected
+
+
+class RouteMaintenance:
+    """
+    RouteMaintenance keeps the stored routes current after the graph changes, without rewriting the routes
+    an edit can not change. A stored route is valid from the version it was computed with, and it is current
+    while every edit made after that version was checked by the job and the route was not shortened.
+
+    The edits are queued with the version of the graph before and after them, and a background task
+    processes the queue. Consecutive edits are merged, so the routes of a burst of edits are checked once.
+    The checked and stale edits are kept in the graph_edit table, so the stored routes stay valid after a
+    restart. An edit without a job, as one made by another process or one with too many edges, is stale: the
+    routes before it are computed again on read.
+
+    Attributes:
+    - current (dict | None): The progress of the running job.
+    - last (dict | None): The counts of the last job.
+    - totals (dict): The number of jobs, and of checked, re-routed, unchanged and failed routes.
+    """
+
+    def __init__(self):
+        """
+        Initialize the RouteMaintenance object, with an empty queue. Routes are only served at the version
+        they were computed with until the job is started.
+
+        Returns: None
+        """
+        self._edits = []
+        self._pending = []
+        self._floor = None
+        self._version = None
+        self._edge_version = 0
+        self._started = False
+        self._task = None
+        self.current = None
+        self.last = None
+        self.totals = {"jobs": 0, "routes_checked": 0, "routes_rerouted": 0, "routes_unchanged": 0,
+                       "routes_failed": 0}
+
+    async def start(self, db: AsyncSession):
+        """
+        Reads the edit log, to know from which version the stored routes are valid.
+
+        Args:
+            db: (AsyncSession): The database session.
+
+        Returns: None
+        """
+        result = await db.execute(select(models.GraphEdit).order_by(models.GraphEdit.id))
+        edits = result.scalars().all()
+
+        # The routes are valid from the start of the last run of checked edits that reaches the last version
+        self._floor = self._version = None
+        if edits:
+            self._floor = self._version = edits[-1].new_version
+            for edit in reversed(edits):
+                if edit.state != "checked" or edit.new_version != self._floor:
+                    break
+                self._floor = edit.old_version
+        self._started = True
+
+    def valid_from(self, version: int):
+        """
+        Gets the oldest version of the stored routes that are current at a version of the graph.
+
+        Args:
+            version: (int): The version of the graph.
+
+        Returns:
+            int: The oldest version of a current route. The routes of a version from it up to the version of
+            the graph are current.
+        """
+        if not self._started:
+            return version
+        self._reach(version)
+        if version != self._version:
+            return version
+
+        # The routes before an edit that is being checked are not current until its job finishes
+        return max([self._floor, *self._pending])
+
+    def edited_since(self, version: int):
+        """
+        Tells if edges were added to the graph after a version, so a route computed with it and stored after
+        the job of the edit read the routes may not have been checked.
+
+        Args:
+            version: (int): The version of the graph the route was computed with.
+
+        Returns:
+            bool: True if the route must not be kept.
+        """
+        return version < self._edge_version
+
+    def graph_edited(self, old_version: int, new_version: int, edges=()):
+        """
+        Queues the job of a graph edit, and starts the background task if it is not running. The edits are
+        ignored until the job is started, as in the command line importer.
+
+        Args:
+            old_version: (int): The version of the graph before the edit.
+            new_version: (int): The version of the graph after the edit.
+            edges: (Iterable[tuple[int, int, float]]): The start node id, end node id and distance of each
+            new edge, empty if only nodes were added.
+
+        Returns: None
+        """
+        if not self._started or old_version == new_version:
+            return
+        self._reach(old_version)
+
+        # Part of the edit was already seen as an unknown change of the graph, so the rest is stale too
+        if old_version != self._version:
+            if new_version > self._version:
+                self._queue(self._version, new_version, None)
+            return
+        self._queue(old_version, new_version, [edge for edge in edges if edge[2] is not None])
+
+    def _reach(self, version: int):
+        """
+        Brings the last known version up to a version of the graph. A version reached without a known edit,
+        as one of another process, is a stale edit.
+        """
+        if self._version is None:
+            self._floor = self._version = version
+        elif version > self._version:
+            self._queue(self._version, version, None)
+
+    def _queue(self, old_version: int, new_version: int, edges: Optional[list[tuple[int, int, float]]]):
+        """
+        Queues an edit, with None as edges if they are unknown, and starts the background task.
+        """
+        self._version = new_version
+        if edges is None or len(edges) > REROUTE_MAX_EDGES:
+            self._floor = max(self._floor, new_version)
+        elif edges:
+            self._pending.append(new_version)
+        if edges is None or edges:
+            self._edge_version = new_version
+
+        self._edits.append((old_version, new_version, edges))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        """
+        Processes the queued edits, merging the consecutive ones. A merged edit with unknown edges is stale.
+        """
+        while self._edits:
+            edits, self._edits = self._edits, []
+            groups = []
+            for old_version, new_version, edges in edits:
+                if groups and groups[-1][1] == old_version:
+                    merged = None if edges is None or groups[-1][2] is None else groups[-1][2] + edges
+                    groups[-1] = (groups[-1][0], new_version, merged)
+                else:
+                    groups.append((old_version, new_version, edges))
+
+            for old_version, new_version, edges in groups:
+                await self._process(old_version, new_version, edges)
+
+    async def _process(self, old_version: int, new_version: int, edges: Optional[list[tuple[int, int, float]]]):
+        """
+        Runs the job of an edit, keeps its progress and counts, and logs the edit as checked or stale.
+        """
+        self.current = {"old_version": old_version, "new_version": new_version,
+                        "edges": None if edges is None else len(edges), "state": "running", "batches": 0,
+                        "routes_checked": 0, "routes_rerouted": 0, "routes_unchanged": 0, "routes_failed": 0,
+                        "started_at": time.time()}
+        job = self.current
+        state = "stale"
+        try:
+            if edges is None or len(edges) > REROUTE_MAX_EDGES:
+                job["state"] = "skipped"
+            else:
+                # Adding a node can not change a route, so only the edits with edges read the routes
+                if edges:
+                    await self._reroute(old_version, new_version, edges, job)
+                job["state"] = "finished"
+                state = "checked"
+        except Exception as error:
+            logger.exception("The re-routing job from version %s to %s failed", old_version, new_version)
+            job["state"] = "failed"
+            job["error"] = str(error)
+        finally:
+            job["seconds"] = round(time.time() - job["started_at"], 3)
+            self.totals["jobs"] += 1
+            for key in ("routes_checked", "routes_rerouted", "routes_unchanged", "routes_failed"):
+                self.totals[key] += job[key]
+            self.last, self.current = job, None
+
+        # The routes before a stale edit are computed on read
+        self._pending = [version for version in self._pending if not old_version < version <= new_version]
+        if state == "stale":
+            self._floor = max(self._floor, new_version)
+        try:
+            await self._log(old_version, new_version, state)
+        except Exception:
+            logger.exception("Could not log the graph edit from version %s to %s", old_version, new_version)
+
+    @staticmethod
+    async def _log(old_version: int, new_version: int, state: str):
+        """
+        Logs an edit in the graph_edit table. A checked edit extends the last row if it follows it, and a
+        stale edit replaces the rows before it, so the table stays small.
+        """
+        edit = models.GraphEdit
+        async with AsyncSessionLocal() as db:
+            if state == "stale":
+                await db.execute(delete(edit))
+                db.add(edit(old_version=old_version, new_version=new_version, state=state))
+            else:
+                result = await db.execute(select(edit).order_by(edit.id.desc()).limit(1))
+                last = result.scalars().first()
+                if last is not None and last.state == "checked" and last.new_version == old_version:
+                    last.new_version = new_version
+                else:
+                    db.add(edit(old_version=old_version, new_version=new_version, state=state))
+            await db.commit()
+
+    async def _reroute(self, old_version: int, new_version: int, edges: list[tuple[int, int, float]], job: dict):
+        """
+        Reads the current routes of the versions before an edit in batches, ordered by package id, and checks
+        up to REROUTE_CONCURRENCY batches at a time.
+        """
+        async with AsyncSessionLocal() as db:
+            graph = await graph_store.snapshot(db)
+
+        # The routes older than the valid version are already computed on read
+        floor = self._floor
+        semaphore = asyncio.Semaphore(REROUTE_CONCURRENCY)
+        tasks = set()
+        last_id = 0
+        while True:
+            await semaphore.acquire()
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(select(models.PackageRoute.package_id, models.Package.start_node_id,
+                                                 models.Package.end_node_id, models.PackageRoute.distance,
+                                                 models.PackageRoute.graph_version)
+                                          .join(models.Package)
+                                          .where(models.PackageRoute.graph_version >= floor,
+                                                 models.PackageRoute.graph_version < new_version,
+                                                 models.PackageRoute.package_id > last_id)
+                                          .order_by(models.PackageRoute.package_id)
+                                          .limit(REROUTE_BATCH_SIZE))
+                rows = result.all()
+            if not rows:
+                semaphore.release()
+                break
+            last_id = rows[-1].package_id
+
+            task = asyncio.create_task(self._reroute_batch(graph, edges, rows, job))
+            tasks.add(task)
+            task.add_done_callback(lambda done: (tasks.discard(done), semaphore.release()))
+
+        await asyncio.gather(*tasks)
+
+    async def _reroute_batch(self, graph: GraphSnapshot, edges: list[tuple[int, int, float]], rows, job: dict):
+        """
+        Searches again the routes of a batch that the new edges can shorten. The others are not written, as
+        they stay valid once the edit is logged as checked.
+        """
+        table = models.PackageRoute.__table__
+        keys = [{"route_package_id": row.package_id, "route_graph_version": row.graph_version} for row in rows]
+        pairs = [(row.start_node_id, row.end_node_id) for row in rows]
+        try:
+            affected = await self._run_task(affected_routes, graph, edges, *zip(*pairs),
+                                            [row.distance for row in rows])
+            positions = np.flatnonzero(affected)
+            found = await self._run_task(search_routes, graph, [pairs[position] for position in positions])
+        except TaskTimeoutError:
+            # The routes of the batch were not checked, so they are deleted and computed on read
+            async with AsyncSessionLocal() as db:
+                await db.execute(delete(table)
+                                 .where(table.c.package_id == bindparam("route_package_id"),
+                                        table.c.graph_version == bindparam("route_graph_version")),
+                                 keys)
+                await db.commit()
+            job["routes_failed"] += len(rows)
+            return
+
+        # Only the routes that were not stored again since they were read are updated
+        rerouted = [{**keys[position], "route_node_ids": [int(node_id) for node_id in path],
+                     "route_distance": float(distance) if path else None}
+                    for position, (path, distance) in zip(positions, found)]
+        if rerouted:
+            async with AsyncSessionLocal() as db:
+                await db.execute(update(table)
+                                 .where(table.c.package_id == bindparam("route_package_id"),
+                                        table.c.graph_version == bindparam("route_graph_version"))
+                                 .values(node_ids=bindparam("route_node_ids"), distance=bindparam("route_distance"),
+                                         graph_version=graph.version),
+                                 rerouted)
+                await db.commit()
+
+        job["batches"] += 1
+        job["routes_checked"] += len(rows)
+        job["routes_rerouted"] += len(rerouted)
+        job["routes_unchanged"] += len(rows) - len(rerouted)
+
+    @staticmethod
+    async def _run_task(function, graph: GraphSnapshot, *args):
+        """
+        Runs a task in the executor, waiting while its queue is full, so the job does not take the place of
+        the requests.
+        """
+        while True:
+            try:
+                return await executor.run_graph(function, graph, *args)
+            except ExecutorBusyError:
+                await asyncio.sleep(REROUTE_RETRY_DELAY)
+
+    def stats(self):
+        """
+        Gets the progress of the running job, the counts of the last one, and the totals.
+
+        Returns:
+            dict: The version of the graph and the oldest version of the current routes, the queued edits, the
+            running and last jobs, and the total counts.
+        """
+        return {"graph_version": self._version, "valid_from": self._floor, "queued_edits": len(self._edits),
+                "current": self.current, "last": self.last, "totals": self.totals}
+
+    async def shutdown(self):
+        """
+        Cancels the background task. The edits it did not log are stale after a restart.
+
+        Returns: None
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+# The re-routing job of the process
+route_maintenance = RouteMaintenance()
@@ -0,0 +1,65 @@
+"""
+This module contains the keyset pagination of the node and edge listings.
+It includes the following:
+- The page size settings of the listings
+- The encode_cursor and decode_cursor functions, which convert the last id of a page to an opaque cursor
+
+A cursor holds the id of the last row of a page, and the next page starts after it, so every page is read
+with an index range scan, whatever its position in the table.
+"""
+
+# Standard library imports
+import base64
+import binascii
+import json
+import os
+from typing import Optional
+
+# Number of rows per page of the node and edge listings, and the largest page size a client can request
+LISTING_PAGE_SIZE = int(os.getenv("LISTING_PAGE_SIZE", "1000"))
+LISTING_MAX_PAGE_SIZE = int(os.getenv("LISTING_MAX_PAGE_SIZE", "10000"))
+
+
+class InvalidCursorError(ValueError):
+    """
+    InvalidCursorError is raised when a cursor was not returned by the API.
+    """
+    pass
+
+
+def encode_cursor(last_id: int):
+    """
+    Creates the cursor of the page that starts after a row.
+
+    Args:
+        last_id: (int): The id of the last row of the current page.
+
+    Returns:
+        str: The opaque cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps({"after": last_id}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]):
+    """
+    Gets the id after which a page starts.
+
+    Args:
+        cursor: (Optional[str]): The cursor, or None for the first page.
+
+    Returns:
+        int: The id after which the page starts, 0 for the first page.
+
+    Raises:
+        InvalidCursorError: If the cursor is not valid.
+    """
+    if not cursor:
+        return 0
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        last_id = value["after"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+        raise InvalidCursorError("The cursor is not valid")
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise InvalidCursorError("The cursor is not valid")
+    return last_id
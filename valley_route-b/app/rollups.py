@@ -0,0 +1,234 @@
+"""
+This module contains the rollup tables of the package statistics, with the number of packages per node,
+and per node and hour.
+It includes the following:
+- The count_package function, which updates the rollups in the transaction that creates or deletes a package
+- The rebuild_node_package_rollups function, which computes the rollups again from the package table
+- The get_package_time_series function, which merges the hourly rollup into hours, days or weeks
+- The command line entry point, to rebuild the rollups without going through the API
+
+Usage:
+    python -m app.rollups rebuild
+"""
+
+# Standard library imports
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+# Third-party imports
+from sqlalchemy import delete, exists, func, insert, literal, select, text, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local imports (project-specific)
+from app import models
+from app.database import AsyncSessionLocal
+
+
+def hour_of(moment: datetime):
+    """
+    Gets the start of the hour of a moment.
+
+    Args:
+        moment: (datetime): The moment.
+
+    Returns:
+        datetime: The moment with the minutes, seconds and microseconds set to zero.
+    """
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+async def _add_counts(db: AsyncSession, rollup, key: dict, start_packages: int, end_packages: int):
+    """
+    Adds to the counts of a rollup row, creating the row if it does not exist yet.
+    """
+    statement = (update(rollup).filter_by(**key)
+                 .values(start_packages=rollup.start_packages + start_packages,
+                         end_packages=rollup.end_packages + end_packages))
+    if (await db.execute(statement)).rowcount:
+        return
+
+    # The row is inserted in a savepoint, because another transaction can insert it at the same time
+    try:
+        async with db.begin_nested():
+            await db.execute(insert(rollup).values(**key, start_packages=start_packages, end_packages=end_packages))
+    except IntegrityError:
+        await db.execute(statement)
+
+
+async def count_package(db: AsyncSession, start_node_id: int, end_node_id: int, created_at: datetime,
+                        delta: int = 1):
+    """
+    Updates the rollups with a package that is being created or deleted. It does not commit, so the rollups
+    change in the same transaction as the package.
+
+    Args:
+        db: (AsyncSession): The database session.
+        start_node_id: (int): The id of the start node of the package.
+        end_node_id: (int): The id of the end node of the package.
+        created_at: (datetime): The creation date of the package.
+        delta: (int): 1 when the package is created, -1 when it is deleted.
+
+    Returns: None
+    """
+    # A package that starts and ends at the same node updates a single row of each rollup
+    counts = {start_node_id: [0, 0], end_node_id: [0, 0]}
+    counts[start_node_id][0] += delta
+    counts[end_node_id][1] += delta
+
+    # The rows are always updated in the same order, so concurrent transactions do not deadlock
+    hour = hour_of(created_at)
+    for node_id in sorted(counts):
+        await _add_counts(db, models.NodePackageRollup, {"node_id": node_id}, *counts[node_id])
+        await _add_counts(db, models.NodePackageHourlyRollup, {"node_id": node_id, "hour": hour}, *counts[node_id])
+
+
+def _count_by_node(*group_columns):
+    """
+    Builds the query that counts the packages by start node and by end node, each count in its own column,
+    and adds up the two counts of each node and group.
+    """
+    # Rows without a value in one of the group columns can not be counted
+    known = [column.is_not(None) for column in group_columns]
+
+    starts = (select(models.Package.start_node_id.label("node_id"), *group_columns,
+                     func.count().label("start_packages"), literal(0).label("end_packages"))
+              .where(models.Package.start_node_id.is_not(None), *known)
+              .group_by(models.Package.start_node_id, *group_columns))
+    ends = (select(models.Package.end_node_id.label("node_id"), *group_columns,
+                   literal(0).label("start_packages"), func.count().label("end_packages"))
+            .where(models.Package.end_node_id.is_not(None), *known)
+            .group_by(models.Package.end_node_id, *group_columns))
+    counts = union_all(starts, ends).subquery()
+
+    keys = [counts.c.node_id, *(counts.c[column.name] for column in group_columns)]
+    return select(*keys, func.sum(counts.c.start_packages), func.sum(counts.c.end_packages)).group_by(*keys)
+
+
+async def rebuild_node_package_rollups(db: AsyncSession):
+    """
+    Computes the rollups again from the package table, with one query each, and commits them.
+
+    Args:
+        db: (AsyncSession): The database session.
+
+    Returns:
+        int: The number of nodes with packages.
+    """
+    # Packages can not be created while the rollup is rebuilt
+    if db.get_bind().dialect.name == "postgresql":
+        await db.execute(text("LOCK TABLE package IN SHARE MODE"))
+
+    # Replace the rollups with the counts of each node, and of each node and hour
+    await db.execute(delete(models.NodePackageRollup))
+    result = await db.execute(insert(models.NodePackageRollup).from_select(
+        ["node_id", "start_packages", "end_packages"], _count_by_node()))
+
+    if db.get_bind().dialect.name == "postgresql":
+        hour = func.date_trunc("hour", models.Package.created_at)
+    else:
+        hour = func.strftime("%Y-%m-%d %H:00:00.000000", models.Package.created_at)
+    await db.execute(delete(models.NodePackageHourlyRollup))
+    await db.execute(insert(models.NodePackageHourlyRollup).from_select(
+        ["node_id", "hour", "start_packages", "end_packages"],
+        _count_by_node(hour.label("hour"))))
+    await db.commit()
+    return result.rowcount
+
+
+async def ensure_node_package_rollups(db: AsyncSession):
+    """
+    Builds the rollups if one of them is empty while there are packages, as after the tables are first created.
+
+    Args:
+        db: (AsyncSession): The database session.
+
+    Returns: None
+    """
+    rollup_empty = False
+    for rollup in (models.NodePackageRollup, models.NodePackageHourlyRollup):
+        rollup_empty = rollup_empty or not (await db.execute(select(exists().select_from(rollup)))).scalar()
+    if rollup_empty and (await db.execute(select(exists().select_from(models.Package)))).scalar():
+        await rebuild_node_package_rollups(db)
+
+
+def bucket_of(hour: datetime, bucket: str):
+    """
+    Gets the start of the hour, day or week of an hour. Weeks start on Monday.
+
+    Args:
+        hour: (datetime): The start of the hour.
+        bucket: (str): "hour", "day" or "week".
+
+    Returns:
+        datetime: The start of the bucket.
+    """
+    if bucket == "hour":
+        return hour
+    day = hour.replace(hour=0)
+    return day if bucket == "day" else day - timedelta(days=day.weekday())
+
+
+async def get_package_time_series(db: AsyncSession, bucket: str, start: Optional[datetime] = None,
+                                  end: Optional[datetime] = None, node_id: Optional[int] = None):
+    """
+    Gets the number of packages that start and end at each node by hour, day or week. Only the rows of the
+    hourly rollup in the date range are read, and they are merged into the requested buckets.
+
+    Args:
+        db: (AsyncSession): The database session.
+        bucket: (str): "hour", "day" or "week".
+        start: (Optional[datetime]): The first hour of the range, included.
+        end: (Optional[datetime]): The end of the range, excluded.
+        node_id: (Optional[int]): The id of the node, or None for all the nodes.
+
+    Returns:
+        list[tuple[datetime, int, str, int, int]]: The bucket, node id, node name, and the number of
+        packages that start and end at the node in the bucket, ordered by bucket and node name.
+    """
+    rollup = models.NodePackageHourlyRollup
+    query = (select(rollup.hour, rollup.node_id, models.Node.name, rollup.start_packages, rollup.end_packages)
+             .join(models.Node, models.Node.id == rollup.node_id))
+    if start is not None:
+        query = query.where(rollup.hour >= start)
+    if end is not None:
+        query = query.where(rollup.hour < end)
+    if node_id is not None:
+        query = query.where(rollup.node_id == node_id)
+
+    # Merge the hours into the buckets
+    series = {}
+    for hour, row_node_id, name, start_packages, end_packages in await db.execute(query):
+        key = (bucket_of(hour, bucket), row_node_id)
+        counts = series.setdefault(key, [name, 0, 0])
+        counts[1] += start_packages
+        counts[2] += end_packages
+
+    points = [(bucket_start, row_node_id, name, start_packages, end_packages)
+              for (bucket_start, row_node_id), (name, start_packages, end_packages) in series.items()
+              if start_packages or end_packages]
+    return sorted(points, key=lambda point: (point[0], point[2] or "", point[1]))
+
+
+def main():
+    """
+    Command line entry point of the rollup maintenance.
+
+    Returns: None
+    """
+    parser = argparse.ArgumentParser(description="Maintain the rollup tables of the package statistics.")
+    parser.add_argument("command", choices=["rebuild"], help="The operation to run.")
+    parser.parse_args()
+
+    async def run():
+        async with AsyncSessionLocal() as db:
+            return await rebuild_node_package_rollups(db)
+
+    count = asyncio.run(run())
+    print(f"Rebuilt the package counts of {count} nodes")
+
+
+if __name__ == "__main__":
+    main()
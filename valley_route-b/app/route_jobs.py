@@ -0,0 +1,243 @@
+"""
+This module contains the background worker that computes the routes of new packages.
+It includes the following:
+- The RouteJobWorker class, which claims the pending jobs of the route_job table in batches and stores their routes
+- The process-level route_jobs instance, started with the application and notified by create_user_package
+
+The queue is the route_job table, so no external broker is needed. A package and its job are inserted in the
+same transaction, and the request returns without waiting for the route. The worker claims the oldest jobs
+with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never claim the same job, and solves each batch
+with one task of the executor, which runs a single search per distinct start node. At most
+ROUTE_JOB_CONCURRENCY batches are solved at a time.
+"""
+
+# Standard library imports
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+# Third-party imports
+from sqlalchemy import and_, func, or_, select, update
+
+# Local imports (project-specific)
+from app import models
+from app.database import AsyncSessionLocal
+from app.executor import ExecutorBusyError, TaskTimeoutError, executor
+from app.graph import graph_store
+from app.package_routes import save_routes
+from app.routing import search_routes
+
+# Number of jobs claimed and solved together, and number of batches solved at a time
+ROUTE_JOB_BATCH_SIZE = int(os.getenv("ROUTE_JOB_BATCH_SIZE", "500"))
+ROUTE_JOB_CONCURRENCY = int(os.getenv("ROUTE_JOB_CONCURRENCY", "2"))
+
+# Seconds between two checks of the queue when it is empty, and seconds after which a claimed job that did not
+# finish can be claimed again
+ROUTE_JOB_POLL_INTERVAL = float(os.getenv("ROUTE_JOB_POLL_INTERVAL", "1"))
+ROUTE_JOB_LEASE = float(os.getenv("ROUTE_JOB_LEASE", "300"))
+
+# Number of attempts after which a job that times out is marked as failed
+ROUTE_JOB_MAX_ATTEMPTS = int(os.getenv("ROUTE_JOB_MAX_ATTEMPTS", "3"))
+
+logger = logging.getLogger(__name__)
+
+
+class RouteJobWorker:
+    """
+    RouteJobWorker computes the routes of the jobs of the route_job table in a background task of the
+    event loop of the application.
+
+    Attributes:
+    - claimed (int): The number of jobs claimed.
+    - done (int): The number of jobs whose route was stored.
+    - retried (int): The number of jobs released to be claimed again.
+    - failed (int): The number of jobs marked as failed.
+    - batches (int): The number of batches solved.
+    """
+
+    def __init__(self):
+        """
+        Initialize a stopped RouteJobWorker.
+
+        Returns: None
+        """
+        self.claimed = 0
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self._task = None
+        self._wakeup = None
+        self._batches = set()
+
+    def start(self):
+        """
+        Starts the background task in the running event loop.
+
+        Returns: None
+        """
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def notify(self):
+        """
+        Wakes up the worker, after a job was queued, instead of waiting for the next check of the queue.
+
+        Returns: None
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def shutdown(self):
+        """
+        Cancels the background task and the batches being solved. Their jobs are claimed again once their
+        claim expires.
+
+        Returns: None
+        """
+        tasks = [task for task in (self._task, *self._batches) if task is not None and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        """
+        Claims batches of jobs while there are free slots, and waits for new jobs when the queue is empty.
+        """
+        slots = asyncio.Semaphore(ROUTE_JOB_CONCURRENCY)
+        while True:
+            await slots.acquire()
+            self._wakeup.clear()
+            try:
+                jobs = await self._claim()
+            except Exception:
+                logger.exception("Could not claim the route jobs")
+                jobs = []
+
+            if not jobs:
+                slots.release()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), ROUTE_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self._solve(jobs))
+            self._batches.add(task)
+            task.add_done_callback(lambda done: (self._batches.discard(done), slots.release()))
+
+    async def _claim(self):
+        """
+        Claims the oldest pending jobs, and the running jobs whose claim expired.
+        """
+        now = datetime.now()
+        job = models.RouteJob
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(job.id)
+                                      .where(or_(job.status == "pending",
+                                                 and_(job.status == "running",
+                                                      job.claimed_at < now - timedelta(seconds=ROUTE_JOB_LEASE))))
+                                      .order_by(job.id)
+                                      .limit(ROUTE_JOB_BATCH_SIZE)
+                                      .with_for_update(skip_locked=True))
+            job_ids = result.scalars().all()
+            if not job_ids:
+                return []
+
+            await db.execute(update(job).where(job.id.in_(job_ids))
+                             .values(status="running", claimed_at=now, attempts=job.attempts + 1))
+            result = await db.execute(select(job.id, job.attempts, models.Package.id, models.Package.start_node_id,
+                                             models.Package.end_node_id)
+                                      .join(models.Package, models.Package.id == job.package_id)
+                                      .where(job.id.in_(job_ids)))
+            jobs = result.all()
+            await db.commit()
+
+        self.claimed += len(jobs)
+        return jobs
+
+    async def _solve(self, jobs):
+        """
+        Solves the routes of a batch of jobs, and stores them with the version of the graph they were
+        computed with.
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                graph = await graph_store.snapshot(db)
+
+            try:
+                routes = await executor.run_graph(search_routes, graph,
+                                                  [(start, end) for _, _, _, start, end in jobs])
+            except (ExecutorBusyError, TaskTimeoutError) as error:
+                await self._release(jobs, error)
+                return
+
+            # Store the routes, then mark the jobs as done. A job that is not marked is solved again
+            async with AsyncSessionLocal() as db:
+                await save_routes(db, graph.version, [(package_id, *route)
+                                                      for (_, _, package_id, _, _), route in zip(jobs, routes)])
+                await db.execute(update(models.RouteJob)
+                                 .where(models.RouteJob.id.in_([job_id for job_id, _, _, _, _ in jobs]))
+                                 .values(status="done", error=None))
+                await db.commit()
+        except Exception:
+            # The jobs stay claimed, and they are claimed again once their claim expires
+            logger.exception("Could not solve a batch of %s route jobs", len(jobs))
+            return
+
+        self.done += len(jobs)
+        self.batches += 1
+
+    async def _release(self, jobs, error: Exception):
+        """
+        Releases the jobs of a batch that could not be solved. A full executor queue does not count as an
+        attempt, and a job that timed out too many times is marked as failed.
+        """
+        busy = isinstance(error, ExecutorBusyError)
+        retry = [job_id for job_id, attempts, _, _, _ in jobs if busy or attempts < ROUTE_JOB_MAX_ATTEMPTS]
+        failed = [job_id for job_id, attempts, _, _, _ in jobs if not busy and attempts >= ROUTE_JOB_MAX_ATTEMPTS]
+
+        async with AsyncSessionLocal() as db:
+            values = {"status": "pending", "error": str(error)}
+            if busy:
+                values["attempts"] = models.RouteJob.attempts - 1
+            await db.execute(update(models.RouteJob).where(models.RouteJob.id.in_(retry)).values(**values))
+            await db.execute(update(models.RouteJob).where(models.RouteJob.id.in_(failed))
+                             .values(status="failed", error=str(error)))
+            await db.commit()
+
+        self.retried += len(retry)
+        self.failed += len(failed)
+
+        # Give the executor time to drain its queue before the next batch is claimed
+        if busy:
+            await asyncio.sleep(ROUTE_JOB_POLL_INTERVAL)
+
+    async def stats(self):
+        """
+        Gets the number of jobs of each status, and the counters of the worker.
+
+        Returns:
+            dict: The jobs by status, and the claimed, done, retried and failed jobs and the solved batches
+            of this process.
+        """
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(models.RouteJob.status, func.count())
+                                      .group_by(models.RouteJob.status))
+            statuses = {status: count for status, count in result.all()}
+
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "jobs": {status: statuses.get(status, 0) for status in ("pending", "running", "done", "failed")},
+            "claimed": self.claimed,
+            "done": self.done,
+            "retried": self.retried,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+
+# The route worker of the process
+route_jobs = RouteJobWorker()
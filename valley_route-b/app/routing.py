@@ -0,0 +1,415 @@
+"""
+This module contains the point-to-point route engine used by the package endpoints.
+It includes the following:
+- A geodesic lower bound between nodes, computed from their latitude and longitude
+- Landmark (ALT) lower bounds, precomputed once per graph snapshot
+- An A* search that stops as soon as it reaches the target node
+- The search_route and search_routes functions, which run the searches in the workers of the executor
+- The find_route and find_routes functions, which answer from the cache and send the other routes to the executor
+- The distance_matrix function, which computes origin by destination distance tables
+- The reachable_nodes function, which finds the nodes within a distance of a node with a bounded search
+"""
+
+# Standard library imports
+import heapq
+import math
+import os
+
+# Third-party imports
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local imports (project-specific)
+from app.cache import route_cache
+from app.contraction import contraction_index
+from app.distance import EARTH_RADIUS, haversine
+from app.executor import executor
+from app.graph import GraphSnapshot, graph_store
+
+# Number of landmarks used by the ALT heuristic, 0 disables the landmarks
+ROUTING_LANDMARKS = int(os.getenv("ROUTING_LANDMARKS", "8"))
+
+# Maximum number of distance and predecessor values held in memory by each batch of searches
+ROUTING_BATCH_VALUES = int(os.getenv("ROUTING_BATCH_VALUES", "16000000"))
+
+# Route engine of the deployment: "astar", or "ch" to use the contraction hierarchies index
+ROUTING_ENGINE = os.getenv("ROUTING_ENGINE", "astar")
+
+
+class Heuristic:
+    """
+    Heuristic holds the lower bounds used by the A* search for one graph snapshot.
+
+    The geodesic bound is scaled by the smallest ratio between the distance of an edge and the great-circle
+    distance of its nodes, so it never overestimates, whatever method was used to measure the edges. The
+    landmark bounds use the triangle inequality with the distances from a few nodes far from each other.
+
+    Attributes:
+    - scale (float): The factor applied to the great-circle distance.
+    - landmarks (np.ndarray): The matrix indexes of the landmark nodes.
+    - landmark_distances (np.ndarray): The distance from every landmark, one row per node.
+    """
+
+    def __init__(self, graph: GraphSnapshot, landmarks: int = ROUTING_LANDMARKS):
+        """
+        Initialize the Heuristic object, computing the geodesic scale and the landmark distances.
+        Args:
+            graph: (GraphSnapshot): The graph snapshot.
+            landmarks: (int): The number of landmarks to select.
+
+        Returns: None
+        """
+        self.lat = np.radians(graph.lat)
+        self.lng = np.radians(graph.lng)
+        self.scale = self._geodesic_scale(graph)
+        self.landmarks, self.landmark_distances = self._select_landmarks(graph, landmarks)
+
+    @staticmethod
+    def _geodesic_scale(graph: GraphSnapshot):
+        """
+        Gets the largest factor for which the scaled great-circle distance is a lower bound of every edge.
+        """
+        edges = graph.matrix.tocoo()
+        if edges.nnz == 0:
+            return 0.0
+
+        geodesic = haversine(graph.lat[edges.row], graph.lng[edges.row], graph.lat[edges.col], graph.lng[edges.col])
+        measured = geodesic > 0
+        if not measured.any():
+            return 0.0
+
+        # Leave a small margin for rounding errors
+        return float(np.min(edges.data[measured] / geodesic[measured])) * (1 - 1e-9)
+
+    @staticmethod
+    def _select_landmarks(graph: GraphSnapshot, count: int):
+        """
+        Selects the landmarks by farthest-point selection and gets their distances to every node.
+        """
+        count = min(count, graph.size)
+        if count <= 0:
+            return np.empty(0, dtype=np.int64), np.empty((graph.size, 0))
+
+        # Start from the first node, and then add the node farthest from the landmarks already selected
+        landmarks = [0]
+        distances = [dijkstra(graph.matrix, directed=False, indices=0)]
+        closest = distances[0].copy()
+        while len(landmarks) < count:
+            candidate = int(np.argmax(closest))
+            if candidate in landmarks:
+                break
+            landmarks.append(candidate)
+            distances.append(dijkstra(graph.matrix, directed=False, indices=candidate))
+            closest = np.minimum(closest, distances[-1])
+
+        # Store one row per node so the bounds of a node are contiguous
+        return np.array(landmarks), np.ascontiguousarray(np.array(distances).T)
+
+    def to_target(self, target: int):
+        """
+        Gets the lower bound function of the distance to a target node.
+
+        Args:
+            target: (int): The matrix index of the target node.
+
+        Returns:
+            Callable[[int], float]: The function that returns the lower bound from a node to the target.
+        """
+        target_lat = float(self.lat[target])
+        target_lng = float(self.lng[target])
+        cos_target = math.cos(target_lat)
+        target_distances = self.landmark_distances[target]
+        target_reached = np.isfinite(target_distances)
+        use_landmarks = len(target_distances) > 0
+
+        def bound(node: int):
+            # Great-circle distance to the target
+            lat = float(self.lat[node])
+            a = (math.sin((target_lat - lat) / 2) ** 2
+                 + math.cos(lat) * cos_target * math.sin((target_lng - float(self.lng[node])) / 2) ** 2)
+            estimate = self.scale * 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+
+            if use_landmarks:
+                node_distances = self.landmark_distances[node]
+                node_reached = np.isfinite(node_distances)
+
+                # A landmark that reaches only one of the nodes means they are not connected
+                if (node_reached != target_reached).any():
+                    return math.inf
+
+                both = node_reached & target_reached
+                if both.any():
+                    estimate = max(estimate, float(np.abs(node_distances[both] - target_distances[both]).max()))
+            return estimate
+
+        return bound
+
+
+def get_heuristic(graph: GraphSnapshot):
+    """
+    Gets the heuristic of a graph snapshot, building it the first time it is needed.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+
+    Returns:
+        Heuristic: The heuristic of the snapshot.
+    """
+    return graph.derived("heuristic", Heuristic)
+
+
+def astar(graph: GraphSnapshot, source: int, target: int):
+    """
+    Finds the shortest path between two nodes with the A* algorithm. The search stops as soon as the target
+    is taken from the queue, so only the part of the graph near the route is explored.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+        source: (int): The matrix index of the start node.
+        target: (int): The matrix index of the end node.
+
+    Returns:
+        tuple[list[int], float]: The matrix indexes of the path and its distance, or an empty path and
+        infinity if the target can not be reached.
+    """
+    indptr = graph.matrix.indptr
+    indices = graph.matrix.indices
+    data = graph.matrix.data
+    bound = get_heuristic(graph).to_target(target)
+
+    # Best known distance and predecessor of each reached node
+    distance = {source: 0.0}
+    previous = {source: -1}
+    settled = set()
+
+    queue = [(bound(source), 0.0, source)]
+    while queue:
+        _, node_distance, node = heapq.heappop(queue)
+        if node == target:
+            break
+        if node in settled:
+            continue
+        settled.add(node)
+
+        # Relax the edges of the node
+        start, end = indptr[node], indptr[node + 1]
+        for neighbor, weight in zip(indices[start:end].tolist(), data[start:end].tolist()):
+            new_distance = node_distance + weight
+            if new_distance < distance.get(neighbor, math.inf):
+                estimate = bound(neighbor)
+                if estimate == math.inf:
+                    continue
+                distance[neighbor] = new_distance
+                previous[neighbor] = node
+                heapq.heappush(queue, (new_distance + estimate, new_distance, neighbor))
+    else:
+        return [], math.inf
+
+    # Follow the predecessors back from the target
+    path = [target]
+    while previous[path[-1]] != -1:
+        path.append(previous[path[-1]])
+    path.reverse()
+    return path, distance[target]
+
+
+async def graph_changed(db: AsyncSession):
+    """
+    Notifies the route engine that the graph changed, so the indexes of the selected engine are rebuilt.
+
+    Args:
+        db: (AsyncSession): The database session.
+
+    Returns: None
+    """
+    if ROUTING_ENGINE == "ch":
+        contraction_index.rebuild(await graph_store.snapshot(db))
+
+
+def search_route(graph: GraphSnapshot, start_node_id: int, end_node_id: int):
+    """
+    Searches the shortest route between two nodes with the engine selected for the deployment, without
+    using the cache. It runs in the workers of the executor.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+        start_node_id: (int): The id of the start node.
+        end_node_id: (int): The id of the end node.
+
+    Returns:
+        tuple[list[int], float]: The node ids of the path and its distance, or an empty path and
+        infinity if there is no route between the nodes.
+    """
+    source = graph.index_of(start_node_id)
+    target = graph.index_of(end_node_id)
+    if source is None or target is None:
+        return [], math.inf
+
+    # The A* search is also used while the hierarchy of the graph is being built
+    hierarchy = contraction_index.get(graph) if ROUTING_ENGINE == "ch" else None
+    if hierarchy is not None:
+        path, distance = hierarchy.query(source, target)
+    else:
+        path, distance = astar(graph, source, target)
+
+    return [int(graph.node_ids[index]) for index in path], distance
+
+
+def search_routes(graph: GraphSnapshot, pairs: list[tuple[int, int]]):
+    """
+    Searches the shortest routes of many (start node, end node) pairs, without using the cache. The pairs
+    are grouped by start node, and a single-source search is run for each distinct start node. It runs in
+    the workers of the executor.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+        pairs: (list[tuple[int, int]]): The ids of the start and end nodes of each route.
+
+    Returns:
+        list[tuple[list[int], float]]: The node ids of the path and the distance of each pair, in the same
+        order as the pairs, with an empty path and infinity for the pairs without a route.
+    """
+    routes = [([], math.inf)] * len(pairs)
+
+    # Group the pairs by the matrix index of their start node
+    pending = {}
+    for position, (start_node_id, end_node_id) in enumerate(pairs):
+        source = graph.index_of(start_node_id)
+        target = graph.index_of(end_node_id)
+        if source is not None and target is not None:
+            pending.setdefault(source, []).append((position, target))
+
+    # Run the searches in chunks of start nodes, so the result matrices stay bounded
+    sources = list(pending)
+    chunk = max(1, ROUTING_BATCH_VALUES // max(graph.size, 1))
+    for offset in range(0, len(sources), chunk):
+        chunk_sources = sources[offset:offset + chunk]
+        distances, predecessors = dijkstra(graph.matrix, directed=False, indices=chunk_sources,
+                                           return_predecessors=True)
+
+        for row, source in enumerate(chunk_sources):
+            for position, target in pending[source]:
+                if not np.isfinite(distances[row, target]):
+                    continue
+
+                # Follow the predecessors back from the end node
+                path = [target]
+                while path[-1] != source:
+                    path.append(predecessors[row, path[-1]])
+                path = [int(graph.node_ids[index]) for index in reversed(path)]
+                routes[position] = (path, float(distances[row, target]))
+
+    return routes
+
+
+async def find_route(graph: GraphSnapshot, start_node_id: int, end_node_id: int):
+    """
+    Finds the shortest route between two nodes. Popular routes are answered from the cache, and the
+    others are searched in the executor, so the event loop is not blocked.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+        start_node_id: (int): The id of the start node.
+        end_node_id: (int): The id of the end node.
+
+    Returns:
+        tuple[list[int], float]: The node ids of the path and its distance, or an empty path and
+        infinity if there is no route between the nodes.
+    """
+    if graph.index_of(start_node_id) is None or graph.index_of(end_node_id) is None:
+        return [], math.inf
+
+    # Popular routes are answered from the cache while the graph does not change
+    cached = route_cache.get(start_node_id, end_node_id, graph.version)
+    if cached is not None:
+        return cached
+
+    path, distance = await executor.run_graph(search_route, graph, start_node_id, end_node_id)
+    route_cache.put(start_node_id, end_node_id, graph.version, path, distance)
+    return path, distance
+
+
+async def find_routes(graph: GraphSnapshot, pairs: list[tuple[int, int]]):
+    """
+    Finds the shortest routes of many (start node, end node) pairs. The pairs that are not answered by the
+    cache are searched together in one task of the executor.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+        pairs: (list[tuple[int, int]]): The ids of the start and end nodes of each route.
+
+    Returns:
+        list[tuple[list[int], float]]: The node ids of the path and the distance of each pair, in the same
+        order as the pairs, with an empty path and infinity for the pairs without a route.
+    """
+    routes = [([], math.inf)] * len(pairs)
+
+    # Take the routes in the cache, and keep the position of the others
+    missing = []
+    for position, (start_node_id, end_node_id) in enumerate(pairs):
+        if graph.index_of(start_node_id) is None or graph.index_of(end_node_id) is None:
+            continue
+        cached = route_cache.get(start_node_id, end_node_id, graph.version)
+        if cached is not None:
+            routes[position] = cached
+        else:
+            missing.append(position)
+
+    if missing:
+        found = await executor.run_graph(search_routes, graph, [pairs[position] for position in missing])
+        for position, (path, distance) in zip(missing, found):
+            if path:
+                route_cache.put(pairs[position][0], pairs[position][1], graph.version, path, distance)
+            routes[position] = (path, distance)
+
+    return routes
+
+
+def distance_matrix(graph: GraphSnapshot, origins: list[int], destinations: list[int]):
+    """
+    Computes the shortest distance from every origin to every destination. A multi-source search is run for
+    the distinct origins, in chunks, and the destination columns are taken from its result.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+        origins: (list[int]): The matrix indexes of the origin nodes.
+        destinations: (list[int]): The matrix indexes of the destination nodes.
+
+    Returns:
+        np.ndarray: The float32 matrix of distances, one row per origin and one column per destination,
+        with infinity for the pairs without a route.
+    """
+    unique_origins, inverse = np.unique(np.asarray(origins, dtype=np.int64), return_inverse=True)
+    destinations = np.asarray(destinations, dtype=np.int64)
+    distances = np.empty((len(unique_origins), len(destinations)), dtype=np.float32)
+
+    # Run the searches in chunks of origins, so only chunk rows of the whole graph are held at a time
+    chunk = max(1, ROUTING_BATCH_VALUES // max(graph.size, 1))
+    for offset in range(0, len(unique_origins), chunk):
+        result = dijkstra(graph.matrix, directed=False, indices=unique_origins[offset:offset + chunk])
+        distances[offset:offset + chunk] = result[:, destinations]
+
+    # Expand the distinct origins back to the requested order
+    return distances[inverse]
+
+
+def reachable_nodes(graph: GraphSnapshot, source: int, max_distance: float):
+    """
+    Finds the nodes that can be reached from a node within a distance. The search stops expanding the nodes
+    that are farther than the distance, so its cost depends on the size of the zone, not of the graph.
+    It runs in the workers of the executor.
+
+    Args:
+        graph: (GraphSnapshot): The graph snapshot.
+        source: (int): The matrix index of the node.
+        max_distance: (float): The largest distance of the route to a node.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The ids of the nodes reached, including the source, and their
+        distances, sorted by distance.
+    """
+    distances = dijkstra(graph.matrix, directed=False, indices=source, limit=max_distance)
+    reached = np.flatnonzero(np.isfinite(distances))
+    reached = reached[np.argsort(distances[reached], kind="stable")]
+    return graph.node_ids[reached], distances[reached]
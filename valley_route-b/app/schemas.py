@@ -8,11 +8,12 @@ the structure of the data. It provides a way to define data models with type hin
 validate and serialize the data based on these models.
 """
 
-# Third-party imports
-from pydantic import BaseModel, ConfigDict
+# Standard library imports
+from datetime import datetime
+from typing import Annotated, Literal, Optional
 
-# Local imports (project-specific)
-from app.models import Edge
+# Third-party imports
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class UserBase(BaseModel):
@@ -115,25 +116,6 @@ class EdgeCreate(EdgeBase):
     pass
 
 
-class EdgeGet:
-    """
-    EdgeCreate is a Pydantic model that defines the fields required to create a new edge. It inherits from EdgeBase and
-    adds no additional fields.
-
-    Attributes: None
-    """
-    def __init__(self, edge: Edge):
-        """
-        Initialize the EdgeGet object with the data from the given Edge object.
-        Args:
-            edge: (Edge): The Edge object to get the data from.
-        Returns: None
-        """
-        self.start_node = edge.start_node
-        self.end_node = edge.end_node
-        self.distance = edge.distance
-
-
 class Edge(EdgeBase):
     """
     Edge is a Pydantic model that defines the fields for an edge entity.
@@ -147,6 +129,136 @@ class Edge(EdgeBase):
     pass
 
 
+class EdgeGet(BaseModel):
+    """
+    EdgeGet is a Pydantic model that defines an edge with its start and end nodes, as listed by GET /edge/.
+
+    Attributes:
+    - start_node (Node): The node where the edge starts.
+    - end_node (Node): The node where the edge ends.
+    - distance (Optional[float]): The distance between the two nodes.
+    """
+    start_node: Node
+    end_node: Node
+    distance: Optional[float]
+
+
+class NearestNode(Node):
+    """
+    NearestNode is a Pydantic model that defines a node found near a coordinate.
+    It inherits from Node and adds the distance field:
+
+    Attributes:
+    - distance (float): The great-circle distance from the coordinate to the node, in meters.
+    """
+    distance: float
+
+
+class Coordinate(BaseModel):
+    """
+    Coordinate is a Pydantic model that defines a point on the earth.
+
+    Attributes:
+    - lat (float): The latitude, between -90 and 90.
+    - lng (float): The longitude, between -180 and 180.
+    """
+    lat: Annotated[float, Field(ge=-90, le=90)]
+    lng: Annotated[float, Field(ge=-180, le=180)]
+
+
+class NearestNodesRequest(BaseModel):
+    """
+    NearestNodesRequest is a Pydantic model that defines the fields required to find the nodes nearest to
+    many coordinates.
+
+    Attributes:
+    - points (list[Coordinate]): The coordinates.
+    - k (int): The number of nodes to find for each coordinate.
+    """
+    points: list[Coordinate]
+    k: Annotated[int, Field(ge=1)] = 1
+
+
+class NodeCluster(BaseModel):
+    """
+    NodeCluster is a Pydantic model that defines the nodes of a grid cell, shown as one point of the map.
+
+    Attributes:
+    - lat (float): The mean latitude of the nodes of the cell.
+    - lng (float): The mean longitude of the nodes of the cell.
+    - count (int): The number of nodes of the cell.
+    """
+    lat: float
+    lng: float
+    count: int
+
+
+class NodeViewport(BaseModel):
+    """
+    NodeViewport is a Pydantic model that defines the content of a map viewport.
+
+    Attributes:
+    - zoom (int): The zoom level of the viewport.
+    - kind (str): "nodes" when the nodes are listed, or "clusters" when they are grouped by grid cell.
+    - nodes (list[Node]): The nodes inside the viewport, empty when kind is "clusters".
+    - clusters (list[NodeCluster]): The clusters inside the viewport, empty when kind is "nodes".
+    """
+    zoom: int
+    kind: Literal["nodes", "clusters"]
+    nodes: list[Node]
+    clusters: list[NodeCluster]
+
+
+class ReachableNode(BaseModel):
+    """
+    ReachableNode is a Pydantic model that defines a node reached from another node.
+
+    Attributes:
+    - id (int): The id of the node.
+    - distance (float): The distance of the shortest route to the node.
+    """
+    id: int
+    distance: float
+
+
+class ReachableNodes(BaseModel):
+    """
+    ReachableNodes is a Pydantic model that defines the nodes reachable from a node within a distance.
+
+    Attributes:
+    - node_id (int): The id of the node where the routes start.
+    - max_distance (float): The largest distance of the routes.
+    - nodes (list[ReachableNode]): The nodes reached, including the start node, sorted by distance.
+    """
+    node_id: int
+    max_distance: float
+    nodes: list[ReachableNode]
+
+
+class NodePage(BaseModel):
+    """
+    NodePage is a Pydantic model that defines a page of the node listing.
+
+    Attributes:
+    - data (list[Node]): The nodes of the page.
+    - next_cursor (Optional[str]): The cursor of the next page, None if it is the last page.
+    """
+    data: list[Node]
+    next_cursor: Optional[str]
+
+
+class EdgePage(BaseModel):
+    """
+    EdgePage is a Pydantic model that defines a page of the edge listing.
+
+    Attributes:
+    - data (list[EdgeGet]): The edges of the page.
+    - next_cursor (Optional[str]): The cursor of the next page, None if it is the last page.
+    """
+    data: list[EdgeGet]
+    next_cursor: Optional[str]
+
+
 class PackageBase(BaseModel):
     """
     PackageBase is a Pydantic model that defines the fields that are
@@ -172,6 +284,37 @@ class PackageCreate(PackageBase):
     pass
 
 
+class PackageAccepted(PackageBase):
+    """
+    PackageAccepted is a Pydantic model that defines a package whose route is being computed in the background.
+    It inherits from PackageBase and adds the id and the status URL:
+
+    Attributes:
+    - id (int): The unique identifier for the package.
+    - status_url (str): The URL of the status of the route of the package.
+    """
+    id: int
+    status_url: str
+
+
+class RouteJobStatus(BaseModel):
+    """
+    RouteJobStatus is a Pydantic model that defines the status of the computation of the route of a package.
+
+    Attributes:
+    - package_id (int): The id of the package.
+    - status (str): "pending", "running", "done" or "failed".
+    - attempts (int): The number of times the route computation was started.
+    - error (Optional[str]): The error of the last attempt, None if it did not fail.
+    - route_url (str): The URL of the package with its route.
+    """
+    package_id: int
+    status: Literal["pending", "running", "done", "failed"]
+    attempts: int
+    error: Optional[str]
+    route_url: str
+
+
 class Package(PackageBase):
     """
     Package is a Pydantic model that defines the fields for a package entity.
@@ -234,6 +377,97 @@ class PackageGetAll:
         self.end_node = end_node
 
 
+class PackageRoutesRequest(BaseModel):
+    """
+    PackageRoutesRequest is a Pydantic model that defines the fields required to get the routes of many packages.
+
+    Attributes:
+    - package_ids (list[int]): The ids of the packages.
+    """
+    package_ids: list[int]
+
+
+class PackageRoute(BaseModel):
+    """
+    PackageRoute is a Pydantic model that defines the route of a package.
+
+    Attributes:
+    - package_id (int): The id of the package.
+    - start_node_id (int): The id of the starting node of the package.
+    - end_node_id (int): The id of the ending node of the package.
+    - path (list[int]): The ids of the nodes of the route, empty if there is no route.
+    - distance (Optional[float]): The distance of the route, None if there is no route.
+    """
+    package_id: int
+    start_node_id: int
+    end_node_id: int
+    path: list[int]
+    distance: Optional[float]
+
+
+class DistanceMatrixRequest(BaseModel):
+    """
+    DistanceMatrixRequest is a Pydantic model that defines the fields required to compute a distance matrix.
+
+    Attributes:
+    - origins (list[int]): The ids of the origin nodes, one row each.
+    - destinations (list[int]): The ids of the destination nodes, one column each.
+    - format (str): "json" for a JSON matrix, or "binary" for a row-major float32 payload.
+    """
+    origins: list[int]
+    destinations: list[int]
+    format: Literal["json", "binary"] = "json"
+
+
+class NodePackageCount(BaseModel):
+    """
+    NodePackageCount is a Pydantic model that defines the number of packages that start or end at a node.
+
+    Attributes:
+    - node_id (int): The id of the node.
+    - name (str): The name of the node.
+    - packages (int): The number of packages.
+    """
+    node_id: int
+    name: str
+    packages: int
+
+
+class NodePackageStatistics(BaseModel):
+    """
+    NodePackageStatistics is a Pydantic model that defines the number of packages that start and end at a node.
+
+    Attributes:
+    - node_id (int): The id of the node.
+    - name (str): The name of the node.
+    - start_packages (int): The number of packages that start at the node.
+    - end_packages (int): The number of packages that end at the node.
+    """
+    node_id: int
+    name: str
+    start_packages: int
+    end_packages: int
+
+
+class PackageTimeBucket(BaseModel):
+    """
+    PackageTimeBucket is a Pydantic model that defines the number of packages that start and end at a node
+    within an hour, day or week.
+
+    Attributes:
+    - bucket (datetime): The start of the hour, day or week.
+    - node_id (int): The id of the node.
+    - name (Optional[str]): The name of the node.
+    - start_packages (int): The number of packages created in the bucket that start at the node.
+    - end_packages (int): The number of packages created in the bucket that end at the node.
+    """
+    bucket: datetime
+    node_id: int
+    name: Optional[str]
+    start_packages: int
+    end_packages: int
+
+
 class User(UserBase):
     """
     User is a Pydantic model that defines the fields for a user entity. It inherits from
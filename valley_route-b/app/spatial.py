@@ -0,0 +1,351 @@
+"""
+This module contains the spatial index of the node coordinates.
+It includes the following:
+- The NearestNodeIndex class, a KD-tree over the nodes on the unit sphere, with a buffer of the newest nodes
+- The process-level node_index instance used by the nearest node endpoints
+- The NodeGrid class, a grid of the node coordinates per zoom level, with the clusters of each cell
+- The process-level node_grid instance used by the viewport endpoint
+"""
+
+# Standard library imports
+import os
+import threading
+from typing import Optional
+
+# Third-party imports
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Local imports (project-specific)
+from app.distance import EARTH_RADIUS
+from app.graph import GraphSnapshot
+
+# Largest number of nearest nodes a client can request per point
+NEAREST_MAX_K = int(os.getenv("NEAREST_MAX_K", "100"))
+
+# Largest number of coordinates of a batch lookup
+NEAREST_MAX_POINTS = int(os.getenv("NEAREST_MAX_POINTS", "1000"))
+
+# Fraction of nodes added after the tree was built that triggers a rebuild
+NEAREST_REBUILD_FRACTION = float(os.getenv("NEAREST_REBUILD_FRACTION", "0.05"))
+
+# Zoom level from which the viewport returns nodes instead of clusters, and most nodes it returns
+NODE_CLUSTER_MAX_ZOOM = int(os.getenv("NODE_CLUSTER_MAX_ZOOM", "12"))
+NODE_BBOX_MAX_NODES = int(os.getenv("NODE_BBOX_MAX_NODES", "5000"))
+
+# Largest number of grid cells a viewport can cover
+NODE_BBOX_MAX_CELLS = int(os.getenv("NODE_BBOX_MAX_CELLS", "65536"))
+
+# Deepest zoom level of the grid, and number of cells across a map tile at every zoom level
+GRID_MAX_ZOOM = 22
+GRID_CELLS_PER_TILE = 8
+
+# Number of new nodes that are always kept in the buffer, and largest number of nodes the buffer can hold
+NEAREST_MIN_PENDING = 256
+NEAREST_MAX_PENDING = 4096
+
+
+def to_unit_vectors(lat, lng):
+    """
+    Converts coordinates to points on the unit sphere, where the straight line distance between two points
+    grows with their great-circle distance, so a KD-tree finds the nearest nodes on the earth.
+
+    Args:
+        lat: (np.ndarray): The latitudes, in degrees.
+        lng: (np.ndarray): The longitudes, in degrees.
+
+    Returns:
+        np.ndarray: One (x, y, z) row per coordinate.
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lng = np.radians(np.asarray(lng, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+
+
+class NearestNodeIndex:
+    """
+    NearestNodeIndex finds the nodes nearest to coordinates. Nodes are only appended to the graph, so the tree
+    covers the first nodes of the graph, and the nodes added after it was built form a small buffer, searched
+    with a tree built for each query. The tree is rebuilt when the buffer grows past a fraction of the tree.
+
+    Attributes:
+    - rebuild_fraction (float): The fraction of new nodes that triggers a rebuild.
+    - size (int): The number of nodes in the tree.
+    """
+
+    def __init__(self, rebuild_fraction: float = NEAREST_REBUILD_FRACTION):
+        """
+        Initialize an empty NearestNodeIndex.
+        Args:
+            rebuild_fraction: (float): The fraction of new nodes that triggers a rebuild.
+
+        Returns: None
+        """
+        self.rebuild_fraction = rebuild_fraction
+        self.size = 0
+        self._tree = None
+        self._lock = threading.Lock()
+
+    def stale(self, graph: GraphSnapshot):
+        """
+        Checks if the tree should be rebuilt before answering queries on a graph snapshot.
+
+        Args:
+            graph: (GraphSnapshot): The graph snapshot.
+
+        Returns:
+            bool: True if the buffer of new nodes is too large, or the graph was reloaded with fewer nodes.
+        """
+        with self._lock:
+            pending = graph.size - self.size
+        return pending < 0 or pending > min(NEAREST_MAX_PENDING, max(NEAREST_MIN_PENDING,
+                                                                      self.rebuild_fraction * self.size))
+
+    def rebuild(self, graph: GraphSnapshot):
+        """
+        Builds the tree with all the nodes of a graph snapshot.
+
+        Args:
+            graph: (GraphSnapshot): The graph snapshot.
+
+        Returns: None
+        """
+        tree = cKDTree(to_unit_vectors(graph.lat, graph.lng)) if graph.size else None
+        with self._lock:
+            self._tree, self.size = tree, graph.size
+
+    def query(self, graph: GraphSnapshot, lat, lng, k: int):
+        """
+        Finds the k nodes nearest to each coordinate.
+
+        Args:
+            graph: (GraphSnapshot): The graph snapshot.
+            lat: (np.ndarray): The latitude of each coordinate.
+            lng: (np.ndarray): The longitude of each coordinate.
+            k: (int): The number of nodes to find for each coordinate.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The great-circle distance in meters and the matrix index of the
+            nearest nodes, one row per coordinate, sorted by distance. When the graph has fewer than k nodes,
+            the rows are padded with infinity and -1.
+        """
+        points = to_unit_vectors(lat, lng)
+        with self._lock:
+            tree, size = self._tree, self.size
+
+        # A tree built from a newer snapshot can not be used with this one
+        if size > graph.size:
+            tree, size = None, 0
+
+        chords, indexes = self._search(tree, points, k, 0)
+
+        # Search the nodes added after the tree was built, and keep the k nearest of both
+        if graph.size > size:
+            pending_tree = cKDTree(to_unit_vectors(graph.lat[size:], graph.lng[size:]))
+            pending_chords, pending_indexes = self._search(pending_tree, points, k, size)
+            chords = np.concatenate((chords, pending_chords), axis=1)
+            indexes = np.concatenate((indexes, pending_indexes), axis=1)
+            order = np.argsort(chords, axis=1, kind="stable")[:, :k]
+            chords = np.take_along_axis(chords, order, axis=1)
+            indexes = np.take_along_axis(indexes, order, axis=1)
+
+        # Convert the straight line distances on the unit sphere to great-circle distances
+        distances = 2 * EARTH_RADIUS * np.arcsin(np.minimum(chords / 2, 1.0))
+
+        # Pad the rows when the graph has fewer than k nodes
+        if distances.shape[1] < k:
+            missing = k - distances.shape[1]
+            distances = np.pad(distances, ((0, 0), (0, missing)), constant_values=np.inf)
+            indexes = np.pad(indexes, ((0, 0), (0, missing)), constant_values=-1)
+        return distances, indexes
+
+    @staticmethod
+    def _search(tree: Optional[cKDTree], points: np.ndarray, k: int, offset: int):
+        """
+        Searches the k nearest points of a tree, as matrices with one row per point, adding an offset to
+        the indexes.
+        """
+        if tree is None:
+            return np.empty((len(points), 0)), np.empty((len(points), 0), dtype=np.int64)
+
+        found = min(k, tree.n)
+        chords, indexes = tree.query(points, k=found)
+        return (np.asarray(chords).reshape(len(points), found),
+                np.asarray(indexes, dtype=np.int64).reshape(len(points), found) + offset)
+
+
+# The spatial index of the process
+node_index = NearestNodeIndex()
+
+
+class ViewportTooLargeError(ValueError):
+    """
+    ViewportTooLargeError is raised when a viewport covers too many cells of the grid of its zoom level.
+    """
+    pass
+
+
+class _GridLevel:
+    """
+    _GridLevel is the grid of one zoom level. The nodes are sorted by the row-major key of their cell, so the
+    cells of each row of a viewport are a contiguous range of the keys, found with a binary search.
+    """
+
+    def __init__(self, graph: GraphSnapshot, zoom: int, clustered: bool):
+        self.columns = GRID_CELLS_PER_TILE << zoom
+        self.rows = self.columns // 2
+        self.cell_size = 360.0 / self.columns
+
+        keys = self.key_of(self.row_of(graph.lat), self.column_of(graph.lng))
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+
+        if clustered:
+            # One cluster per occupied cell, with the number of nodes and the mean of their coordinates
+            self.keys, first, self.counts = np.unique(keys, return_index=True, return_counts=True)
+            self.lat = np.add.reduceat(graph.lat[order], first) / self.counts if len(keys) else np.empty(0)
+            self.lng = np.add.reduceat(graph.lng[order], first) / self.counts if len(keys) else np.empty(0)
+        else:
+            self.keys, self.indexes = keys, order
+
+    def row_of(self, lat):
+        return np.clip(((np.asarray(lat, dtype=np.float64) + 90) // self.cell_size).astype(np.int64),
+                       0, self.rows - 1)
+
+    def column_of(self, lng):
+        return np.clip(((np.asarray(lng, dtype=np.float64) + 180) // self.cell_size).astype(np.int64),
+                       0, self.columns - 1)
+
+    def key_of(self, rows, columns):
+        return rows * self.columns + columns
+
+    def select(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float):
+        """
+        Gets the positions, in the keys, of the cells inside a viewport. When min_lng is greater than max_lng,
+        the viewport crosses the antimeridian.
+        """
+        rows = np.arange(self.row_of(min_lat), self.row_of(max_lat) + 1)
+        if min_lng <= max_lng:
+            column_ranges = [(self.column_of(min_lng), self.column_of(max_lng))]
+        else:
+            column_ranges = [(self.column_of(min_lng), self.columns - 1), (0, self.column_of(max_lng))]
+
+        starts = np.concatenate([np.searchsorted(self.keys, self.key_of(rows, first), side="left")
+                                 for first, _ in column_ranges])
+        stops = np.concatenate([np.searchsorted(self.keys, self.key_of(rows, last), side="right")
+                                for _, last in column_ranges])
+
+        # Join the ranges of the rows into one array of positions
+        lengths = stops - starts
+        offsets = np.cumsum(lengths) - lengths
+        return np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+
+
+class NodeGrid:
+    """
+    NodeGrid divides the map in cells of equal size in degrees, with GRID_CELLS_PER_TILE cells across a map
+    tile, so a cell is 360 / (GRID_CELLS_PER_TILE * 2 ** zoom) degrees wide. The grid of each zoom level is
+    built the first time it is requested and kept until a node is added.
+
+    The grids below NODE_CLUSTER_MAX_ZOOM store one cluster per occupied cell, with its count and centroid.
+    The grid of NODE_CLUSTER_MAX_ZOOM stores the nodes, and answers the viewports of the deeper zoom levels.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty NodeGrid.
+
+        Returns: None
+        """
+        self._levels = {}
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _level(self, graph: GraphSnapshot, zoom: int, clustered: bool):
+        """
+        Gets the grid of a zoom level, building it if the nodes changed since it was built.
+        """
+        with self._lock:
+            if self._size != graph.size:
+                self._levels, self._size = {}, graph.size
+            level = self._levels.get((zoom, clustered))
+        if level is None:
+            level = _GridLevel(graph, zoom, clustered)
+            with self._lock:
+                if self._size == graph.size:
+                    self._levels[(zoom, clustered)] = level
+        return level
+
+    @staticmethod
+    def check_viewport(min_lat: float, min_lng: float, max_lat: float, max_lng: float, zoom: int):
+        """
+        Checks that a viewport does not cover more than NODE_BBOX_MAX_CELLS cells of its zoom level.
+
+        Args:
+            min_lat: (float): The southern edge of the viewport.
+            min_lng: (float): The western edge of the viewport.
+            max_lat: (float): The northern edge of the viewport.
+            max_lng: (float): The eastern edge of the viewport, smaller than min_lng across the antimeridian.
+            zoom: (int): The zoom level.
+
+        Returns: None
+
+        Raises:
+            ViewportTooLargeError: If the viewport covers too many cells.
+        """
+        cell_size = 360.0 / (GRID_CELLS_PER_TILE << zoom)
+        width = max_lng - min_lng if min_lng <= max_lng else 360 - min_lng + max_lng
+        if ((max_lat - min_lat) / cell_size + 1) * (width / cell_size + 1) > NODE_BBOX_MAX_CELLS:
+            raise ViewportTooLargeError("The viewport is too large for its zoom level, use a lower zoom level")
+
+    def clusters(self, graph: GraphSnapshot, min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                 zoom: int):
+        """
+        Gets the clusters of the cells inside a viewport.
+
+        Args:
+            graph: (GraphSnapshot): The graph snapshot.
+            min_lat: (float): The southern edge of the viewport.
+            min_lng: (float): The western edge of the viewport.
+            max_lat: (float): The northern edge of the viewport.
+            max_lng: (float): The eastern edge of the viewport, smaller than min_lng across the antimeridian.
+            zoom: (int): The zoom level.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The latitude and longitude of the centroid, and the
+            number of nodes, of each cluster.
+        """
+        level = self._level(graph, zoom, clustered=True)
+        positions = level.select(min_lat, min_lng, max_lat, max_lng)
+        return level.lat[positions], level.lng[positions], level.counts[positions]
+
+    def nodes(self, graph: GraphSnapshot, min_lat: float, min_lng: float, max_lat: float, max_lng: float):
+        """
+        Gets the nodes inside a viewport.
+
+        Args:
+            graph: (GraphSnapshot): The graph snapshot.
+            min_lat: (float): The southern edge of the viewport.
+            min_lng: (float): The western edge of the viewport.
+            max_lat: (float): The northern edge of the viewport.
+            max_lng: (float): The eastern edge of the viewport, smaller than min_lng across the antimeridian.
+
+        Returns:
+            np.ndarray: The matrix index of each node.
+        """
+        level = self._level(graph, NODE_CLUSTER_MAX_ZOOM, clustered=False)
+        indexes = level.indexes[level.select(min_lat, min_lng, max_lat, max_lng)]
+
+        # The cells on the edges of the viewport are only partly inside it
+        lat, lng = graph.lat[indexes], graph.lng[indexes]
+        inside = (lat >= min_lat) & (lat <= max_lat)
+        if min_lng <= max_lng:
+            inside &= (lng >= min_lng) & (lng <= max_lng)
+        else:
+            inside &= (lng >= min_lng) | (lng <= max_lng)
+        return indexes[inside]
+
+
+# The grid of the process
+node_grid = NodeGrid()